@@ -0,0 +1,126 @@
+"""
+Семантический кэш ответов тенанта.
+
+Попадание — новый запрос, эмбеддинг которого ближе заданного порога (косинус)
+к уже отвеченному запросу с тем же каналом и тем же результатом quality gate.
+Записи привязаны к chunks_version и settings_version: загрузка или удаление PDF,
+смена промпта, модели или форматирования делают их неактуальными.
+
+Включается в ai_settings тенанта: answer_cache_enabled, answer_cache_threshold.
+"""
+import os
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import psycopg2
+
+from embedding_codec import encode_embedding, decode_embedding
+
+ANSWER_CACHE_DEFAULT_THRESHOLD = float(os.environ.get('ANSWER_CACHE_DEFAULT_THRESHOLD', '0.97'))
+ANSWER_CACHE_TTL = int(os.environ.get('ANSWER_CACHE_TTL', str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_CANDIDATES = int(os.environ.get('ANSWER_CACHE_MAX_CANDIDATES', '500'))
+
+
+def answer_cache_settings(ai_settings: Dict) -> Tuple[bool, float]:
+    """(включён, порог косинуса) из ai_settings тенанта"""
+    if not ai_settings:
+        return False, ANSWER_CACHE_DEFAULT_THRESHOLD
+    enabled = ai_settings.get('answer_cache_enabled', False) in (True, 'true', '1', 1)
+    try:
+        threshold = float(ai_settings.get('answer_cache_threshold', ANSWER_CACHE_DEFAULT_THRESHOLD))
+    except (ValueError, TypeError):
+        threshold = ANSWER_CACHE_DEFAULT_THRESHOLD
+    return enabled, min(max(threshold, 0.5), 1.0)
+
+
+def answer_cache_channel(channel: str, is_first_message: bool) -> str:
+    """Первый ответ в звонке содержит приветствие, поэтому кэшируется отдельно"""
+    if channel == 'voice' and is_first_message:
+        return 'voice:first'
+    return channel
+
+
+def lookup_answer(cur, tenant_id: int, chunks_version: int, settings_version: int,
+                  channel: str, context_ok: bool,
+                  query_embedding: Sequence[float], threshold: float) -> Optional[Dict]:
+    """Ближайший закэшированный ответ или None; ошибки БД не ломают транзакцию запроса"""
+    try:
+        cur.execute("SAVEPOINT answer_cache")
+        cur.execute("""
+            SELECT id, answer, embedding_bin, embedding_dim, tokens_used, latency_ms
+            FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+            WHERE tenant_id = %s AND chunks_version = %s AND settings_version = %s
+              AND channel = %s AND context_ok = %s
+              AND created_at > NOW() - make_interval(secs => %s)
+            ORDER BY last_hit_at DESC NULLS LAST, id DESC
+            LIMIT %s
+        """, (tenant_id, chunks_version, settings_version, channel, context_ok,
+              ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_CANDIDATES))
+        rows = cur.fetchall()
+        if not rows:
+            cur.execute("RELEASE SAVEPOINT answer_cache")
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            cur.execute("RELEASE SAVEPOINT answer_cache")
+            return None
+        matrix = np.vstack([decode_embedding(row[2], row[3]) for row in rows])
+        norms = np.linalg.norm(matrix, axis=1)
+        norms[norms == 0] = 1.0
+        sims = (matrix @ query) / (norms * query_norm)
+        best = int(np.argmax(sims))
+        similarity = float(sims[best])
+
+        if similarity < threshold:
+            cur.execute("RELEASE SAVEPOINT answer_cache")
+            return None
+
+        row = rows[best]
+        cur.execute("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.answer_cache
+            SET hits = hits + 1, last_hit_at = NOW()
+            WHERE id = %s
+        """, (row[0],))
+        cur.execute("RELEASE SAVEPOINT answer_cache")
+        return {
+            'id': row[0],
+            'answer': row[1],
+            'similarity': similarity,
+            'saved_tokens': row[4] or 0,
+            'saved_ms': row[5]
+        }
+    except Exception as e:
+        print(f"[answer_cache] lookup error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT answer_cache")
+        return None
+
+
+def store_answer(cur, tenant_id: int, chunks_version: int, settings_version: int,
+                 channel: str, context_ok: bool,
+                 user_message: str, query_embedding: Sequence[float], answer: str,
+                 tokens_used: int, latency_ms: int):
+    try:
+        cur.execute("SAVEPOINT answer_cache")
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.answer_cache
+            (tenant_id, chunks_version, settings_version, channel, context_ok, user_message,
+             embedding_bin, embedding_dim, answer, tokens_used, latency_ms)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (
+            tenant_id, chunks_version, settings_version, channel, context_ok, user_message,
+            psycopg2.Binary(encode_embedding(query_embedding)), len(query_embedding),
+            answer, tokens_used, latency_ms
+        ))
+        # Записи прошлых версий чанков и настроек больше никогда не совпадут
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+            WHERE tenant_id = %s
+              AND (chunks_version <> %s OR settings_version <> %s
+                   OR created_at < NOW() - make_interval(secs => %s))
+        """, (tenant_id, chunks_version, settings_version, ANSWER_CACHE_TTL))
+        cur.execute("RELEASE SAVEPOINT answer_cache")
+    except Exception as e:
+        print(f"[answer_cache] store error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT answer_cache")
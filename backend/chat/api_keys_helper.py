@@ -1,7 +1,7 @@
 """Утилита для работы с API ключами клиентов"""
 import os
 import json
-import psycopg2
+from db_pool import get_connection, release_connection
 
 def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[str | None, dict | None]:
     """
@@ -16,7 +16,7 @@ def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[st
         (key_value, error_response) - либо значение ключа, либо HTTP ошибка
     """
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         print(f"🔑 DEBUG get_tenant_api_key: tenant_id={tenant_id}, provider={provider}, key_name={key_name}")
@@ -45,7 +45,7 @@ def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[st
             print(f"❌ DEBUG: No key found for tenant_id={tenant_id}, provider={provider}, key_name={key_name}")
         
         cur.close()
-        conn.close()
+        release_connection(conn)
         
         if not row:
             # Fallback на секреты проекта для ProxyAPI
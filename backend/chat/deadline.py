@@ -0,0 +1,90 @@
+"""
+Дедлайн запроса chat: сколько времени осталось до того, как вызывающий перестанет ждать.
+
+Бюджет приходит в теле запроса (deadlineMs — таймаут вызывающего: telegram-webhook 60 с,
+voximplant-webhook 30 с) или берётся по каналу. Если платформа сообщает остаток времени
+функции, бюджет ограничивается и им. От остатка зависят таймаут эмбеддинга, допуск
+расширенного top-k, max_tokens и таймаут LLM. Каждый этап проверяет дедлайн через check().
+"""
+import os
+import time
+from typing import Optional
+
+CHAT_DEADLINE_DEFAULT_MS = int(os.environ.get('CHAT_DEADLINE_DEFAULT_MS', '60000'))
+CHANNEL_DEADLINES_MS = {
+    'voice': 30000,
+    'telegram': 60000,
+    'vk': 60000,
+    'max': 60000,
+}
+# Запас на запись в БД, форматирование и доставку ответа вызывающему
+CHAT_DEADLINE_RESERVE_MS = int(os.environ.get('CHAT_DEADLINE_RESERVE_MS', '2000'))
+# Расширенный top-k удлиняет промпт — только если времени достаточно
+CHAT_TOPK_FALLBACK_MIN_MS = int(os.environ.get('CHAT_TOPK_FALLBACK_MIN_MS', '10000'))
+LLM_MIN_TIMEOUT_MS = int(os.environ.get('LLM_MIN_TIMEOUT_MS', '1500'))
+# Скорость генерации для оценки, сколько токенов успеет ответ
+LLM_TOKENS_PER_SECOND = float(os.environ.get('LLM_TOKENS_PER_SECOND', '30'))
+LLM_MIN_MAX_TOKENS = int(os.environ.get('LLM_MIN_MAX_TOKENS', '64'))
+
+
+class DeadlineExceeded(Exception):
+    """Времени на этап не осталось — вызывающий ответа уже не дождётся"""
+
+    def __init__(self, stage: str, remaining_ms: float):
+        super().__init__(f'deadline exceeded before {stage} ({remaining_ms:.0f}ms left)')
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, budget_ms: float):
+        self.budget_ms = budget_ms
+        self.expires_at = time.perf_counter() + budget_ms / 1000
+
+    def remaining_ms(self) -> float:
+        return (self.expires_at - time.perf_counter()) * 1000
+
+    def usable_ms(self) -> float:
+        """Остаток за вычетом запаса на завершение запроса"""
+        return self.remaining_ms() - CHAT_DEADLINE_RESERVE_MS
+
+    def check(self, stage: str, need_ms: float = 0):
+        if self.usable_ms() < need_ms:
+            raise DeadlineExceeded(stage, self.remaining_ms())
+
+    def timeout(self, cap_s: float, reserve_ms: float = 0) -> float:
+        """Таймаут сетевого вызова, с: не больше cap_s и не дольше остатка минус reserve_ms"""
+        return max(0.1, min(cap_s, (self.usable_ms() - reserve_ms) / 1000))
+
+    def allows_topk_fallback(self) -> bool:
+        return self.usable_ms() >= CHAT_TOPK_FALLBACK_MIN_MS
+
+    def llm_timeout(self, cap_s: float) -> float:
+        self.check('llm', LLM_MIN_TIMEOUT_MS)
+        return self.timeout(cap_s)
+
+    def llm_max_tokens(self, configured: int) -> int:
+        """max_tokens, которые успеют сгенерироваться за остаток времени"""
+        affordable = int(self.usable_ms() / 1000 * LLM_TOKENS_PER_SECOND)
+        return max(min(LLM_MIN_MAX_TOKENS, configured), min(configured, affordable))
+
+    def to_dict(self) -> dict:
+        return {'budget_ms': round(self.budget_ms), 'remaining_ms': round(self.remaining_ms())}
+
+
+def request_deadline(body: dict, channel: str, context=None) -> Deadline:
+    """deadlineMs из тела запроса → бюджет канала; не дольше остатка времени функции"""
+    budget_ms: Optional[float] = None
+    try:
+        if body.get('deadlineMs') is not None:
+            budget_ms = float(body['deadlineMs'])
+    except (TypeError, ValueError):
+        budget_ms = None
+    if budget_ms is None or budget_ms <= 0:
+        budget_ms = CHANNEL_DEADLINES_MS.get(channel, CHAT_DEADLINE_DEFAULT_MS)
+
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        try:
+            budget_ms = min(budget_ms, float(context.get_remaining_time_in_millis()))
+        except Exception:
+            pass
+    return Deadline(budget_ms)
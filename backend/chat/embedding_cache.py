@@ -0,0 +1,121 @@
+"""
+LRU-кэш матриц эмбеддингов тенантов, живущий между тёплыми вызовами функции.
+
+Инвалидация — по счётчику tenant_settings.chunks_version, который увеличивают
+process-pdf, delete-pdf и reindex-embeddings. Объём ограничен EMBEDDING_CACHE_MAX_BYTES.
+Вместе с матрицей кэшируются IVF-индекс и лексический (BM25) индекс той же версии.
+"""
+import os
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from retrieval_engine import RetrievalEngine
+from ann_index import ANN_MIN_CHUNKS, load_ann_index
+from lexical_index import PREPROCESS_VERSION, LexicalIndex, load_lexical_index
+
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get('EMBEDDING_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# tenant_id -> (chunks_version, engine)
+_engines: 'OrderedDict[int, Tuple[int, RetrievalEngine]]' = OrderedDict()
+_cache_bytes = 0
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def get_chunks_version(cur, tenant_id: int) -> int:
+    """Текущая версия чанков тенанта (одна дешёвая выборка по PK)"""
+    cur.execute("""
+        SELECT chunks_version FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings
+        WHERE tenant_id = %s
+    """, (tenant_id,))
+    row = cur.fetchone()
+    return int(row[0]) if row and row[0] is not None else 0
+
+
+def _evict(tenant_id: int):
+    global _cache_bytes
+    entry = _engines.pop(tenant_id, None)
+    if entry:
+        _cache_bytes -= entry[1].nbytes
+
+
+def get_cached_engine(tenant_id: int, chunks_version: int) -> Optional[RetrievalEngine]:
+    entry = _engines.get(tenant_id)
+    if entry is None:
+        return None
+    if entry[0] != chunks_version:
+        _evict(tenant_id)
+        return None
+    _engines.move_to_end(tenant_id)
+    return entry[1]
+
+
+def put_engine(tenant_id: int, chunks_version: int, engine: RetrievalEngine):
+    """Кладёт движок в кэш и вытесняет самые старые записи сверх бюджета"""
+    global _cache_bytes
+    _evict(tenant_id)
+
+    size = engine.nbytes
+    if size > EMBEDDING_CACHE_MAX_BYTES:
+        print(f"[embedding_cache] tenant {tenant_id}: {size} bytes exceeds budget {EMBEDDING_CACHE_MAX_BYTES}, not cached")
+        return
+
+    while _engines and _cache_bytes + size > EMBEDDING_CACHE_MAX_BYTES:
+        old_tenant_id, _ = next(iter(_engines.items()))
+        _evict(old_tenant_id)
+        _stats['evictions'] += 1
+
+    _engines[tenant_id] = (chunks_version, engine)
+    _cache_bytes += size
+
+
+def load_tenant_engine(cur, tenant_id: int, chunks_version: int = None) -> RetrievalEngine:
+    """
+    Движок тенанта из кэша, либо из tenant_chunks при смене версии / холодном старте.
+    chunks_version можно передать, если она уже прочитана (TenantContext).
+    """
+    if chunks_version is None:
+        chunks_version = get_chunks_version(cur, tenant_id)
+    engine = get_cached_engine(tenant_id, chunks_version)
+    if engine is not None:
+        _stats['hits'] += 1
+        print(f"[embedding_cache] HIT tenant={tenant_id} version={chunks_version} chunks={len(engine)}")
+        return engine
+
+    _stats['misses'] += 1
+    # embedding_bin (float32) читается без JSON; embedding_text — fallback для строк до бэкфилла.
+    # chunk_clean/chunk_tokens — только посчитанные текущими правилами, иначе chat очистит сам
+    cur.execute("""
+        SELECT id, chunk_text, embedding_bin, embedding_dim,
+               CASE WHEN embedding_bin IS NULL THEN embedding_text END,
+               CASE WHEN preprocess_version = %s THEN chunk_clean END,
+               CASE WHEN preprocess_version = %s THEN chunk_tokens END
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        WHERE tenant_id = %s AND (embedding_bin IS NOT NULL OR embedding_text IS NOT NULL)
+        ORDER BY id
+    """, (PREPROCESS_VERSION, PREPROCESS_VERSION, tenant_id))
+    engine = RetrievalEngine.from_rows(cur.fetchall())
+    engine.chunks_version = chunks_version
+
+    if len(engine) >= ANN_MIN_CHUNKS:
+        ann = load_ann_index(cur, tenant_id, chunks_version)
+        if ann is not None and ann.bind(engine.chunk_ids):
+            engine.ann = ann
+            print(f"[embedding_cache] tenant={tenant_id}: IVF index with {ann.n_lists} lists")
+        else:
+            print(f"[embedding_cache] tenant={tenant_id}: no IVF index for version {chunks_version}, exact search")
+
+    if len(engine):
+        lexical = load_lexical_index(cur, tenant_id, chunks_version, engine.chunk_ids)
+        if lexical is None:
+            # Индекс ещё не построен (чанки до миграции) — строим в памяти по текстам движка
+            print(f"[embedding_cache] tenant={tenant_id}: no lexical index for version {chunks_version}, building in memory")
+            lexical = LexicalIndex.build(engine.chunk_texts, engine.clean_texts)
+        engine.lexical = lexical
+
+    put_engine(tenant_id, chunks_version, engine)
+    print(f"[embedding_cache] MISS tenant={tenant_id} version={chunks_version} chunks={len(engine)} cache_bytes={_cache_bytes}")
+    return engine
+
+
+def cache_stats() -> dict:
+    return {**_stats, 'tenants': len(_engines), 'bytes': _cache_bytes, 'max_bytes': EMBEDDING_CACHE_MAX_BYTES}
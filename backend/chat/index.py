@@ -1,94 +1,37 @@
 import json
 import os
 import sys
-import psycopg2
 import hashlib
-from datetime import datetime, timedelta
-import re
+import time
 
 sys.path.append('/function/code')
 from timezone_helper import now_moscow, moscow_naive
-from api_keys_helper import get_tenant_api_key
-from openrouter_models import get_working_free_model
-from token_logger import log_token_usage
-from system_prompt import DEFAULT_SYSTEM_PROMPT
-from formatting_helper import get_formatting_settings, format_with_settings
+from token_logger import log_token_usage, PRICING, buffered_token_usage
+from formatting_helper import format_with_settings
+from embedding_cache import load_tenant_engine
+from tenant_context import load_tenant_context
+from query_preprocessing import get_query_preprocessor
+from prompt_budget import estimate_tokens, fit_prompt, prompt_budget
+from query_embedding_cache import get_query_embedding, avg_api_latency_ms
+from answer_cache import answer_cache_settings, answer_cache_channel, lookup_answer, store_answer
+from lexical_index import tokenize, detect_lang_simple
+from db_pool import get_connection, release_connection, pool_stats
+from llm_stream import StreamPublisher, stream_events_response
+from llm_providers import call_provider, ProviderConfigError
+from llm_router import route_completion, LLM_HEDGE_AFTER_MS
+from deadline import request_deadline, DeadlineExceeded
+from provider_clients import LLM_REQUEST_TIMEOUT
+from query_embedding_cache import QUERY_EMBEDDING_TIMEOUT
+from pipeline import StageTimer, run_with_cursor
 
 from quality_gate import (
     build_context_with_scores, 
     quality_gate, 
     compose_system,
     rag_debug_log,
-    low_overlap_rate,
-    update_low_overlap_stats,
-    get_tenant_topk,
-    RAG_TOPK_DEFAULT,
-    RAG_TOPK_FALLBACK,
-    RAG_LOW_OVERLAP_THRESHOLD,
-    RAG_LOW_OVERLAP_START_TOPK5
+    get_tenant_topk
 )
-
-
-def parse_proxy(proxy_string: str):
-    """Парсит прокси из формата ip:port@login:pass в dict для httpx"""
-    if not proxy_string or not proxy_string.strip():
-        return None
-    
-    try:
-        # Формат в БД: ip:port@login:pass
-        # Нужный формат: http://login:pass@ip:port
-        if '@' in proxy_string:
-            ip_port, login_pass = proxy_string.split('@', 1)
-            # login_pass это "htHeTxF34:MjMfyEKT4"
-            # ip_port это "172.120.190.64:63478"
-            proxy_url = f'http://{login_pass}@{ip_port}'
-            print(f'DEBUG parse_proxy: input="{proxy_string}" → output="{proxy_url}"')
-        else:
-            proxy_url = f'http://{proxy_string}'
-        
-        return {
-            'http://': proxy_url,
-            'https://': proxy_url
-        }
-    except Exception as e:
-        print(f'Failed to parse proxy: {e}')
-        return None
-
-
-def get_proxy_settings(cur, tenant_id: int) -> dict:
-    """Загружает настройки прокси для DeepSeek, OpenRouter, ProxyAPI и OpenAI"""
-    cur.execute("""
-        SELECT 
-            use_proxy_deepseek, proxy_deepseek,
-            use_proxy_openrouter, proxy_openrouter,
-            use_proxy_proxyapi, proxy_proxyapi,
-            use_proxy_openai, proxy_openai
-        FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings
-        WHERE tenant_id = %s
-    """, (tenant_id,))
-    row = cur.fetchone()
-    
-    if not row:
-        return {}
-    
-    return {
-        'deepseek': {
-            'enabled': row[0] or False,
-            'proxy': parse_proxy(row[1]) if row[0] and row[1] else None
-        },
-        'openrouter': {
-            'enabled': row[2] or False,
-            'proxy': parse_proxy(row[3]) if row[2] and row[3] else None
-        },
-        'proxyapi': {
-            'enabled': row[4] or False,
-            'proxy': parse_proxy(row[5]) if row[4] and row[5] else None
-        },
-        'openai': {
-            'enabled': row[6] or False,
-            'proxy': parse_proxy(row[7]) if row[6] and row[7] else None
-        }
-    }
+from topk_controller import load_topk_state, record_topk_outcome
 
 
 def get_provider_and_api_model(frontend_model: str, frontend_provider: str) -> tuple:
@@ -157,6 +100,7 @@ def get_provider_and_api_model(frontend_model: str, frontend_provider: str) -> t
     
     raise ValueError(f"Model '{frontend_model}' not supported for provider '{frontend_provider}'")
 
+@buffered_token_usage
 def handler(event: dict, context) -> dict:
     """AI чат с поиском в документах или в режиме чистого промпта (Moscow UTC+3)"""
     method = event.get('httpMethod', 'POST')
@@ -166,13 +110,32 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Session-Id'
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Session-Id, Last-Event-ID'
             },
             'body': '',
             'isBase64Encoded': False
         }
 
+    # Потоковый ответ виджету: EventSource читает текст, который пишет POST с тем же streamId
+    if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        stream_id = params.get('stream_id')
+        if not stream_id:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'stream_id required'}),
+                'isBase64Encoded': False
+            }
+        headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            return stream_events_response(cur, stream_id, headers.get('last-event-id') or params.get('offset'))
+        finally:
+            release_connection(conn)
+
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -181,15 +144,19 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
 
+    publisher = None
+    conn = None
     try:
-        from openai import OpenAI
-        
         body = json.loads(event.get('body', '{}'))
         user_message = body.get('message', '')
         session_id = body.get('sessionId', 'default')
         tenant_id = body.get('tenantId')
         tenant_slug = body.get('tenantSlug')
         channel = body.get('channel', 'widget')  # widget, telegram, vk, max
+        # streamId — только для виджета; мессенджеры получают ответ целиком, как раньше
+        stream_id = body.get('streamId') if channel == 'widget' else None
+        # Дедлайн вызывающего (deadlineMs) или канала — от остатка зависят таймауты, top-k и max_tokens
+        deadline = request_deadline(body, channel, context)
         
         # Конвертируем tenant_id в int если он передан
         if tenant_id is not None:
@@ -205,7 +172,8 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        stages = StageTimer()
+        conn = get_connection()
         cur = conn.cursor()
         
         # Если передан slug, получаем tenant_id
@@ -228,39 +196,18 @@ def handler(event: dict, context) -> dict:
         # Обеспечиваем, что tenant_id - это integer
         tenant_id = int(tenant_id)
 
-        # Load proxy settings for AI providers
-        proxy_settings = get_proxy_settings(cur, tenant_id)
-
-        # Загружаем дефолтный промпт из БД
-        cur.execute("""
-            SELECT setting_value 
-            FROM t_p56134400_telegram_ai_bot_pdf.default_settings 
-            WHERE setting_key = 'default_system_prompt'
-        """)
-        default_prompt_row = cur.fetchone()
-        default_prompt_from_db = default_prompt_row[0] if default_prompt_row else DEFAULT_SYSTEM_PROMPT
-        
-        cur.execute("""
-            SELECT ai_settings, embedding_provider, embedding_query_model, quality_gate_settings
-            FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings
-            WHERE tenant_id = %s
-        """, (tenant_id,))
-        settings_row = cur.fetchone()
-        
-        embedding_provider = 'yandex'
-        embedding_model = 'text-search-query'
-        quality_gate_settings = {}
+        # Все настройки тенанта одним запросом (кэш между тёплыми вызовами, сброс по settings_version)
+        with stages.stage('tenant_context'):
+            tenant_ctx = load_tenant_context(cur, tenant_id)
+        proxy_settings = tenant_ctx.proxy_settings
+        default_prompt_from_db = tenant_ctx.default_prompt
         
-        if settings_row:
-            if settings_row[1]:
-                embedding_provider = settings_row[1]
-            if settings_row[2]:
-                embedding_model = settings_row[2]
-            if settings_row[3]:
-                quality_gate_settings = settings_row[3]
+        embedding_provider = tenant_ctx.embedding_provider
+        embedding_model = tenant_ctx.embedding_query_model
+        quality_gate_settings = tenant_ctx.quality_gate_settings
         
         # Получаем tenant-specific RAG top_k из ai_settings, используя get_tenant_topk
-        tenant_overrides = settings_row[0] if (settings_row and settings_row[0]) else {}
+        tenant_overrides = tenant_ctx.ai_settings
         tenant_rag_topk_default, tenant_rag_topk_fallback = get_tenant_topk(tenant_overrides)
         # Принудительная конвертация в int (на случай если где-то осталась строка)
         tenant_rag_topk_default = int(tenant_rag_topk_default)
@@ -270,8 +217,8 @@ def handler(event: dict, context) -> dict:
         enable_pure_prompt_mode = tenant_overrides.get('enable_pure_prompt_mode', False)
         print(f"DEBUG: Tenant {tenant_id} RAG settings: top_k_default={tenant_rag_topk_default}, top_k_fallback={tenant_rag_topk_fallback}, pure_prompt_mode={enable_pure_prompt_mode}")
         
-        if settings_row and settings_row[0]:
-            settings = settings_row[0]
+        if tenant_ctx.ai_settings:
+            settings = tenant_ctx.ai_settings
             
             # Для голосовых звонков используем отдельные настройки модели, если есть
             if channel == 'voice' and settings.get('voice_model') and settings.get('voice_provider'):
@@ -320,6 +267,21 @@ def handler(event: dict, context) -> dict:
             ai_presence_penalty = safe_float(settings.get('presence_penalty'), 0.0)
             ai_max_tokens = safe_int(settings.get('max_tokens'), default_max_tokens)
             
+            # Запасной провайдер/модель на случай ошибок или разомкнутой цепи основного
+            fallback_provider = settings.get('fallback_provider')
+            fallback_model = settings.get('fallback_model')
+            if channel == 'voice' and settings.get('voice_fallback_provider') and settings.get('voice_fallback_model'):
+                fallback_provider = settings.get('voice_fallback_provider')
+                fallback_model = settings.get('voice_fallback_model')
+            fallback_candidate = None
+            if fallback_provider and fallback_model:
+                try:
+                    fallback_api_model, fallback_provider = get_provider_and_api_model(fallback_model, fallback_provider)
+                    fallback_candidate = (fallback_provider, fallback_api_model)
+                except ValueError as e:
+                    print(f"⚠️ Fallback model ignored: {e}")
+            voice_hedge_ms = safe_int(settings.get('voice_hedge_ms'), LLM_HEDGE_AFTER_MS)
+            
             # Приоритет выбора промпта для звонков: voice_system_prompt → system_prompt → default
             # Для чата: system_prompt → default
             voice_system_prompt = settings.get('voice_system_prompt')
@@ -334,128 +296,63 @@ def handler(event: dict, context) -> dict:
                 system_prompt_template = chat_system_prompt or default_prompt_from_db
                 print(f"💬 CHAT: Using {'system_prompt' if chat_system_prompt else 'default_prompt'}")
 
-        # Загружаем историю ДО эмбеддингов для обогащения запроса
-        cur.execute("""
-            SELECT role, content FROM t_p56134400_telegram_ai_bot_pdf.chat_messages 
-            WHERE session_id = %s AND tenant_id = %s
-            ORDER BY created_at DESC
-            LIMIT 10
-        """, (session_id, tenant_id))
-        history_rows = cur.fetchall()
-        history_messages_preview = [{"role": row[0], "content": row[1]} for row in reversed(history_rows)]
-        
-        # Конвертация относительных дат в абсолютные
-        def convert_relative_dates(text):
-            """Конвертирует относительные даты (завтра, послезавтра и т.д.) в абсолютные"""
-            today = now_moscow().date()
-            
-            relative_patterns = {
-                r'(?:на\s+)?завтра': today + timedelta(days=1),
-                r'(?:на\s+)?послезавтра': today + timedelta(days=2),
-                r'через\s+(\d+)\s+(?:день|дня|дней)': lambda m: today + timedelta(days=int(m.group(1))),
-                r'через\s+неделю': today + timedelta(weeks=1),
-                r'через\s+(\d+)\s+(?:неделю|недели|недель)': lambda m: today + timedelta(weeks=int(m.group(1))),
-                r'через\s+месяц': today + timedelta(days=30),
-                r'на\s+следующей\s+неделе': today + timedelta(weeks=1),
-            }
-            
-            months_ru = [
-                'января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
-                'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря'
-            ]
-            
-            converted_text = text
-            for pattern, replacement in relative_patterns.items():
-                match = re.search(pattern, text, re.IGNORECASE)
-                if match:
-                    if callable(replacement):
-                        date_obj = replacement(match)
-                    else:
-                        date_obj = replacement
-                    
-                    day = date_obj.day
-                    month = months_ru[date_obj.month - 1]
-                    date_str = f"{day} {month}"
-                    converted_text = re.sub(pattern, date_str, converted_text, flags=re.IGNORECASE)
-                    print(f"DEBUG: Converted relative date '{match.group()}' to '{date_str}'")
-            
-            return converted_text
-        
-        # Извлекаем даты из истории для обогащения запроса эмбеддинга
-        def extract_date_from_history(history_msgs):
-            """Извлекает упоминания дат из истории для контекста"""
-            date_patterns = [
-                r'\d{1,2}\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)',
-                r'\d{1,2}\.\d{1,2}\.\d{2,4}',
-                r'(январ|феврал|март|апрел|ма|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]{0,2}\s+\d{4}',
-                r'Период:\s*\d{2}\.\d{2}\.\d{4}-\d{2}\.\d{2}\.\d{4}'
-            ]
-            for msg in reversed(history_msgs):  # Проверяем от старых к новым
-                if msg['role'] == 'user':
-                    text = msg['content'].lower()
-                    for pattern in date_patterns:
-                        match = re.search(pattern, text, re.IGNORECASE)
-                        if match:
-                            return match.group()
-            return None
-        
+        # Шаблоны дат скомпилированы один раз на конфигурацию (тенант может добавить свои)
+        preprocessor = get_query_preprocessor(tenant_overrides.get('query_date_patterns'))
+
         # Конвертируем относительные даты в абсолютные в запросе пользователя
         print(f"DEBUG: User message BEFORE conversion: '{user_message}'")
-        user_message_converted = convert_relative_dates(user_message)
+        user_message_converted = preprocessor.convert_relative_dates(user_message)
         print(f"DEBUG: User message AFTER conversion: '{user_message_converted}' (changed: {user_message_converted != user_message})")
         
+        # Запрос без учёта истории известен сразу: история дополняет его только для коротких
+        # сообщений, если в прошлых репликах была дата. Поэтому эмбеддинг считается спекулятивно
+        # и движок тенанта грузится в фоне, пока основной поток читает историю
         # Обогащаем запрос: если указана дата без года, добавляем год и период
-        def enrich_date_query(text):
-            """Добавляет год к датам и преобразует в формат периода для лучшего поиска"""
-            from calendar import monthrange
-            today = now_moscow().date()
-            current_year = today.year
-            next_year = current_year + 1
-            
-            # Паттерн: "12 марта", "8 марта", "15 апреля" и т.д.
-            date_pattern = r'(\d{1,2})\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)'
-            match = re.search(date_pattern, text, re.IGNORECASE)
-            
-            if match:
-                day_str = match.group(1)
-                month_name = match.group(2).lower()
-                
-                months_map = {
-                    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 
-                    'мая': 5, 'июня': 6, 'июля': 7, 'августа': 8,
-                    'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12
-                }
-                
-                if month_name in months_map:
-                    month_num = months_map[month_name]
-                    
-                    # Если месяц уже прошёл в текущем году, берём следующий год
-                    if month_num < today.month or (month_num == today.month and int(day_str) < today.day):
-                        year = next_year
-                    else:
-                        year = current_year
-                    
-                    # Формат ТОЧНО как в документах: "Период: 01.03.2026-31.03.2026"
-                    # Определяем последний день месяца
-                    last_day = monthrange(year, month_num)[1]
-                    period_str = f"Период: 01.{month_num:02d}.{year}-{last_day:02d}.{month_num:02d}.{year}"
-                    
-                    # Добавляем также дату в формате "12.03.2026" для лучшего матчинга
-                    date_str = f"{day_str}.{month_num:02d}.{year}"
-                    
-                    enriched = f"{text} {period_str} {date_str}"
-                    print(f"DEBUG: Enriched date query: '{text}' → '{enriched}'")
-                    return enriched
-            
-            return text
-        
-        context_date = extract_date_from_history(history_messages_preview)
-        enriched_query = enrich_date_query(user_message_converted)
+        speculative_query = preprocessor.enrich_date_query(user_message_converted)
+        embedding_future = None
+        engine_future = None
+        embedding_model_uri = None
+        if not enable_pure_prompt_mode:
+            engine_future = stages.submit('engine', run_with_cursor, load_tenant_engine, tenant_id, tenant_ctx.chunks_version)
+            if embedding_provider == 'yandex':
+                # ВСЕГДА используем PROJECT секреты для эмбеддингов (не tenant ключи!)
+                yandex_api_key = os.environ.get('YANDEXGPT_API_KEY')
+                yandex_folder_id = os.environ.get('YANDEXGPT_FOLDER_ID')
+                if yandex_api_key and yandex_folder_id:
+                    embedding_model_uri = f'emb://{yandex_folder_id}/text-search-query/latest'
+                    embedding_future = stages.submit(
+                        'embedding', run_with_cursor, get_query_embedding,
+                        embedding_model_uri, speculative_query, yandex_api_key,
+                        timeout=deadline.timeout(QUERY_EMBEDDING_TIMEOUT)
+                    )
+
+        deadline.check('history')
+        with stages.stage('history'):
+            cur.execute("""
+                SELECT role, content FROM t_p56134400_telegram_ai_bot_pdf.chat_messages 
+                WHERE session_id = %s AND tenant_id = %s
+                ORDER BY created_at DESC
+                LIMIT 10
+            """, (session_id, tenant_id))
+            history_rows = cur.fetchall()
+        history_messages_preview = [{"role": row[0], "content": row[1]} for row in reversed(history_rows)]
+
+        enriched_query = speculative_query
         
-        if context_date and len(user_message_converted.split()) <= 3:  # Обогащаем только короткие запросы
+        if len(user_message_converted.split()) <= 3:  # Обогащаем только короткие запросы
+            context_date = preprocessor.extract_date_from_history(history_messages_preview)
+        else:
+            context_date = None
+        if context_date:
             enriched_query = f"{enriched_query} {context_date}"
             print(f"DEBUG: Enriched query for embedding: '{enriched_query}' (original: '{user_message_converted}'")
 
+        # Эмбеддинг запроса и версия чанков нужны также семантическому кэшу ответов
+        query_embedding = None
+        chunks_version = None
+        # (стартовый top-k, нужен ли был расширенный) — для topk_controller
+        topk_outcome = None
+
         # Если включен режим Pure Prompt Mode - ПОЛНОСТЬЮ пропускаем RAG
         if enable_pure_prompt_mode:
             print(f"✅ Pure Prompt Mode enabled for tenant {tenant_id}, skipping RAG entirely")
@@ -466,14 +363,10 @@ def handler(event: dict, context) -> dict:
             gate_debug = {'mode': 'pure_prompt'}
         else:
             # Обычный режим: поиск по эмбеддингам и RAG
+            deadline.check('retrieval')
             try:
                 if embedding_provider == 'yandex':
-                    import requests
-                    # ВСЕГДА используем PROJECT секреты для эмбеддингов (не tenant ключи!)
-                    yandex_api_key = os.environ.get('YANDEXGPT_API_KEY')
-                    yandex_folder_id = os.environ.get('YANDEXGPT_FOLDER_ID')
-                    
-                    if not yandex_api_key or not yandex_folder_id:
+                    if embedding_model_uri is None:
                         return {
                             'statusCode': 500,
                             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -481,42 +374,58 @@ def handler(event: dict, context) -> dict:
                             'isBase64Encoded': False
                         }
                     
-                    print(f"🚀 SENDING TO YANDEX (PROJECT keys): api_key={yandex_api_key[:10]}..., folder_id={yandex_folder_id}")
-                    
-                    emb_response = requests.post(
-                        'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding',
-                        headers={
-                            'Authorization': f'Api-Key {yandex_api_key}',
-                            'Content-Type': 'application/json'
-                        },
-                        json={
-                            'modelUri': f'emb://{yandex_folder_id}/text-search-query/latest',
-                            'text': enriched_query  # Используем обогащённый запрос вместо user_message
-                        }
-                    )
-                    
-                    if emb_response.status_code != 200:
-                        print(f"Yandex Embedding API error: {emb_response.status_code}, {emb_response.text}")
-                        raise Exception(f"Yandex API returned {emb_response.status_code}: {emb_response.text}")
-                    
-                    emb_data = emb_response.json()
-                    print(f"DEBUG: Yandex embedding response keys: {emb_data.keys()}")
-                    
-                    if 'embedding' not in emb_data:
-                        print(f"ERROR: No 'embedding' in response: {emb_data}")
-                        raise Exception(f"Yandex API response missing 'embedding': {emb_data}")
-                    
-                    query_embedding = emb_data['embedding']
+                    # Используем обогащённый запрос вместо user_message; повторы берутся из кэша
+                    if enriched_query == speculative_query:
+                        query_embedding, embedding_source, embedding_latency_ms = stages.wait('embedding', embedding_future)
+                    else:
+                        # Дата из истории изменила запрос — спекулятивный вектор не подходит,
+                        # но если он стоил вызова API, токены всё равно учитываем
+                        def log_speculative_embedding(future):
+                            if future.exception() is None and future.result()[1] == 'api':
+                                log_token_usage(
+                                    tenant_id=tenant_id,
+                                    operation_type='embedding_query',
+                                    model='text-search-query',
+                                    tokens_used=min(len(user_message) // 4, 256),
+                                    request_id=session_id,
+                                    metadata={'speculative': True}
+                                )
+                        embedding_future.add_done_callback(log_speculative_embedding)
+                        with stages.stage('embedding_retry'):
+                            query_embedding, embedding_source, embedding_latency_ms = get_query_embedding(
+                                cur, embedding_model_uri, enriched_query, yandex_api_key,
+                                timeout=deadline.timeout(QUERY_EMBEDDING_TIMEOUT)
+                            )
+                    print(f"🚀 QUERY EMBEDDING: source={embedding_source}, latency={embedding_latency_ms:.0f}ms")
                     
                     # Логируем использование токенов для запроса (примерно по количеству символов)
                     tokens_estimate = min(len(user_message) // 4, 256)
-                    log_token_usage(
-                        tenant_id=tenant_id,
-                        operation_type='embedding_query',
-                        model='text-search-query',
-                        tokens_used=tokens_estimate,
-                        request_id=session_id
-                    )
+                    if embedding_source == 'api':
+                        log_token_usage(
+                            tenant_id=tenant_id,
+                            operation_type='embedding_query',
+                            model='text-search-query',
+                            tokens_used=tokens_estimate,
+                            request_id=session_id,
+                            metadata={'latency_ms': round(embedding_latency_ms)}
+                        )
+                    else:
+                        # Попадание в кэш: токены не потрачены, фиксируем сэкономленное
+                        api_latency_ms = avg_api_latency_ms()
+                        log_token_usage(
+                            tenant_id=tenant_id,
+                            operation_type='embedding_query_cache_hit',
+                            model='text-search-query',
+                            tokens_used=0,
+                            request_id=session_id,
+                            metadata={
+                                'cache': embedding_source,
+                                'saved_tokens': tokens_estimate,
+                                'saved_cost_rubles': (tokens_estimate / 1000.0) * PRICING.get('text-search-query', 0),
+                                'latency_ms': round(embedding_latency_ms, 1),
+                                'saved_ms': round(api_latency_ms - embedding_latency_ms) if api_latency_ms else None
+                            }
+                        )
                 else:
                     return {
                         'statusCode': 400,
@@ -525,46 +434,40 @@ def handler(event: dict, context) -> dict:
                         'isBase64Encoded': False
                     }
                 
-                query_embedding_json = json.dumps(query_embedding)
+                # Матрица эмбеддингов из кэша тёплого контейнера (проверка chunks_version — один запрос)
+                engine = stages.wait('engine', engine_future)
+                chunks_version = engine.chunks_version
 
-                cur.execute("""
-                    SELECT chunk_text, embedding_text FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks 
-                    WHERE tenant_id = %s AND embedding_text IS NOT NULL
-                """, (tenant_id,))
-                all_chunks = cur.fetchall()
-
-                if all_chunks:
-                    def cosine_similarity(vec1, vec2):
-                        import math
-                        dot_product = sum(a * b for a, b in zip(vec1, vec2))
-                        magnitude1 = math.sqrt(sum(a * a for a in vec1))
-                        magnitude2 = math.sqrt(sum(b * b for b in vec2))
-                        if magnitude1 == 0 or magnitude2 == 0:
-                            return 0
-                        return dot_product / (magnitude1 * magnitude2)
-
-                    scored_chunks = []
-                    for chunk_text, embedding_text in all_chunks:
-                        chunk_embedding = json.loads(embedding_text)
-                        similarity = cosine_similarity(query_embedding, chunk_embedding)
-                        scored_chunks.append((chunk_text, similarity))
-                    
-                    scored_chunks.sort(key=lambda x: x[1], reverse=True)
+                if len(engine):
+                    candidates_k = max(tenant_rag_topk_default, tenant_rag_topk_fallback)
+                    # Один отбор кандидатов обслуживает обе попытки quality gate (префиксы);
+                    # BM25 по лексическому индексу дополняет векторный поиск точными совпадениями
+                    query_tokens = tokenize(enriched_query, detect_lang_simple(enriched_query))
+                    with stages.stage('retrieval'):
+                        retrieval = engine.retrieve(query_embedding, candidates_k, query_tokens=query_tokens)
                     print(f"DEBUG: Top {tenant_rag_topk_default} chunks for query '{user_message}':")
-                    for i, (chunk, sim) in enumerate(scored_chunks[:tenant_rag_topk_default]):
+                    for i, (chunk, sim) in enumerate(retrieval.scored(tenant_rag_topk_default)):
                         print(f"  {i+1}. Similarity: {sim:.4f}, Text: {chunk[:200]}...")
 
                     request_id = context.request_id if hasattr(context, 'request_id') else 'unknown'
                     query_hash = hashlib.sha256(user_message.encode()).hexdigest()[:12]
                     
-                    overlap_rate = low_overlap_rate()
-                    start_top_k = tenant_rag_topk_fallback if (RAG_LOW_OVERLAP_START_TOPK5 and overlap_rate >= RAG_LOW_OVERLAP_THRESHOLD) else tenant_rag_topk_default
+                    # Стартовый top-k — по доле вторых проходов у этого тенанта
+                    topk_state = load_topk_state(cur, tenant_id, tenant_rag_topk_default)
+                    # Расширенный top-k удлиняет промпт: при малом остатке времени остаёмся на базовом
+                    topk_fallback_allowed = deadline.allows_topk_fallback()
+                    if not topk_fallback_allowed:
+                        print(f"⏱️ DEADLINE: {deadline.remaining_ms():.0f}ms left, top-k fallback disabled")
+                    start_top_k = topk_state.start_top_k(tenant_rag_topk_default, tenant_rag_topk_fallback, topk_fallback_allowed)
                     
-                    context_str, sims = build_context_with_scores(scored_chunks, top_k=start_top_k)
-                    context_ok, gate_reason, gate_debug = quality_gate(user_message, context_str, sims, quality_gate_settings)
+                    context_str, sims = build_context_with_scores(retrieval, top_k=start_top_k)
+                    context_ok, gate_reason, gate_debug = quality_gate(user_message, context_str, sims, quality_gate_settings,
+                                                                        context_tokens=retrieval.context_tokens(start_top_k))
                     
                     gate_debug['top_k_used'] = start_top_k
-                    gate_debug['overlap_rate'] = overlap_rate
+                    gate_debug['start_top_k'] = start_top_k
+                    gate_debug['topk_controller'] = topk_state.to_dict()
+                    needed_fallback = 'low_overlap' in gate_reason
                     
                     rag_debug_log({
                         'event': 'rag_gate',
@@ -578,12 +481,14 @@ def handler(event: dict, context) -> dict:
                         'metrics': gate_debug
                     })
                     
-                    if 'low_overlap' in gate_reason and start_top_k < tenant_rag_topk_fallback:
-                        context2, sims2 = build_context_with_scores(scored_chunks, top_k=tenant_rag_topk_fallback)
-                        context_ok2, gate_reason2, gate_debug2 = quality_gate(user_message, context2, sims2, quality_gate_settings)
+                    if 'low_overlap' in gate_reason and start_top_k < tenant_rag_topk_fallback and topk_fallback_allowed:
+                        context2, sims2 = build_context_with_scores(retrieval, top_k=tenant_rag_topk_fallback)
+                        context_ok2, gate_reason2, gate_debug2 = quality_gate(user_message, context2, sims2, quality_gate_settings,
+                                                                               context_tokens=retrieval.context_tokens(tenant_rag_topk_fallback))
                         
                         gate_debug2['top_k_used'] = tenant_rag_topk_fallback
-                        gate_debug2['overlap_rate'] = overlap_rate
+                        gate_debug2['start_top_k'] = start_top_k
+                        gate_debug2['topk_controller'] = topk_state.to_dict()
                         
                         rag_debug_log({
                             'event': 'rag_gate_fallback',
@@ -591,7 +496,7 @@ def handler(event: dict, context) -> dict:
                             'query_hash': query_hash,
                             'timestamp': now_moscow().isoformat(),
                             'attempt': 2,
-                            'top_k': RAG_TOPK_FALLBACK,
+                            'top_k': tenant_rag_topk_fallback,
                             'ok': context_ok2,
                             'reason': gate_reason2,
                             'metrics': gate_debug2
@@ -603,7 +508,7 @@ def handler(event: dict, context) -> dict:
                         gate_reason = gate_reason2
                         gate_debug = gate_debug2
                     
-                    update_low_overlap_stats('low_overlap' in gate_reason)
+                    topk_outcome = (start_top_k, needed_fallback)
                 else:
                     # Если нет chunks - проверяем режим pure_prompt
                     context_str = ""
@@ -622,7 +527,7 @@ def handler(event: dict, context) -> dict:
             except Exception as emb_error:
                 print(f"Embedding search error: {emb_error}")
                 cur.execute("""
-                    SELECT chunk_text FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks 
+                    SELECT COALESCE(chunk_clean, chunk_text) FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks 
                     WHERE tenant_id = %s
                     ORDER BY id DESC 
                     LIMIT 3
@@ -637,14 +542,9 @@ def handler(event: dict, context) -> dict:
         # Проверяем, первое ли это сообщение в голосовом диалоге (ДО добавления в БД!)
         is_first_message = True
         if channel == 'voice':
-            # Для голосовых звонков проверяем историю ДО добавления текущего сообщения
-            cur.execute("""
-                SELECT COUNT(*) FROM t_p56134400_telegram_ai_bot_pdf.chat_messages
-                WHERE session_id = %s AND tenant_id = %s
-            """, (session_id, tenant_id))
-            msg_count = cur.fetchone()[0]
-            is_first_message = (msg_count == 0)
-            print(f"🎙️ VOICE: is_first_message={is_first_message}, message_count_before_insert={msg_count}")
+            # История уже загружена по тем же session_id/tenant_id — отдельный COUNT(*) не нужен
+            is_first_message = not history_rows
+            print(f"🎙️ VOICE: is_first_message={is_first_message}, history_before_insert={len(history_rows)}")
 
         cur.execute("""
             INSERT INTO t_p56134400_telegram_ai_bot_pdf.chat_messages (session_id, role, content, tenant_id)
@@ -654,8 +554,8 @@ def handler(event: dict, context) -> dict:
         cur.execute("""
             INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_quality_gate_logs 
             (tenant_id, user_message, context_ok, gate_reason, query_type, lang, 
-             best_similarity, context_len, overlap, key_tokens, top_k_used)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+             best_similarity, context_len, overlap, key_tokens, top_k_used, start_top_k)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """, (
             tenant_id,
             user_message,
@@ -667,8 +567,11 @@ def handler(event: dict, context) -> dict:
             gate_debug.get('context_len'),
             gate_debug.get('overlap'),
             gate_debug.get('key_tokens'),
-            gate_debug.get('top_k_used')
+            gate_debug.get('top_k_used'),
+            gate_debug.get('start_top_k')
         ))
+        if topk_outcome is not None:
+            record_topk_outcome(cur, tenant_id, topk_outcome[0], tenant_rag_topk_default, topk_outcome[1])
         conn.commit()
         
         # Используем ранее загруженную историю (history_messages_preview)
@@ -681,269 +584,131 @@ def handler(event: dict, context) -> dict:
         if not context_ok:
             print(f"⚠️ Quality gate failed ({gate_reason}), history disabled for this request")
 
-        if ai_provider == 'yandex':
-            yandex_api_key, error = get_tenant_api_key(tenant_id, 'yandex', 'api_key')
-            if error:
-                return error
-            
-            yandex_folder_id, error = get_tenant_api_key(tenant_id, 'yandex', 'folder_id')
-            if error:
-                return error
-            
-            import requests
-            yandex_messages = [{"role": "system", "text": system_prompt}]
-            
-            # Добавляем историю сообщений (только если context_ok=True)
-            for msg in history_to_use:
-                yandex_messages.append({
-                    "role": "user" if msg["role"] == "user" else "assistant",
-                    "text": msg["content"]
-                })
-            
-            # Добавляем текущее сообщение
-            yandex_messages.append({"role": "user", "text": user_message_converted})
-            
-            payload = {
-                "modelUri": f"gpt://{yandex_folder_id}/{chat_api_model}",
-                "completionOptions": {
-                    "temperature": ai_temperature,
-                    "maxTokens": str(ai_max_tokens)
-                },
-                "messages": yandex_messages
-            }
-            
-            yandex_response = requests.post(
-                'https://llm.api.cloud.yandex.net/foundationModels/v1/completion',
-                headers={
-                    'Authorization': f'Api-Key {yandex_api_key}',
-                    'Content-Type': 'application/json'
-                },
-                json=payload
+        # Бюджет токенов промпта: при превышении уходят старая история и чанки с наименьшим рангом
+        with stages.stage('prompt_budget'):
+            context_parts = context_str.split("\n\n") if (context_ok and context_str) else []
+            prompt_plan = fit_prompt(
+                estimate_tokens(system_prompt) - (estimate_tokens(context_str) if context_parts else 0),
+                context_parts, history_to_use, user_message_converted,
+                prompt_budget(tenant_overrides, channel)
             )
-            
-            if yandex_response.status_code != 200:
-                return {
-                    'statusCode': 500,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': f'Yandex API error: {yandex_response.text}'}),
-                    'isBase64Encoded': False
-                }
-            
-            yandex_data = yandex_response.json()
-            assistant_message = yandex_data['result']['alternatives'][0]['message']['text']
-            
-            # Логируем использование токенов
-            usage_data = yandex_data.get('result', {}).get('usage', {})
-            total_tokens = int(usage_data.get('totalTokens', 0))
-            if total_tokens > 0:
-                log_token_usage(
-                    tenant_id=tenant_id,
-                    operation_type='gpt_response',
-                    model=chat_api_model,
-                    tokens_used=total_tokens,
-                    request_id=session_id,
-                    metadata={'provider': 'yandex'}
-                )
-        elif ai_provider == 'openrouter':
-            openrouter_key, error = get_tenant_api_key(tenant_id, 'openrouter', 'api_key')
-            if error:
-                return error
-            
-            is_free_model = chat_api_model.endswith(':free')
-            
-            if is_free_model:
-                try:
-                    working_model = get_working_free_model(chat_api_model)
-                    print(f"✅ OpenRouter бесплатная модель доступна: {chat_api_model}")
-                except Exception as model_error:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': f'Модель недоступна: {str(model_error)}'}),
-                        'isBase64Encoded': False
-                    }
-            else:
-                # Платные модели используем напрямую
-                working_model = chat_api_model
-                print(f"💰 OpenRouter платная модель: {chat_api_model}")
-            
-            # Setup proxy for OpenRouter if enabled
-            openrouter_http_client = None
-            if proxy_settings.get('openrouter', {}).get('enabled') and proxy_settings['openrouter'].get('proxy'):
-                import httpx
-                openrouter_http_client = httpx.Client(proxies=proxy_settings['openrouter']['proxy'])
-                print(f"[chat] Using proxy for OpenRouter: {list(proxy_settings['openrouter']['proxy'].values())[0][:50]}...")
-            
-            chat_client = OpenAI(
-                api_key=openrouter_key,
-                base_url="https://openrouter.ai/api/v1",
-                http_client=openrouter_http_client
-            )
-            openrouter_messages = [{"role": "system", "content": system_prompt}]
-            for msg in history_to_use:
-                openrouter_messages.append({"role": msg["role"], "content": msg["content"]})
-            openrouter_messages.append({"role": "user", "content": user_message_converted})
-            
-            response = chat_client.chat.completions.create(
-                model=working_model,
-                messages=openrouter_messages,
-                temperature=ai_temperature,
-                top_p=ai_top_p,
-                frequency_penalty=ai_frequency_penalty,
-                presence_penalty=ai_presence_penalty,
-                max_tokens=ai_max_tokens
-            )
-            assistant_message = response.choices[0].message.content
-            
-            # Логируем использование токенов
-            if hasattr(response, 'usage') and response.usage:
-                log_token_usage(
-                    tenant_id=tenant_id,
-                    operation_type='gpt_response',
-                    model=working_model,
-                    tokens_used=response.usage.total_tokens,
-                    request_id=session_id,
-                    metadata={'provider': 'openrouter'}
-                )
-        elif ai_provider == 'deepseek':
-            deepseek_key, error = get_tenant_api_key(tenant_id, 'deepseek', 'api_key')
-            if error:
-                return error
-            
-            # Setup proxy for DeepSeek if enabled
-            deepseek_http_client = None
-            if proxy_settings.get('deepseek', {}).get('enabled') and proxy_settings['deepseek'].get('proxy'):
-                import httpx
-                deepseek_http_client = httpx.Client(proxies=proxy_settings['deepseek']['proxy'])
-                print(f"[chat] Using proxy for DeepSeek: {list(proxy_settings['deepseek']['proxy'].values())[0][:50]}...")
-            
-            chat_client = OpenAI(
-                api_key=deepseek_key,
-                base_url="https://api.deepseek.com",
-                http_client=deepseek_http_client
+            if prompt_plan.trimmed:
+                history_to_use = prompt_plan.history
+                if prompt_plan.chunks_dropped:
+                    system_prompt = compose_system(system_prompt_template, "\n\n".join(prompt_plan.context_parts), context_ok,
+                                                   channel=channel, is_first_message=is_first_message)
+                print(f"✂️ PROMPT BUDGET: {prompt_plan.tokens_before} → {prompt_plan.tokens_after} tokens (budget {prompt_plan.budget}), "
+                      f"chunks -{prompt_plan.chunks_dropped}, history -{prompt_plan.history_dropped}")
+
+        # Семантический кэш ответов: похожий вопрос с тем же каналом и исходом gate
+        answer_cache_enabled, answer_cache_threshold = answer_cache_settings(tenant_overrides)
+        cache_channel = answer_cache_channel(channel, is_first_message)
+        use_answer_cache = answer_cache_enabled and query_embedding is not None and chunks_version is not None
+        cached_answer = None
+        if use_answer_cache:
+            cached_answer = lookup_answer(
+                cur, tenant_id, chunks_version, tenant_ctx.settings_version, cache_channel, context_ok,
+                query_embedding, answer_cache_threshold
             )
-            deepseek_messages = [{"role": "system", "content": system_prompt}]
-            for msg in history_to_use:
-                deepseek_messages.append({"role": msg["role"], "content": msg["content"]})
-            deepseek_messages.append({"role": "user", "content": user_message_converted})
-            
-            response = chat_client.chat.completions.create(
+        llm_started = time.perf_counter()
+        llm_tokens_used = 0
+        if stream_id:
+            publisher = StreamPublisher(stream_id, tenant_id, session_id)
+
+        if cached_answer:
+            assistant_message = cached_answer['answer']
+            print(f"♻️ ANSWER CACHE HIT: id={cached_answer['id']}, similarity={cached_answer['similarity']:.4f}")
+            log_token_usage(
+                tenant_id=tenant_id,
+                operation_type='answer_cache_hit',
                 model=chat_api_model,
-                messages=deepseek_messages,
-                temperature=ai_temperature,
-                top_p=ai_top_p,
-                frequency_penalty=ai_frequency_penalty,
-                presence_penalty=ai_presence_penalty,
-                max_tokens=ai_max_tokens
+                tokens_used=0,
+                request_id=session_id,
+                metadata={
+                    'provider': ai_provider,
+                    'channel': channel,
+                    'similarity': round(cached_answer['similarity'], 4),
+                    'saved_tokens': cached_answer['saved_tokens'],
+                    'saved_ms': cached_answer['saved_ms']
+                }
             )
-            assistant_message = response.choices[0].message.content
-            
-            # Логируем использование токенов
-            if hasattr(response, 'usage') and response.usage:
-                log_token_usage(
-                    tenant_id=tenant_id,
-                    operation_type='gpt_response',
-                    model=chat_api_model,
-                    tokens_used=response.usage.total_tokens,
-                    request_id=session_id,
-                    metadata={'provider': 'deepseek'}
+        else:
+            # Основной провайдер, затем запасной из ai_settings; для голоса — хедж по бюджету задержки
+            candidates = [(ai_provider, chat_api_model)]
+            if fallback_candidate:
+                candidates.append(fallback_candidate)
+            llm_params = {
+                'temperature': ai_temperature,
+                'top_p': ai_top_p,
+                'frequency_penalty': ai_frequency_penalty,
+                'presence_penalty': ai_presence_penalty,
+                'max_tokens': ai_max_tokens
+            }
+
+            def call_llm(provider, api_model):
+                # Таймаут и max_tokens — по остатку времени на момент попытки (запасной получает меньше)
+                timeout = deadline.llm_timeout(LLM_REQUEST_TIMEOUT)
+                params = {**llm_params, 'max_tokens': deadline.llm_max_tokens(llm_params['max_tokens'])}
+                if params['max_tokens'] < llm_params['max_tokens']:
+                    print(f"⏱️ DEADLINE: max_tokens {llm_params['max_tokens']} → {params['max_tokens']}, timeout={timeout:.1f}s")
+                return call_provider(
+                    tenant_ctx, provider, api_model, system_prompt, history_to_use,
+                    user_message_converted, params, publisher, timeout=timeout
                 )
-        elif ai_provider == 'proxyapi':
-            proxyapi_key, error = get_tenant_api_key(tenant_id, 'proxyapi', 'api_key')
-            if error:
-                return error
-            # Setup proxy for ProxyAPI if enabled
-            proxyapi_http_client = None
-            if proxy_settings.get('proxyapi', {}).get('enabled') and proxy_settings['proxyapi'].get('proxy'):
-                import httpx
-                proxyapi_http_client = httpx.Client(proxies=proxy_settings['proxyapi']['proxy'])
-                print(f"[chat] Using proxy for ProxyAPI: {list(proxy_settings['proxyapi']['proxy'].values())[0][:50]}...")
-            
-            chat_client = OpenAI(
-                api_key=proxyapi_key,
-                base_url="https://api.proxyapi.ru/openai/v1",
-                http_client=proxyapi_http_client
-            )
-            proxyapi_messages = [{"role": "system", "content": system_prompt}]
-            for msg in history_to_use:
-                proxyapi_messages.append({"role": msg["role"], "content": msg["content"]})
-            proxyapi_messages.append({"role": "user", "content": user_message_converted})
-            
-            response = chat_client.chat.completions.create(
-                model=chat_api_model,
-                messages=proxyapi_messages,
-                temperature=ai_temperature,
-                top_p=ai_top_p,
-                frequency_penalty=ai_frequency_penalty,
-                presence_penalty=ai_presence_penalty,
-                max_tokens=ai_max_tokens
-            )
-            assistant_message = response.choices[0].message.content
-            
-            # Логируем использование токенов
-            if hasattr(response, 'usage') and response.usage:
-                log_token_usage(
-                    tenant_id=tenant_id,
-                    operation_type='gpt_response',
-                    model=chat_api_model,
-                    tokens_used=response.usage.total_tokens,
-                    request_id=session_id,
-                    metadata={'provider': 'proxyapi'}
+
+            def log_abandoned(result):
+                # Ответ хеджа, пришедший вторым, не используется, но токены потрачены
+                if result.total_tokens:
+                    log_token_usage(
+                        tenant_id=tenant_id,
+                        operation_type='gpt_response',
+                        model=result.model,
+                        tokens_used=result.total_tokens,
+                        request_id=session_id,
+                        metadata={'provider': result.provider, 'hedge': 'abandoned'}
+                    )
+
+            try:
+                llm_result, llm_attempts = route_completion(
+                    candidates,
+                    call_llm,
+                    hedge_after_ms=voice_hedge_ms if channel == 'voice' and publisher is None else None,
+                    on_abandoned=log_abandoned,
+                    before_retry=publisher.reset if publisher else None
                 )
-        elif ai_provider == 'openai':
-            openai_key, error = get_tenant_api_key(tenant_id, 'openai', 'OPENAI_API_KEY')
-            if error:
-                return error
-            
-            # Setup proxy for OpenAI if enabled
-            openai_http_client = None
-            if proxy_settings.get('openai', {}).get('enabled') and proxy_settings['openai'].get('proxy'):
-                import httpx
-                proxy_url = proxy_settings['openai']['proxy']['http://']
-                print(f"[chat] Using proxy for OpenAI: {proxy_url[:50]}...")
-                openai_http_client = httpx.Client(proxies={
-                    'http://': proxy_url,
-                    'https://': proxy_url
-                })
-            
-            chat_client = OpenAI(
-                api_key=openai_key,
-                base_url="https://api.openai.com/v1",
-                http_client=openai_http_client
-            )
-            openai_messages = [{"role": "system", "content": system_prompt}]
-            for msg in history_to_use:
-                openai_messages.append({"role": msg["role"], "content": msg["content"]})
-            openai_messages.append({"role": "user", "content": user_message_converted})
-            
-            response = chat_client.chat.completions.create(
-                model=chat_api_model,
-                messages=openai_messages,
-                temperature=ai_temperature,
-                top_p=ai_top_p,
-                frequency_penalty=ai_frequency_penalty,
-                presence_penalty=ai_presence_penalty,
-                max_tokens=ai_max_tokens
-            )
-            assistant_message = response.choices[0].message.content
+            except ProviderConfigError as config_error:
+                # Виджет ждёт done=true, а соединение потока должно вернуться в пул
+                if publisher:
+                    try:
+                        publisher.finish(error=str(config_error))
+                    except Exception as stream_error:
+                        print(f'[chat] stream finish error: {stream_error}')
+                return config_error.response
+            assistant_message = llm_result.text
             
             # Логируем использование токенов
-            if hasattr(response, 'usage') and response.usage:
+            if llm_result.total_tokens:
+                llm_tokens_used = llm_result.total_tokens
+                llm_metadata = {'provider': llm_result.provider, **prompt_plan.metadata()}
+                if len(llm_attempts) > 1:
+                    llm_metadata['attempts'] = llm_attempts
                 log_token_usage(
                     tenant_id=tenant_id,
                     operation_type='gpt_response',
-                    model=chat_api_model,
-                    tokens_used=response.usage.total_tokens,
+                    model=llm_result.model,
+                    tokens_used=llm_result.total_tokens,
                     request_id=session_id,
-                    metadata={'provider': 'openai'}
+                    metadata=llm_metadata
                 )
-        else:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': f'Неизвестный провайдер: {ai_provider}'}),
-                'isBase64Encoded': False
-            }
+
+        stages.record('llm', (time.perf_counter() - llm_started) * 1000)
+
+        if use_answer_cache and not cached_answer:
+            store_answer(
+                cur, tenant_id, chunks_version, tenant_ctx.settings_version, cache_channel, context_ok, user_message,
+                query_embedding, assistant_message, llm_tokens_used,
+                int((time.perf_counter() - llm_started) * 1000)
+            )
 
         cur.execute("""
             INSERT INTO t_p56134400_telegram_ai_bot_pdf.chat_messages (session_id, role, content, tenant_id)
@@ -952,15 +717,25 @@ def handler(event: dict, context) -> dict:
         conn.commit()
 
         cur.close()
-        conn.close()
+        # Соединение больше не нужно — возвращаем в пул до форматирования ответа.
+        # conn = None: finally не должен вернуть его второй раз, когда оно уже выдано другому запросу
+        release_connection(conn)
+        conn = None
+        print(f"[db_pool] {pool_stats()}")
 
         # Форматируем ответ под конкретный канал
         print(f'[chat] Formatting for channel={channel}, tenant_id={tenant_id}')
-        settings = get_formatting_settings(tenant_id, channel)
+        settings = tenant_ctx.formatting(channel)
         formatted_message = format_with_settings(assistant_message, settings, channel)
         print(f'[chat] Original: {assistant_message[:100]}...')
         print(f'[chat] Formatted: {formatted_message[:100]}...')
 
+        if publisher:
+            publisher.finish(formatted_message)
+
+        timings_ms = stages.summary()
+        print(f"⏱️ STAGES: {json.dumps(timings_ms)}")
+
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -970,19 +745,51 @@ def handler(event: dict, context) -> dict:
                 'debug': {
                     'context_ok': context_ok,
                     'gate_reason': gate_reason,
-                    'gate_info': gate_debug
+                    'gate_info': gate_debug,
+                    'timings_ms': timings_ms,
+                    'deadline': deadline.to_dict()
                 }
             }),
             'isBase64Encoded': False
         }
 
+    except DeadlineExceeded as e:
+        # Вызывающий уже не ждёт — быстро отдаём ошибку вместо ответа, который никто не получит
+        print(f'⏱️ [chat] {e}')
+        if publisher:
+            try:
+                publisher.finish(error=str(e))
+            except Exception as stream_error:
+                print(f'[chat] stream finish error: {stream_error}')
+        return {
+            'statusCode': 504,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e), 'stage': e.stage}),
+            'isBase64Encoded': False
+        }
+
     except Exception as e:
         print(f'❌ [chat] Critical error: {e}')
         import traceback
         traceback.print_exc()
+        if publisher:
+            try:
+                publisher.finish(error=str(e))
+            except Exception as stream_error:
+                print(f'[chat] stream finish error: {stream_error}')
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+
+    finally:
+        # Ранние return и ошибки тоже возвращают соединение в пул
+        release_connection(conn)
+        if publisher:
+            # Повторный finish ничего не делает; здесь закрываем поток, забытый ранним return
+            try:
+                publisher.finish(error='stream closed without an answer')
+            except Exception as stream_error:
+                print(f'[chat] stream finish error: {stream_error}')
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+Вызов одного LLM-провайдера для chat: ключи и прокси тенанта, формат сообщений,
+поток в виджет через StreamPublisher. Выбор провайдера и запасной вариант — llm_router.
+"""
+import json
+from typing import Dict, List
+
+from openrouter_models import get_working_free_model
+from provider_clients import get_openai_client, yandex_session, yandex_timeout
+from llm_stream import StreamResult, complete_openai_compatible, stream_yandex, YANDEX_COMPLETION_URL
+
+OPENAI_COMPATIBLE_BASE_URLS = {
+    'openrouter': 'https://openrouter.ai/api/v1',
+    'deepseek': 'https://api.deepseek.com',
+    'proxyapi': 'https://api.proxyapi.ru/openai/v1',
+    'openai': 'https://api.openai.com/v1',
+}
+
+# Имя ключа в tenant_api_keys
+API_KEY_NAMES = {
+    'openrouter': 'api_key',
+    'deepseek': 'api_key',
+    'proxyapi': 'api_key',
+    'openai': 'OPENAI_API_KEY',
+}
+
+PROVIDER_LABELS = {
+    'openrouter': 'OpenRouter',
+    'deepseek': 'DeepSeek',
+    'proxyapi': 'ProxyAPI',
+    'openai': 'OpenAI',
+}
+
+
+class ProviderConfigError(Exception):
+    """Провайдер не вызывается из-за настроек тенанта (нет ключа, модель недоступна); response — HTTP-ответ"""
+
+    def __init__(self, response: dict):
+        super().__init__(json.loads(response['body']).get('error'))
+        self.response = response
+
+
+class LLMResult:
+    def __init__(self, provider: str, model: str, text: str, total_tokens: int):
+        self.provider = provider
+        self.model = model
+        self.text = text
+        self.total_tokens = total_tokens
+
+
+def _error_response(status_code: int, error: str) -> dict:
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': error}),
+        'isBase64Encoded': False
+    }
+
+
+def _api_key(tenant_ctx, provider: str, key_name: str) -> str:
+    value, error = tenant_ctx.api_key(provider, key_name)
+    if error:
+        raise ProviderConfigError(error)
+    return value
+
+
+def call_provider(tenant_ctx, provider: str, api_model: str, system_prompt: str, history: List[Dict],
+                  user_message: str, params: Dict, publisher=None, timeout: float = None) -> LLMResult:
+    """
+    Один запрос к провайдеру. params — temperature, top_p, frequency_penalty, presence_penalty, max_tokens.
+    Ошибка сети/API — исключение (его считает llm_router), ошибка настроек — ProviderConfigError.
+    """
+    if provider == 'yandex':
+        yandex_api_key = _api_key(tenant_ctx, 'yandex', 'api_key')
+        yandex_folder_id = _api_key(tenant_ctx, 'yandex', 'folder_id')
+
+        yandex_messages = [{"role": "system", "text": system_prompt}]
+        # История сообщений (пустая, если quality gate не прошёл)
+        for msg in history:
+            yandex_messages.append({
+                "role": "user" if msg["role"] == "user" else "assistant",
+                "text": msg["content"]
+            })
+        yandex_messages.append({"role": "user", "text": user_message})
+
+        payload = {
+            "modelUri": f"gpt://{yandex_folder_id}/{api_model}",
+            "completionOptions": {
+                "temperature": params['temperature'],
+                "maxTokens": str(params['max_tokens'])
+            },
+            "messages": yandex_messages
+        }
+
+        if publisher:
+            stream_result = StreamResult()
+            text = publisher.pump(stream_yandex(yandex_api_key, payload, stream_result, timeout=timeout))
+            return LLMResult(provider, api_model, text, stream_result.total_tokens)
+
+        yandex_response = yandex_session().post(
+            YANDEX_COMPLETION_URL,
+            headers={
+                'Authorization': f'Api-Key {yandex_api_key}',
+                'Content-Type': 'application/json'
+            },
+            json=payload,
+            timeout=yandex_timeout(timeout)
+        )
+        if yandex_response.status_code != 200:
+            raise Exception(f'Yandex API error: {yandex_response.text}')
+
+        yandex_data = yandex_response.json()
+        text = yandex_data['result']['alternatives'][0]['message']['text']
+        usage_data = yandex_data.get('result', {}).get('usage', {})
+        return LLMResult(provider, api_model, text, int(usage_data.get('totalTokens', 0)))
+
+    if provider not in OPENAI_COMPATIBLE_BASE_URLS:
+        raise ProviderConfigError(_error_response(400, f'Неизвестный провайдер: {provider}'))
+
+    api_key = _api_key(tenant_ctx, provider, API_KEY_NAMES[provider])
+
+    model = api_model
+    if provider == 'openrouter':
+        if api_model.endswith(':free'):
+            try:
+                model = get_working_free_model(api_model)
+                print(f"✅ OpenRouter бесплатная модель доступна: {api_model}")
+            except Exception as model_error:
+                raise ProviderConfigError(_error_response(400, f'Модель недоступна: {str(model_error)}'))
+        else:
+            # Платные модели используем напрямую
+            print(f"💰 OpenRouter платная модель: {api_model}")
+
+    # Клиент из реестра: keep-alive пул и прокси переживают тёплые вызовы
+    proxy = None
+    proxy_settings = tenant_ctx.proxy_settings
+    if proxy_settings.get(provider, {}).get('enabled') and proxy_settings[provider].get('proxy'):
+        proxy = proxy_settings[provider]['proxy']
+        print(f"[chat] Using proxy for {PROVIDER_LABELS[provider]}: {list(proxy.values())[0][:50]}...")
+
+    chat_client = get_openai_client(provider, OPENAI_COMPATIBLE_BASE_URLS[provider], api_key, proxy)
+    if timeout is not None:
+        chat_client = chat_client.with_options(timeout=timeout)
+
+    messages = [{"role": "system", "content": system_prompt}]
+    for msg in history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    messages.append({"role": "user", "content": user_message})
+
+    # Для виджета со streamId — stream=True, текст уходит в chat_streams по мере генерации
+    text, total_tokens = complete_openai_compatible(
+        chat_client,
+        publisher,
+        model=model,
+        messages=messages,
+        temperature=params['temperature'],
+        top_p=params['top_p'],
+        frequency_penalty=params['frequency_penalty'],
+        presence_penalty=params['presence_penalty'],
+        max_tokens=params['max_tokens']
+    )
+    return LLMResult(provider, model, text, total_tokens)
@@ -0,0 +1,227 @@
+"""
+Маршрутизация запросов chat к LLM с учётом задержек и ошибок провайдеров.
+
+Статистика живёт в процессе функции между тёплыми вызовами, отдельно на каждую пару
+(provider, model): задержки и исходы последних LLM_STATS_WINDOW вызовов.
+После LLM_CIRCUIT_FAILURES ошибок подряд цепь размыкается на LLM_CIRCUIT_OPEN_SECONDS.
+Пока цепь разомкнута, запрос сразу уходит на запасной вариант тенанта
+(ai_settings.fallback_provider / fallback_model). Когда срок выходит, пропускается
+один пробный запрос.
+
+Для голоса включается хедж. Если первый запрос не ответил за бюджет задержки, стартует
+второй, и берётся первый успешный ответ. Бюджет — минимум из настройки и p90 задержки
+основной модели, но не меньше LLM_HEDGE_MIN_MS.
+"""
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from llm_providers import LLMResult, ProviderConfigError
+from deadline import DeadlineExceeded
+
+LLM_STATS_WINDOW = int(os.environ.get('LLM_STATS_WINDOW', '50'))
+LLM_CIRCUIT_FAILURES = int(os.environ.get('LLM_CIRCUIT_FAILURES', '3'))
+LLM_CIRCUIT_OPEN_SECONDS = float(os.environ.get('LLM_CIRCUIT_OPEN_SECONDS', '60'))
+LLM_HEDGE_AFTER_MS = int(os.environ.get('LLM_HEDGE_AFTER_MS', '2500'))
+LLM_HEDGE_MIN_MS = int(os.environ.get('LLM_HEDGE_MIN_MS', '800'))
+LLM_ROUTER_WORKERS = int(os.environ.get('LLM_ROUTER_WORKERS', '4'))
+
+Candidate = Tuple[str, str]
+
+_lock = threading.Lock()
+_stats: Dict[Candidate, 'ProviderStats'] = {}
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+class ProviderStats:
+    """Скользящее окно (latency_ms, ok) и состояние цепи для одной (provider, model)"""
+
+    def __init__(self):
+        self.samples = deque(maxlen=LLM_STATS_WINDOW)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        # Когда выдан пробный запрос; если он так и не был сделан, через срок размыкания выдаётся новый
+        self.probe_started = 0.0
+
+    def record(self, ok: bool, latency_ms: float):
+        with _lock:
+            self.samples.append((latency_ms, ok))
+            self.probe_started = 0.0
+            if ok:
+                self.consecutive_failures = 0
+                self.open_until = 0.0
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= LLM_CIRCUIT_FAILURES:
+                self.open_until = time.monotonic() + LLM_CIRCUIT_OPEN_SECONDS
+
+    def available(self) -> bool:
+        """Цепь замкнута, либо срок размыкания вышел и пробный запрос ещё не выдан"""
+        with _lock:
+            if not self.open_until:
+                return True
+            now = time.monotonic()
+            if now < self.open_until or now - self.probe_started < LLM_CIRCUIT_OPEN_SECONDS:
+                return False
+            self.probe_started = now
+            return True
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        with _lock:
+            latencies = sorted(ms for ms, ok in self.samples if ok)
+        if len(latencies) < 5:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def snapshot(self) -> dict:
+        with _lock:
+            samples = list(self.samples)
+            open_for = max(0.0, self.open_until - time.monotonic())
+        ok_samples = [ms for ms, ok in samples if ok]
+        return {
+            'calls': len(samples),
+            'error_rate': round(1 - len(ok_samples) / len(samples), 3) if samples else 0.0,
+            'avg_ms': round(sum(ok_samples) / len(ok_samples)) if ok_samples else None,
+            'circuit_open_s': round(open_for, 1),
+        }
+
+
+def get_stats(candidate: Candidate) -> ProviderStats:
+    with _lock:
+        stats = _stats.get(candidate)
+        if stats is None:
+            stats = _stats[candidate] = ProviderStats()
+        return stats
+
+
+def router_stats() -> dict:
+    with _lock:
+        items = list(_stats.items())
+    return {f'{provider}/{model}': stats.snapshot() for (provider, model), stats in items}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_WORKERS, thread_name_prefix='llm-route')
+        return _executor
+
+
+def _attempt(candidate: Candidate, call: Callable[[str, str], LLMResult], attempts: List[dict]) -> LLMResult:
+    """Один вызов с замером; ошибки настроек тенанта и исчерпанный дедлайн не считаются отказом провайдера"""
+    provider, model = candidate
+    started = time.perf_counter()
+    try:
+        result = call(provider, model)
+    except (ProviderConfigError, DeadlineExceeded) as e:
+        attempts.append({'provider': provider, 'model': model, 'ok': False,
+                         'error': 'deadline' if isinstance(e, DeadlineExceeded) else 'config'})
+        print(f"[llm_router] {provider}/{model} skipped: {e}")
+        raise
+    except Exception as e:
+        latency_ms = (time.perf_counter() - started) * 1000
+        get_stats(candidate).record(False, latency_ms)
+        attempts.append({'provider': provider, 'model': model, 'ok': False, 'ms': round(latency_ms), 'error': str(e)[:200]})
+        print(f"[llm_router] {provider}/{model} failed after {latency_ms:.0f}ms: {e}")
+        raise
+    latency_ms = (time.perf_counter() - started) * 1000
+    get_stats(candidate).record(True, latency_ms)
+    attempts.append({'provider': provider, 'model': model, 'ok': True, 'ms': round(latency_ms)})
+    return result
+
+
+def _order(candidates: List[Candidate]) -> List[Candidate]:
+    """Кандидаты с замкнутой цепью — первыми; если разомкнуты все, пробуем всё равно по порядку"""
+    unique = list(dict.fromkeys(candidates))
+    available = [c for c in unique if get_stats(c).available()]
+    for candidate in unique:
+        if candidate not in available:
+            print(f"[llm_router] circuit open for {candidate[0]}/{candidate[1]}")
+    return available + [c for c in unique if c not in available]
+
+
+def hedge_budget_ms(candidate: Candidate, budget_ms: int) -> int:
+    p90 = get_stats(candidate).latency_quantile(0.9)
+    if p90 is None:
+        return budget_ms
+    return int(max(LLM_HEDGE_MIN_MS, min(budget_ms, p90)))
+
+
+def _sequential(ordered: List[Candidate], call, attempts: List[dict], before_retry: Optional[Callable]) -> LLMResult:
+    last_error = None
+    for i, candidate in enumerate(ordered):
+        if i and before_retry:
+            before_retry()
+        try:
+            return _attempt(candidate, call, attempts)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            last_error = e
+    raise last_error
+
+
+def _submit(pool: ThreadPoolExecutor, candidate: Candidate, call, attempts: List[dict]):
+    # Копия контекста вызова: токены, записанные в call, идут в его буфер token_logger.
+    # Колбэк проигравшего выполняется вне этой копии и после ответа пишет токены сразу
+    return pool.submit(contextvars.copy_context().run, _attempt, candidate, call, attempts)
+
+
+def _hedged(ordered: List[Candidate], call, attempts: List[dict], budget_ms: int,
+            on_abandoned: Optional[Callable[[LLMResult], None]]) -> LLMResult:
+    pool = _get_executor()
+    # Без запасного варианта хеджируем тем же провайдером (другое соединение)
+    queue = list(ordered) if len(ordered) > 1 else ordered * 2
+    running = {_submit(pool, queue.pop(0), call, attempts)}
+    hedged = False
+    last_error = None
+
+    def abandon(future):
+        if on_abandoned and future.exception() is None:
+            on_abandoned(future.result())
+
+    while running:
+        timeout = budget_ms / 1000 if (queue and not hedged) else None
+        done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            hedged = True
+            print(f"[llm_router] no answer in {budget_ms}ms, hedging with {queue[0][0]}/{queue[0][1]}")
+            running.add(_submit(pool, queue.pop(0), call, attempts))
+            continue
+        for future in done:
+            if future.exception() is None:
+                # Проигравший запрос не отменить — его токены учитываем, когда он завершится
+                for loser in running:
+                    loser.add_done_callback(abandon)
+                return future.result()
+            last_error = future.exception()
+        if not running and queue:
+            # Первый упал раньше бюджета — сразу переключаемся на следующий
+            hedged = True
+            running.add(_submit(pool, queue.pop(0), call, attempts))
+    raise last_error
+
+
+def route_completion(candidates: List[Candidate], call: Callable[[str, str], LLMResult],
+                     hedge_after_ms: Optional[int] = None,
+                     on_abandoned: Optional[Callable[[LLMResult], None]] = None,
+                     before_retry: Optional[Callable[[], None]] = None) -> Tuple[LLMResult, List[dict]]:
+    """
+    (результат, попытки). candidates — [(provider, api_model)], основной первым.
+    Если не ответил никто, пробрасывается последняя ошибка (ProviderConfigError — с HTTP-ответом).
+    """
+    ordered = _order(candidates)
+    attempts: List[dict] = []
+    if hedge_after_ms:
+        budget_ms = hedge_budget_ms(ordered[0], hedge_after_ms)
+        result = _hedged(ordered, call, attempts, budget_ms, on_abandoned)
+    else:
+        result = _sequential(ordered, call, attempts, before_retry)
+    if len(attempts) > 1:
+        print(f"[llm_router] answered by {result.provider}/{result.model} after {len(attempts)} attempts")
+    return result, attempts
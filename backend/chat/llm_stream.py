@@ -0,0 +1,215 @@
+"""
+Потоковая генерация ответа для веб-виджета.
+
+Cloud Function отдаёт ответ целиком, поэтому handler chat пишет нарастающий текст
+в chat_streams (отдельное autocommit-соединение, не чаще CHAT_STREAM_FLUSH_MS),
+а GET chat?stream_id=... отдаёт новые куски как Server-Sent Events с retry —
+EventSource в браузере переподключается и передаёт Last-Event-ID («поколение:смещение»).
+После повтора запроса другим провайдером текст начинается заново в новом поколении,
+и клиент получает событие reset.
+Сообщение в chat_messages и token_usage пишутся после окончания потока, как раньше.
+"""
+import os
+import json
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from db_pool import get_connection, release_connection
+from provider_clients import yandex_session, yandex_timeout
+
+CHAT_STREAM_FLUSH_MS = int(os.environ.get('CHAT_STREAM_FLUSH_MS', '250'))
+CHAT_STREAM_RETRY_MS = int(os.environ.get('CHAT_STREAM_RETRY_MS', '300'))
+CHAT_STREAM_TTL = int(os.environ.get('CHAT_STREAM_TTL', '3600'))
+
+YANDEX_COMPLETION_URL = 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'
+
+
+class StreamResult:
+    """Итог потока: полный текст и total_tokens, если провайдер их сообщил"""
+
+    def __init__(self):
+        self.text = ''
+        self.total_tokens = 0
+
+
+def stream_openai_compatible(chat_client, result: StreamResult, **create_kwargs) -> Iterator[str]:
+    """Дельты текста из chat.completions.create(stream=True); usage — в последнем чанке"""
+    stream = chat_client.chat.completions.create(
+        stream=True,
+        stream_options={'include_usage': True},
+        **create_kwargs
+    )
+    for chunk in stream:
+        if getattr(chunk, 'usage', None):
+            result.total_tokens = chunk.usage.total_tokens
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            result.text += delta
+            yield delta
+
+
+def complete_openai_compatible(chat_client, publisher: Optional['StreamPublisher'], **create_kwargs) -> Tuple[str, int]:
+    """(текст, total_tokens): потоком через publisher для виджета, иначе обычным запросом"""
+    if publisher is not None:
+        result = StreamResult()
+        publisher.pump(stream_openai_compatible(chat_client, result, **create_kwargs))
+        return result.text, result.total_tokens
+
+    response = chat_client.chat.completions.create(**create_kwargs)
+    total_tokens = response.usage.total_tokens if getattr(response, 'usage', None) else 0
+    return response.choices[0].message.content, total_tokens
+
+
+def stream_yandex(api_key: str, payload: Dict, result: StreamResult, timeout: float = None) -> Iterator[str]:
+    """
+    Yandex completion со stream=true: построчный JSON, в каждой строке — весь текст
+    на текущий момент, поэтому дельта — приращение к уже полученному.
+    """
+    payload = {**payload, 'completionOptions': {**payload['completionOptions'], 'stream': True}}
+    response = yandex_session().post(
+        YANDEX_COMPLETION_URL,
+        headers={
+            'Authorization': f'Api-Key {api_key}',
+            'Content-Type': 'application/json'
+        },
+        json=payload,
+        stream=True,
+        timeout=yandex_timeout(timeout)
+    )
+    if response.status_code != 200:
+        raise Exception(f'Yandex API error: {response.text}')
+
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            continue
+        data = json.loads(line)
+        if 'error' in data:
+            raise Exception(f"Yandex API error: {data['error']}")
+        data = data.get('result', data)
+        text = data['alternatives'][0]['message']['text']
+        usage = data.get('usage') or {}
+        if usage.get('totalTokens'):
+            result.total_tokens = int(usage['totalTokens'])
+        if len(text) > len(result.text):
+            delta = text[len(result.text):]
+            result.text = text
+            yield delta
+
+
+class StreamPublisher:
+    """Пишет нарастающий текст в chat_streams для GET-поллинга виджетом"""
+
+    def __init__(self, stream_id: str, tenant_id: int, session_id: str):
+        self.stream_id = stream_id
+        self.tenant_id = tenant_id
+        self.session_id = session_id
+        self.text = ''
+        self._flushed_at = 0.0
+        self._conn = get_connection()
+        self._conn.autocommit = True
+        with self._conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO t_p56134400_telegram_ai_bot_pdf.chat_streams
+                (stream_id, tenant_id, session_id, content, done, generation, updated_at)
+                VALUES (%s, %s, %s, '', false, 0, NOW())
+                ON CONFLICT (stream_id) DO UPDATE SET
+                    content = '', final_message = NULL, done = false, error = NULL,
+                    generation = chat_streams.generation + 1, updated_at = NOW()
+                RETURNING generation
+            """, (stream_id, tenant_id, session_id))
+            self.generation = cur.fetchone()[0]
+
+    def _write(self, done: bool = False, final_message: str = None, error: str = None):
+        with self._conn.cursor() as cur:
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.chat_streams
+                SET content = %s, final_message = %s, done = %s, error = %s, generation = %s, updated_at = NOW()
+                WHERE stream_id = %s
+            """, (self.text, final_message, done, error, self.generation, self.stream_id))
+        self._flushed_at = time.monotonic()
+
+    def push(self, delta: str):
+        self.text += delta
+        if (time.monotonic() - self._flushed_at) * 1000 >= CHAT_STREAM_FLUSH_MS:
+            self._write()
+
+    def reset(self):
+        """Перед повтором запроса другим провайдером: уже отданный текст недействителен — новое поколение"""
+        self.text = ''
+        self.generation += 1
+        self._write()
+
+    def pump(self, deltas: Iterator[str]) -> str:
+        for delta in deltas:
+            self.push(delta)
+        return self.text
+
+    def finish(self, final_message: str = None, error: str = None):
+        """
+        Завершает поток: final_message — ответ после format_with_settings (виджет заменяет
+        им накопленный текст), либо error. Соединение возвращается в пул.
+        """
+        if self._conn is None:
+            return
+        try:
+            self._write(done=True, final_message=final_message, error=error)
+            # Старые потоки больше никто не читает
+            with self._conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM t_p56134400_telegram_ai_bot_pdf.chat_streams
+                    WHERE updated_at < NOW() - make_interval(secs => %s)
+                """, (CHAT_STREAM_TTL,))
+        finally:
+            release_connection(self._conn)
+            self._conn = None
+
+
+def _parse_event_id(last_event_id: Optional[str]) -> Tuple[int, int]:
+    """(поколение, смещение) из Last-Event-ID «поколение:смещение»; просто число — смещение поколения 0"""
+    generation, _, offset = (last_event_id or '').rpartition(':')
+    try:
+        return int(generation or 0), int(offset or 0)
+    except ValueError:
+        return 0, 0
+
+
+def stream_events_response(cur, stream_id: str, last_event_id: Optional[str]) -> dict:
+    """
+    GET-ответ для EventSource: текст после смещения Last-Event-ID.
+    id события — «поколение:длина уже отданного текста». Если текст начат заново (reset),
+    сначала идёт событие reset — клиент очищает накопленный текст. По done=true клиент
+    закрывает поток.
+    """
+    cur.execute("""
+        SELECT content, done, final_message, error, generation
+        FROM t_p56134400_telegram_ai_bot_pdf.chat_streams
+        WHERE stream_id = %s
+    """, (stream_id,))
+    row = cur.fetchone()
+
+    client_generation, offset = _parse_event_id(last_event_id)
+
+    events = [f"retry: {CHAT_STREAM_RETRY_MS}\n\n"]
+    if row:
+        content, done, final_message, error, generation = row
+        if generation != client_generation:
+            events.append(f"id: {generation}:0\nevent: reset\ndata: {{}}\n\n")
+            offset = 0
+        if len(content) > offset:
+            events.append(f"id: {generation}:{len(content)}\nevent: delta\n"
+                          f"data: {json.dumps({'text': content[offset:]}, ensure_ascii=False)}\n\n")
+        if done:
+            events.append(f"event: done\ndata: {json.dumps({'message': final_message, 'error': error}, ensure_ascii=False)}\n\n")
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/event-stream; charset=utf-8',
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': ''.join(events),
+        'isBase64Encoded': False
+    }
@@ -0,0 +1,82 @@
+"""
+Параллельные этапы handler chat и замеры времени по этапам.
+
+Независимые этапы (эмбеддинг запроса, загрузка движка тенанта) стартуют в пуле потоков,
+живущем между тёплыми вызовами, пока основной поток читает историю. Каждый фоновый
+этап работает на своём соединении из db_pool: курсор psycopg2 нельзя делить между потоками.
+"""
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from db_pool import get_connection, release_connection
+
+CHAT_PIPELINE_WORKERS = int(os.environ.get('CHAT_PIPELINE_WORKERS', '3'))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=CHAT_PIPELINE_WORKERS, thread_name_prefix='chat-stage')
+        return _executor
+
+
+def run_with_cursor(fn: Callable, *args, **kwargs):
+    """fn(cur, *args) на отдельном соединении из пула; коммит — записи кэшей, которые делает fn"""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        result = fn(cur, *args, **kwargs)
+        conn.commit()
+        cur.close()
+        return result
+    finally:
+        release_connection(conn)
+
+
+class StageTimer:
+    """
+    Время по этапам запроса, мс. Для фоновых этапов отдельно пишется, сколько основной
+    поток ждал результата (<этап>_wait) — это и есть их вклад в задержку ответа.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages_ms: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, ms: float):
+        with self._lock:
+            self.stages_ms[name] = round(self.stages_ms.get(name, 0.0) + ms, 1)
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def submit(self, name: str, fn: Callable, *args, **kwargs) -> Future:
+        def timed():
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        # Копия контекста: записи token_logger этапа попадают в буфер этого вызова
+        return _get_executor().submit(contextvars.copy_context().run, timed)
+
+    def wait(self, name: str, future: Future):
+        """Результат фонового этапа (исключение пробрасывается в основной поток)"""
+        with self.stage(f'{name}_wait'):
+            return future.result()
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            return {**self.stages_ms, 'total': round((time.perf_counter() - self.started) * 1000, 1)}
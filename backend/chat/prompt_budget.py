@@ -0,0 +1,110 @@
+"""
+Бюджет токенов промпта chat: system prompt с контекстом + история + сообщение пользователя.
+
+Токены оцениваются локально по длине текста, без токенизатора провайдера. Кириллица
+весит больше латиницы, а число кириллических символов берётся из разницы длины в байтах
+UTF-8 и в символах. Если промпт не влезает в бюджет, сначала уходят старые сообщения
+истории (до PROMPT_MIN_HISTORY), затем чанки с наименьшим рангом (до PROMPT_MIN_CHUNKS),
+затем оставшаяся история.
+
+Бюджет задаётся в ai_settings.prompt_token_budget: числом или по каналам
+({"voice": 2000, "default": 6000}). Без настройки действуют PROMPT_TOKEN_BUDGET и
+PROMPT_TOKEN_BUDGET_VOICE.
+"""
+import os
+from typing import Dict, List, Optional
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '6000'))
+PROMPT_TOKEN_BUDGET_VOICE = int(os.environ.get('PROMPT_TOKEN_BUDGET_VOICE', '2500'))
+PROMPT_MIN_CHUNKS = int(os.environ.get('PROMPT_MIN_CHUNKS', '2'))
+PROMPT_MIN_HISTORY = int(os.environ.get('PROMPT_MIN_HISTORY', '2'))
+# Символов на токен: кириллица у BPE-токенизаторов дробится мельче латиницы
+PROMPT_CHARS_PER_TOKEN_CYR = float(os.environ.get('PROMPT_CHARS_PER_TOKEN_CYR', '2.8'))
+PROMPT_CHARS_PER_TOKEN_LAT = float(os.environ.get('PROMPT_CHARS_PER_TOKEN_LAT', '4.0'))
+# Служебные токены на сообщение (роль, разделители)
+PROMPT_TOKENS_PER_MESSAGE = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов: двухбайтовые символы UTF-8 (кириллица) + остальные"""
+    if not text:
+        return 0
+    n_chars = len(text)
+    n_wide = min(n_chars, len(text.encode('utf-8')) - n_chars)
+    return int(n_wide / PROMPT_CHARS_PER_TOKEN_CYR + (n_chars - n_wide) / PROMPT_CHARS_PER_TOKEN_LAT) + 1
+
+
+def prompt_budget(ai_settings: Optional[Dict], channel: str) -> int:
+    value = (ai_settings or {}).get('prompt_token_budget')
+    if isinstance(value, dict):
+        value = value.get(channel, value.get('default'))
+    try:
+        budget = int(value) if value is not None else 0
+    except (TypeError, ValueError):
+        budget = 0
+    if budget > 0:
+        return budget
+    return PROMPT_TOKEN_BUDGET_VOICE if channel == 'voice' else PROMPT_TOKEN_BUDGET
+
+
+class PromptPlan:
+    """Что осталось в промпте после подгонки под бюджет и сколько токенов сэкономлено"""
+
+    def __init__(self, context_parts: List[str], history: List[Dict], budget: int,
+                 tokens_before: int, tokens_after: int, chunks_dropped: int, history_dropped: int):
+        self.context_parts = context_parts
+        self.history = history
+        self.budget = budget
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+        self.chunks_dropped = chunks_dropped
+        self.history_dropped = history_dropped
+
+    @property
+    def trimmed(self) -> bool:
+        return bool(self.chunks_dropped or self.history_dropped)
+
+    def metadata(self) -> dict:
+        """Поля для token_usage.metadata"""
+        data = {'prompt_tokens_est': self.tokens_after, 'prompt_budget': self.budget}
+        if self.trimmed:
+            data.update({
+                'prompt_tokens_saved': self.tokens_before - self.tokens_after,
+                'chunks_dropped': self.chunks_dropped,
+                'history_dropped': self.history_dropped,
+            })
+        return data
+
+
+def fit_prompt(system_tokens: int, context_parts: List[str], history: List[Dict],
+               user_message: str, budget: int) -> PromptPlan:
+    """
+    system_tokens — system prompt без контекста; context_parts — чанки по убыванию ранга;
+    history — от старых к новым. Возвращает урезанные копии списков.
+    """
+    chunk_tokens = [estimate_tokens(part) for part in context_parts]
+    history_tokens = [estimate_tokens(msg['content']) + PROMPT_TOKENS_PER_MESSAGE for msg in history]
+    fixed = system_tokens + estimate_tokens(user_message) + 2 * PROMPT_TOKENS_PER_MESSAGE
+    total = fixed + sum(chunk_tokens) + sum(history_tokens)
+    tokens_before = total
+
+    n_chunks = len(context_parts)
+    first_history = 0
+    if total > budget:
+        # 1. Старая история, пока не останется PROMPT_MIN_HISTORY сообщений
+        while total > budget and len(history) - first_history > PROMPT_MIN_HISTORY:
+            total -= history_tokens[first_history]
+            first_history += 1
+        # 2. Чанки с наименьшим рангом, пока не останется PROMPT_MIN_CHUNKS
+        while total > budget and n_chunks > PROMPT_MIN_CHUNKS:
+            n_chunks -= 1
+            total -= chunk_tokens[n_chunks]
+        # 3. Остаток истории
+        while total > budget and first_history < len(history):
+            total -= history_tokens[first_history]
+            first_history += 1
+
+    return PromptPlan(
+        context_parts[:n_chunks], history[first_history:], budget,
+        tokens_before, total, len(context_parts) - n_chunks, first_history
+    )
@@ -0,0 +1,134 @@
+"""
+Реестр HTTP-клиентов LLM-провайдеров на процесс функции.
+
+OpenAI-совместимые клиенты (OpenRouter, DeepSeek, ProxyAPI, OpenAI) кэшируются по
+(provider, base_url, proxy, sha256(api_key)) вместе со своим httpx.Client: keep-alive пул,
+HTTP/2, если установлен h2, явные таймауты. Yandex ходит через общий requests.Session.
+Тёплый вызов не делает заново TLS-рукопожатие и CONNECT через прокси.
+Вытесненный из реестра клиент закрывается не сразу: им может пользоваться запрос
+в другом потоке (этап chat, хедж), поэтому он ждёт, пока с последней выдачи не пройдёт
+время самого долгого запроса (LLM_CONNECT_TIMEOUT + LLM_REQUEST_TIMEOUT).
+"""
+import os
+import hashlib
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', '5'))
+LLM_REQUEST_TIMEOUT = float(os.environ.get('LLM_REQUEST_TIMEOUT', '60'))
+PROVIDER_CLIENTS_MAX = int(os.environ.get('PROVIDER_CLIENTS_MAX', '32'))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.environ.get('PROVIDER_KEEPALIVE_EXPIRY', '120'))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# httpx >= 0.26 принимает proxy=, более старые — только proxies=
+_HTTPX_PROXY_ARG = 'proxy' if 'proxy' in inspect.signature(httpx.Client.__init__).parameters else 'proxies'
+
+_lock = threading.Lock()
+# (provider, base_url, proxy_url, key_hash) -> [OpenAI, httpx.Client, время последней выдачи]
+_clients: 'OrderedDict[Tuple, list]' = OrderedDict()
+# Вытесненные клиенты: (когда можно закрыть, httpx.Client)
+_retired: List[Tuple[float, httpx.Client]] = []
+_yandex_session: Optional[requests.Session] = None
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'closed': 0}
+
+
+def llm_timeout(read_timeout: float = None) -> httpx.Timeout:
+    return httpx.Timeout(read_timeout or LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _proxy_url(proxy: Optional[dict]) -> Optional[str]:
+    """Прокси в формате parse_proxy ({'http://': url, 'https://': url}) → url"""
+    if not proxy:
+        return None
+    return proxy.get('https://') or proxy.get('http://')
+
+
+def _build_http_client(proxy_url: Optional[str]) -> httpx.Client:
+    kwargs = {
+        'http2': HTTP2_AVAILABLE,
+        'timeout': llm_timeout(),
+        'limits': httpx.Limits(max_connections=10, max_keepalive_connections=5,
+                               keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY),
+    }
+    if proxy_url:
+        kwargs[_HTTPX_PROXY_ARG] = proxy_url
+    return httpx.Client(**kwargs)
+
+
+def _close_retired(now: float):
+    """Закрывает вытесненные клиенты, запросы которых уже точно завершились (под _lock)"""
+    still_open = []
+    for close_after, http_client in _retired:
+        if close_after > now:
+            still_open.append((close_after, http_client))
+            continue
+        _stats['closed'] += 1
+        try:
+            http_client.close()
+        except Exception:
+            pass
+    _retired[:] = still_open
+
+
+def get_openai_client(provider: str, base_url: str, api_key: str, proxy: Optional[dict] = None):
+    """OpenAI-совместимый клиент из реестра (создаётся при первом обращении)"""
+    from openai import OpenAI
+
+    proxy_url = _proxy_url(proxy)
+    key = (provider, base_url, proxy_url, hashlib.sha256(api_key.encode('utf-8')).hexdigest())
+    with _lock:
+        now = time.monotonic()
+        _close_retired(now)
+        entry = _clients.get(key)
+        if entry is not None:
+            _clients.move_to_end(key)
+            entry[2] = now
+            _stats['hits'] += 1
+            return entry[0]
+
+        _stats['misses'] += 1
+        http_client = _build_http_client(proxy_url)
+        client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, timeout=llm_timeout())
+        _clients[key] = [client, http_client, now]
+        print(f"[provider_clients] new client provider={provider} proxy={'yes' if proxy_url else 'no'} http2={HTTP2_AVAILABLE}")
+
+        while len(_clients) > PROVIDER_CLIENTS_MAX:
+            # Запрос, получивший клиент последним, мог ещё не завершиться — закрываем позже
+            _, (_, old_http_client, last_used) = _clients.popitem(last=False)
+            _stats['evictions'] += 1
+            _retired.append((last_used + LLM_CONNECT_TIMEOUT + LLM_REQUEST_TIMEOUT, old_http_client))
+        return client
+
+
+def yandex_session() -> requests.Session:
+    """Общая сессия для Yandex Foundation Models (completion и textEmbedding)"""
+    global _yandex_session
+    with _lock:
+        if _yandex_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=10)
+            session.mount('https://', adapter)
+            _yandex_session = session
+        return _yandex_session
+
+
+def yandex_timeout(read_timeout: float = None) -> Tuple[float, float]:
+    """(connect, read) для requests"""
+    return LLM_CONNECT_TIMEOUT, read_timeout or LLM_REQUEST_TIMEOUT
+
+
+def client_stats() -> dict:
+    with _lock:
+        return {**_stats, 'clients': len(_clients), 'retired': len(_retired), 'http2': HTTP2_AVAILABLE}
@@ -2,22 +2,10 @@ import re
 import os
 import json
 import hashlib
-from collections import deque
-from typing import List, Dict, Tuple
+from typing import AbstractSet, List, Dict, Optional, Tuple, Union
 from datetime import datetime
-
-STOPWORDS_RU = {
-    "и","в","во","на","по","к","ко","с","со","у","из","за","для","о","об","от","до","или",
-    "а","но","что","это","как","где","когда","сколько","какой","какая","какие","какое",
-    "я","мы","вы","они","он","она","оно","мне","нам","вам","их","его","ее","этот","эта","эти",
-    "тут","там","здесь","вот","ли","же","бы","то","не","нет","да"
-}
-
-STOPWORDS_EN = {
-    "the","a","an","and","or","to","of","in","on","for","with","about","is","are","was","were",
-    "be","been","being","as","at","by","from","this","that","these","those","it","its","i","we","you","they",
-    "my","our","your","their","me","us","them","please"
-}
+from retrieval_engine import top_k_scored, RetrievalResult
+from lexical_index import STOPWORDS_RU, STOPWORDS_EN, detect_lang_simple, tokenize, sanitize_chunk
 
 GATE_THRESHOLDS = {
     "tariffs": {"min_len": 300, "min_sim": 0.35, "min_overlap_ru": 0.08, "min_overlap_en": 0.08},
@@ -29,63 +17,13 @@ GATE_THRESHOLDS = {
 RAG_DEBUG = os.environ.get('RAG_DEBUG', 'false').lower() == 'true'
 RAG_TOPK_DEFAULT = int(os.environ.get('RAG_TOPK_DEFAULT', '12'))
 RAG_TOPK_FALLBACK = int(os.environ.get('RAG_TOPK_FALLBACK', '15'))
-RAG_LOW_OVERLAP_WINDOW = int(os.environ.get('RAG_LOW_OVERLAP_WINDOW', '50'))
-RAG_LOW_OVERLAP_THRESHOLD = float(os.environ.get('RAG_LOW_OVERLAP_THRESHOLD', '0.25'))
-RAG_LOW_OVERLAP_START_TOPK5 = os.environ.get('RAG_LOW_OVERLAP_START_TOPK5', 'true').lower() == 'true'
-
-low_overlap_window = deque(maxlen=RAG_LOW_OVERLAP_WINDOW)
+# Стартовый top-k по статистике тенанта — topk_controller.py
 
 def rag_debug_log(event: dict):
     if not RAG_DEBUG:
         return
     print(json.dumps(event, ensure_ascii=False))
 
-def low_overlap_rate() -> float:
-    if len(low_overlap_window) == 0:
-        return 0.0
-    return sum(low_overlap_window) / len(low_overlap_window)
-
-def update_low_overlap_stats(is_low_overlap: bool):
-    low_overlap_window.append(1 if is_low_overlap else 0)
-
-def detect_lang_simple(text: str) -> str:
-    cyr = len(re.findall(r"[А-Яа-яЁё]", text))
-    lat = len(re.findall(r"[A-Za-z]", text))
-    if cyr == 0 and lat == 0:
-        return "other"
-    if cyr >= lat:
-        return "ru"
-    return "en"
-
-def tokenize(text: str, lang: str) -> List[str]:
-    text = text.lower()
-    text = re.sub(r"[^a-zа-я0-9\s\-]+", " ", text, flags=re.IGNORECASE)
-    raw = [t for t in text.split() if len(t) >= 3]
-
-    if lang == "ru":
-        return [t for t in raw if t not in STOPWORDS_RU]
-    if lang == "en":
-        return [t for t in raw if t not in STOPWORDS_EN]
-    return raw
-
-def sanitize_chunk(text: str) -> str:
-    patterns = [
-        r"\bpage_number\b\s*[:=]\s*\d+",
-        r"\bsimilarity\b\s*[:=]\s*[0-9.]+",
-        r"\bid\b\s*[:=]\s*\d+",
-        r"\bfile_name\b\s*[:=]\s*\S+",
-        r"\bresults\b\s*[:=]\s*\[",
-        r"\.pdf\b",
-        r"\bстр\.?\s*\d+\b",
-        r"\bстраниц[аы]\b\s*\d+\b",
-        r"\bна\s+стр\.?\s*\d+\b",
-    ]
-    out = text
-    for p in patterns:
-        out = re.sub(p, " ", out, flags=re.IGNORECASE)
-    out = re.sub(r"\s{2,}", " ", out).strip()
-    return out
-
 def classify_query_type(user_text: str) -> str:
     t = user_text.lower()
     
@@ -107,14 +45,18 @@ def classify_query_type(user_text: str) -> str:
 
     return "services"
 
-def build_context_with_scores(scored_chunks: List[Tuple[str, float]], top_k: int = None, max_chars_per_chunk: int = 2200) -> Tuple[str, List[float]]:
+def build_context_with_scores(scored_chunks: Union[RetrievalResult, List[Tuple[str, float]]], top_k: int = None, max_chars_per_chunk: int = 2200) -> Tuple[str, List[float]]:
     if not scored_chunks:
         return "", []
     
     if top_k is None:
         top_k = RAG_TOPK_DEFAULT
 
-    sorted_chunks = sorted(scored_chunks, key=lambda x: x[1], reverse=True)[:top_k]
+    # Уже отобранные кандидаты: префикс без повторной сортировки и повторной очистки
+    if isinstance(scored_chunks, RetrievalResult):
+        return scored_chunks.context(top_k, sanitize_chunk, max_chars_per_chunk)
+
+    sorted_chunks = top_k_scored(scored_chunks, top_k)
 
     parts: List[str] = []
     sims: List[float] = []
@@ -130,12 +72,12 @@ def build_context_with_scores(scored_chunks: List[Tuple[str, float]], top_k: int
     context = "\n\n".join(parts).strip()
     return context, sims
 
-def keyword_overlap_ratio(user_text: str, context: str, lang: str) -> Tuple[float, int]:
+def keyword_overlap_ratio(user_text: str, context: str, lang: str, context_tokens: Optional[AbstractSet[str]] = None) -> Tuple[float, int]:
     q = tokenize(user_text, lang)
-    c = tokenize(context, lang)
 
     q_set = set(q)
-    c_set = set(c)
+    # Токены контекста из лексического индекса (RetrievalResult.context_tokens) — без повторной токенизации
+    c_set = context_tokens if context_tokens is not None else set(tokenize(context, lang))
     if not q_set:
         return 0.0, 0
 
@@ -162,7 +104,8 @@ def get_tenant_topk(tenant_overrides: Dict = None) -> Tuple[int, int]:
         return default_topk, fallback_topk
     return RAG_TOPK_DEFAULT, RAG_TOPK_FALLBACK
 
-def quality_gate(user_text: str, context: str, sims: List[float], tenant_overrides: Dict = None) -> Tuple[bool, str, Dict]:
+def quality_gate(user_text: str, context: str, sims: List[float], tenant_overrides: Dict = None,
+                 context_tokens: Optional[AbstractSet[str]] = None) -> Tuple[bool, str, Dict]:
     if not context:
         return False, "empty_context", {}
 
@@ -204,7 +147,7 @@ def quality_gate(user_text: str, context: str, sims: List[float], tenant_overrid
     lang = detect_lang_simple(user_text)
     min_overlap = th["min_overlap_ru"] if lang == "ru" else th["min_overlap_en"]
 
-    overlap, q_key_tokens = keyword_overlap_ratio(user_text, context, lang)
+    overlap, q_key_tokens = keyword_overlap_ratio(user_text, context, lang, context_tokens)
     debug_info["overlap"] = overlap
     debug_info["lang"] = lang
     debug_info["key_tokens"] = q_key_tokens
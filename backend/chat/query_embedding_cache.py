@@ -0,0 +1,154 @@
+"""
+Двухуровневый кэш эмбеддингов запросов перед Yandex textEmbedding:
+LRU в памяти тёплого контейнера + общая таблица query_embedding_cache в Postgres.
+
+Ключ — sha256(modelUri + нормализованный enriched_query), записи истекают по TTL.
+"""
+import os
+import time
+import random
+import hashlib
+from collections import OrderedDict, deque
+from typing import List, Optional, Tuple
+
+import psycopg2
+
+from embedding_codec import encode_embedding, decode_embedding
+from provider_clients import yandex_session
+
+YANDEX_EMBEDDING_URL = 'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding'
+
+QUERY_EMBEDDING_CACHE_TTL = int(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', str(7 * 24 * 3600)))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '2048'))
+QUERY_EMBEDDING_TIMEOUT = float(os.environ.get('QUERY_EMBEDDING_TIMEOUT', '10'))
+
+# cache_key -> (expires_at, vector)
+_memory: 'OrderedDict[str, Tuple[float, List[float]]]' = OrderedDict()
+# Задержки реальных вызовов API в этом контейнере — для оценки сэкономленного времени
+_api_latencies_ms = deque(maxlen=50)
+
+
+def normalize_query_text(text: str) -> str:
+    return ' '.join(text.casefold().split())
+
+
+def query_cache_key(model_uri: str, text: str) -> str:
+    return hashlib.sha256(f"{model_uri}\n{normalize_query_text(text)}".encode('utf-8')).hexdigest()
+
+
+def avg_api_latency_ms() -> Optional[float]:
+    if not _api_latencies_ms:
+        return None
+    return sum(_api_latencies_ms) / len(_api_latencies_ms)
+
+
+def _memory_get(key: str) -> Optional[List[float]]:
+    entry = _memory.get(key)
+    if entry is None:
+        return None
+    if entry[0] < time.time():
+        del _memory[key]
+        return None
+    _memory.move_to_end(key)
+    return entry[1]
+
+
+def _memory_put(key: str, vector: List[float]):
+    _memory[key] = (time.time() + QUERY_EMBEDDING_CACHE_TTL, vector)
+    _memory.move_to_end(key)
+    while len(_memory) > QUERY_EMBEDDING_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+def _db_get(cur, key: str) -> Optional[List[float]]:
+    """Чтение из общей таблицы; ошибки не ломают транзакцию запроса (savepoint)"""
+    try:
+        cur.execute("SAVEPOINT query_embedding_cache")
+        cur.execute("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+            SET hits = hits + 1, last_hit_at = NOW()
+            WHERE cache_key = %s AND created_at > NOW() - make_interval(secs => %s)
+            RETURNING embedding_bin, embedding_dim
+        """, (key, QUERY_EMBEDDING_CACHE_TTL))
+        row = cur.fetchone()
+        cur.execute("RELEASE SAVEPOINT query_embedding_cache")
+        if not row:
+            return None
+        return decode_embedding(row[0], row[1]).tolist()
+    except Exception as e:
+        print(f"[query_embedding_cache] DB read error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT query_embedding_cache")
+        return None
+
+
+def _db_put(cur, key: str, model_uri: str, vector: List[float]):
+    try:
+        cur.execute("SAVEPOINT query_embedding_cache")
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+            (cache_key, model_uri, embedding_bin, embedding_dim, created_at)
+            VALUES (%s, %s, %s, %s, NOW())
+            ON CONFLICT (cache_key) DO UPDATE SET
+                embedding_bin = EXCLUDED.embedding_bin,
+                embedding_dim = EXCLUDED.embedding_dim,
+                created_at = EXCLUDED.created_at
+        """, (key, model_uri, psycopg2.Binary(encode_embedding(vector)), len(vector)))
+        # Изредка чистим просроченные записи, чтобы таблица не росла бесконечно
+        if random.random() < 0.01:
+            cur.execute("""
+                DELETE FROM t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+                WHERE created_at < NOW() - make_interval(secs => %s)
+            """, (QUERY_EMBEDDING_CACHE_TTL,))
+        cur.execute("RELEASE SAVEPOINT query_embedding_cache")
+    except Exception as e:
+        print(f"[query_embedding_cache] DB write error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT query_embedding_cache")
+
+
+def fetch_yandex_embedding(model_uri: str, text: str, api_key: str, timeout: float = None) -> List[float]:
+    response = yandex_session().post(
+        YANDEX_EMBEDDING_URL,
+        headers={
+            'Authorization': f'Api-Key {api_key}',
+            'Content-Type': 'application/json'
+        },
+        json={'modelUri': model_uri, 'text': text},
+        timeout=timeout if timeout is not None else QUERY_EMBEDDING_TIMEOUT
+    )
+    if response.status_code != 200:
+        print(f"Yandex Embedding API error: {response.status_code}, {response.text}")
+        raise Exception(f"Yandex API returned {response.status_code}: {response.text}")
+
+    data = response.json()
+    if 'embedding' not in data:
+        print(f"ERROR: No 'embedding' in response: {data}")
+        raise Exception(f"Yandex API response missing 'embedding': {data}")
+    return data['embedding']
+
+
+def get_query_embedding(cur, model_uri: str, text: str, api_key: str, timeout: float = None) -> Tuple[List[float], str, float]:
+    """
+    Возвращает (вектор, источник, задержка_мс).
+    Источник: 'memory' | 'db' | 'api'.
+    """
+    started = time.perf_counter()
+    key = query_cache_key(model_uri, text)
+
+    vector = _memory_get(key)
+    if vector is not None:
+        return vector, 'memory', (time.perf_counter() - started) * 1000
+
+    if cur is not None:
+        vector = _db_get(cur, key)
+        if vector is not None:
+            _memory_put(key, vector)
+            return vector, 'db', (time.perf_counter() - started) * 1000
+
+    vector = fetch_yandex_embedding(model_uri, text, api_key, timeout=timeout)
+    latency_ms = (time.perf_counter() - started) * 1000
+    _api_latencies_ms.append(latency_ms)
+
+    _memory_put(key, vector)
+    if cur is not None:
+        _db_put(cur, key, model_uri, vector)
+    return vector, 'api', latency_ms
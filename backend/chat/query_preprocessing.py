@@ -0,0 +1,232 @@
+"""
+Предобработка запроса chat перед эмбеддингом: относительные даты → абсолютные,
+дата из истории диалога, обогащение запроса годом и периодом тарифа.
+
+Регулярки компилируются один раз на процесс и объединены в одно выражение на задачу.
+Относительные даты заменяются за один проход re.sub. История сканируется одним
+lookahead-выражением, которое сохраняет приоритет шаблонов. Результат по каждому
+сообщению кэшируется: от запроса к запросу история повторяется.
+
+Тенант может добавить свои шаблоны без изменения кода, в ai_settings.query_date_patterns:
+
+    {
+        "relative": [
+            {"pattern": "через\\\\s+пару\\\\s+дней", "days": 2},
+            {"pattern": "через\\\\s+(\\\\d+)\\\\s+суток", "per_unit_days": 1},
+            {"pattern": "в\\\\s+субботу", "weekday": 5}
+        ],
+        "history": ["\\\\d{1,2}\\\\s+(янв|фев|мар)[а-я]*"]
+    }
+
+Смещение задаётся одним из ключей days, weeks, per_unit_days (умножается на первую
+группу шаблона) или weekday (0 — понедельник; ближайший такой день, не раньше сегодня).
+Шаблоны тенанта проверяются после встроенных. Шаблон объединяется с остальными в одно
+выражение, поэтому глобальные флаги вида (?i) и номерные обратные ссылки (\\1) в нём
+запрещены (флаги с областью действия, (?i:...), допустимы). Если объединённое выражение
+всё же не компилируется, тенант получает только встроенные правила.
+"""
+import os
+import re
+import json
+import functools
+from calendar import monthrange
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from timezone_helper import now_moscow
+
+QUERY_DATE_CACHE_SIZE = int(os.environ.get('QUERY_DATE_CACHE_SIZE', '4096'))
+QUERY_PREPROCESSORS_MAX = int(os.environ.get('QUERY_PREPROCESSORS_MAX', '64'))
+
+MONTHS_RU = (
+    'января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
+    'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря'
+)
+MONTH_NUMBERS = {name: i + 1 for i, name in enumerate(MONTHS_RU)}
+_MONTHS_ALT = '|'.join(MONTHS_RU)
+
+# Резолвер: (группа шаблона по номеру, сегодня) → дата
+Resolver = Callable[[Callable[[int], str], date], date]
+
+# Порядок важен только для шаблонов, начинающихся в одной позиции
+BUILTIN_RELATIVE_RULES: List[Tuple[str, Resolver]] = [
+    (r'\b(?:на\s+)?послезавтра\b', lambda g, today: today + timedelta(days=2)),
+    (r'\b(?:на\s+)?завтра\b', lambda g, today: today + timedelta(days=1)),
+    (r'\bчерез\s+(\d+)\s+(?:день|дня|дней)\b', lambda g, today: today + timedelta(days=int(g(1)))),
+    (r'\bчерез\s+(\d+)\s+(?:неделю|недели|недель)\b', lambda g, today: today + timedelta(weeks=int(g(1)))),
+    (r'\bчерез\s+неделю\b', lambda g, today: today + timedelta(weeks=1)),
+    (r'\bчерез\s+месяц\b', lambda g, today: today + timedelta(days=30)),
+    (r'\bна\s+следующей\s+неделе\b', lambda g, today: today + timedelta(weeks=1)),
+]
+
+# В порядке приоритета: возвращается совпадение самого приоритетного шаблона
+BUILTIN_HISTORY_PATTERNS: List[str] = [
+    r'\d{1,2}\s+(?:' + _MONTHS_ALT + r')',
+    r'\d{1,2}\.\d{1,2}\.\d{2,4}',
+    r'(?:январ|феврал|март|апрел|ма|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]{0,2}\s+\d{4}',
+    r'период:\s*\d{2}\.\d{2}\.\d{4}-\d{2}\.\d{2}\.\d{4}',
+]
+
+_DATE_IN_QUERY = re.compile(r'(\d{1,2})\s+(' + _MONTHS_ALT + r')', re.IGNORECASE)
+
+
+def format_day_month(value: date) -> str:
+    return f"{value.day} {MONTHS_RU[value.month - 1]}"
+
+
+def _tenant_resolver(spec: dict) -> Optional[Resolver]:
+    if 'days' in spec:
+        days = int(spec['days'])
+        return lambda g, today: today + timedelta(days=days)
+    if 'weeks' in spec:
+        weeks = int(spec['weeks'])
+        return lambda g, today: today + timedelta(weeks=weeks)
+    if 'per_unit_days' in spec:
+        per_unit = int(spec['per_unit_days'])
+        return lambda g, today: today + timedelta(days=int(g(1)) * per_unit)
+    if 'weekday' in spec:
+        weekday = int(spec['weekday']) % 7
+        return lambda g, today: today + timedelta(days=(weekday - today.weekday()) % 7)
+    return None
+
+
+# Глобальные флаги в середине выражения — ошибка; номерные ссылки указывают на чужие группы
+_GLOBAL_FLAGS_RE = re.compile(r'\(\?[aiLmsux]+\)')
+_NUMBERED_BACKREF_RE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+
+def _valid_pattern(pattern: str) -> bool:
+    """Шаблон тенанта компилируется в той же именованной обёртке, что и в общем выражении"""
+    try:
+        if _GLOBAL_FLAGS_RE.search(pattern):
+            raise re.error('inline global flags are not allowed, use (?i:...)')
+        if _NUMBERED_BACKREF_RE.search(pattern):
+            raise re.error('numbered backreferences are not allowed')
+        re.compile(f'(?=(?P<t0>{pattern}))', re.IGNORECASE)
+        return True
+    except (re.error, TypeError) as e:
+        print(f"[query_preprocessing] invalid tenant pattern {pattern!r}: {e}")
+        return False
+
+
+class QueryPreprocessor:
+    """Скомпилированный набор шаблонов (встроенные + шаблоны тенанта)"""
+
+    def __init__(self, config: Optional[dict] = None):
+        config = config or {}
+        rules = list(BUILTIN_RELATIVE_RULES)
+        for spec in config.get('relative') or []:
+            try:
+                resolver = _tenant_resolver(spec)
+            except (TypeError, ValueError):
+                resolver = None
+            if resolver is not None and _valid_pattern(spec.get('pattern')):
+                rules.append((spec['pattern'], resolver))
+        history = list(BUILTIN_HISTORY_PATTERNS)
+        history += [p for p in (config.get('history') or []) if _valid_pattern(p)]
+        try:
+            self._compile(rules, history)
+        except re.error as e:
+            # Например, имя группы шаблона совпало с именем обёртки — работаем на встроенных правилах
+            print(f"[query_preprocessing] tenant patterns ignored: {e}")
+            self._compile(list(BUILTIN_RELATIVE_RULES), list(BUILTIN_HISTORY_PATTERNS))
+        self._message_date = functools.lru_cache(maxsize=QUERY_DATE_CACHE_SIZE)(self._scan_message)
+
+    def _compile(self, rules: List[Tuple[str, Resolver]], history: List[str]):
+        # Именованная обёртка на правило: номер её группы даёт смещение для групп шаблона
+        self._relative = re.compile(
+            '|'.join(f'(?P<r{i}>{pattern})' for i, (pattern, _) in enumerate(rules)),
+            re.IGNORECASE
+        )
+        self._resolvers = {
+            self._relative.groupindex[f'r{i}']: resolver for i, (_, resolver) in enumerate(rules)
+        }
+        # Lookahead находит в каждой позиции самый приоритетный шаблон, не поглощая текст
+        self._history = re.compile(
+            '(?=' + '|'.join(f'(?P<h{i}>{pattern})' for i, pattern in enumerate(history)) + ')',
+            re.IGNORECASE
+        )
+        self._history_groups = [self._history.groupindex[f'h{i}'] for i in range(len(history))]
+
+    def convert_relative_dates(self, text: str, today: Optional[date] = None) -> str:
+        """«завтра», «через 3 дня», ... → «19 октября»; каждое вхождение — по своему совпадению"""
+        today = today or now_moscow().date()
+
+        def replace(match):
+            # lastindex — группа, закрывшаяся последней, т.е. обёртка сработавшего правила
+            offset = match.lastindex
+            resolver = self._resolvers.get(offset)
+            if resolver is None:
+                return match.group()
+            date_str = format_day_month(resolver(lambda k: match.group(offset + k), today))
+            print(f"DEBUG: Converted relative date '{match.group()}' to '{date_str}'")
+            return date_str
+
+        return self._relative.sub(replace, text)
+
+    def _scan_message(self, text: str) -> Optional[str]:
+        best_priority, best = None, None
+        for match in self._history.finditer(text.lower()):
+            for priority, group_index in enumerate(self._history_groups):
+                if best_priority is not None and priority >= best_priority:
+                    break
+                value = match.group(group_index)
+                if value is not None:
+                    best_priority, best = priority, value
+                    break
+            if best_priority == 0:
+                break
+        return best
+
+    def extract_date_from_history(self, history_msgs: List[Dict]) -> Optional[str]:
+        """Дата из последнего сообщения пользователя, где она есть (история — от старых к новым)"""
+        for msg in reversed(history_msgs):
+            if msg['role'] == 'user':
+                found = self._message_date(msg['content'])
+                if found:
+                    return found
+        return None
+
+    def enrich_date_query(self, text: str, today: Optional[date] = None) -> str:
+        """«12 марта» → «12 марта Период: 01.03.2026-31.03.2026 12.03.2026» (формат как в документах)"""
+        match = _DATE_IN_QUERY.search(text)
+        if not match:
+            return text
+
+        today = today or now_moscow().date()
+        day_str = match.group(1)
+        month_num = MONTH_NUMBERS[match.group(2).lower()]
+        # Если дата в этом году уже прошла, имеется в виду следующий год
+        if month_num < today.month or (month_num == today.month and int(day_str) < today.day):
+            year = today.year + 1
+        else:
+            year = today.year
+
+        last_day = monthrange(year, month_num)[1]
+        period_str = f"Период: 01.{month_num:02d}.{year}-{last_day:02d}.{month_num:02d}.{year}"
+        date_str = f"{day_str}.{month_num:02d}.{year}"
+        enriched = f"{text} {period_str} {date_str}"
+        print(f"DEBUG: Enriched date query: '{text}' → '{enriched}'")
+        return enriched
+
+    def cache_info(self):
+        return self._message_date.cache_info()
+
+
+# json-ключ конфигурации тенанта → QueryPreprocessor
+_preprocessors: 'OrderedDict[str, QueryPreprocessor]' = OrderedDict()
+
+
+def get_query_preprocessor(config: Optional[dict] = None) -> QueryPreprocessor:
+    """Препроцессор для ai_settings.query_date_patterns; компилируется один раз на конфигурацию"""
+    key = json.dumps(config or {}, sort_keys=True, ensure_ascii=False)
+    preprocessor = _preprocessors.get(key)
+    if preprocessor is None:
+        preprocessor = QueryPreprocessor(config)
+        _preprocessors[key] = preprocessor
+        while len(_preprocessors) > QUERY_PREPROCESSORS_MAX:
+            _preprocessors.popitem(last=False)
+    else:
+        _preprocessors.move_to_end(key)
+    return preprocessor
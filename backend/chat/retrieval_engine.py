@@ -0,0 +1,255 @@
+"""Векторный поиск по чанкам тенанта на NumPy (матрица float32 + argpartition top-k)"""
+import json
+import os
+import sys
+from typing import Callable, FrozenSet, List, Optional, Tuple, Sequence
+
+import numpy as np
+
+from embedding_codec import decode_row_embedding
+
+# Гибридный отбор: кандидаты = vector top-N ∪ BM25 top-N, итог = (1-w)·cos + w·bm25/max(bm25)
+RAG_HYBRID_WEIGHT = float(os.environ.get('RAG_HYBRID_WEIGHT', '0.3'))
+RAG_VECTOR_CANDIDATES = int(os.environ.get('RAG_VECTOR_CANDIDATES', '50'))
+RAG_LEXICAL_CANDIDATES = int(os.environ.get('RAG_LEXICAL_CANDIDATES', '50'))
+# Длина tenant_chunks.chunk_clean (lexical_index.INDEX_MAX_CHARS_PER_CHUNK)
+STORED_CLEAN_MAX_CHARS = 2200
+
+
+def select_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Индексы k лучших значений по убыванию.
+    argpartition за O(n), затем сортировка только кандидатов.
+    При равных значениях порядок как у стабильной сортировки (меньший индекс раньше),
+    в том числе на границе k: argpartition выбирает из равных k-му значению произвольно,
+    поэтому в кандидаты берутся все такие индексы, а лишние отсекаются после сортировки.
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:k]
+
+
+class RetrievalEngine:
+    """Все эмбеддинги тенанта одной нормированной матрицей float32"""
+
+    def __init__(self, chunk_texts: Sequence[str], vectors: Sequence, chunk_ids: Sequence[int] = None,
+                 clean_texts: Sequence[Optional[str]] = None, token_sets: Sequence[Optional[FrozenSet[str]]] = None):
+        self.chunk_texts = list(chunk_texts)
+        self.chunk_ids = list(chunk_ids) if chunk_ids is not None else list(range(len(self.chunk_texts)))
+        # Предобработка из tenant_chunks (chunk_clean, chunk_tokens); None в строке — не посчитана
+        self.clean_texts = list(clean_texts) if clean_texts is not None else [None] * len(self.chunk_texts)
+        self.token_sets = list(token_sets) if token_sets is not None else [None] * len(self.chunk_texts)
+        # IVFIndex для крупных тенантов (ann_index.py); None — точный поиск
+        self.ann = None
+        # tenant_settings.chunks_version, из которой построен движок (embedding_cache.py)
+        self.chunks_version = None
+        # LexicalIndex (lexical_index.py) по тем же строкам; None — только векторный поиск
+        self.lexical = None
+        if not self.chunk_texts:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+            return
+
+        matrix = np.vstack([np.asarray(v, dtype=np.float32) for v in vectors])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # Нулевые векторы оставляем нулевыми — их similarity = 0, как в старом cosine_similarity
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+
+    @classmethod
+    def from_json_rows(cls, rows: Sequence[Tuple[str, str]]) -> 'RetrievalEngine':
+        """Строит движок из строк (chunk_text, embedding_text JSON)"""
+        texts = [row[0] for row in rows]
+        vectors = [json.loads(row[1]) for row in rows]
+        return cls(texts, vectors)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Tuple]) -> 'RetrievalEngine':
+        """
+        Строит движок из строк (id, chunk_text, embedding_bin, embedding_dim, embedding_text
+        [, chunk_clean, chunk_tokens]) — последние две NULL, пока строка не предобработана
+        """
+        ids = [row[0] for row in rows]
+        texts = [row[1] for row in rows]
+        vectors = [decode_row_embedding(row[2], row[3], row[4]) for row in rows]
+        clean_texts = [row[5] if len(row) > 5 else None for row in rows]
+        token_sets = [frozenset(row[6]) if len(row) > 6 and row[6] is not None else None for row in rows]
+        return cls(texts, vectors, chunk_ids=ids, clean_texts=clean_texts, token_sets=token_sets)
+
+    def __len__(self) -> int:
+        return len(self.chunk_texts)
+
+    @property
+    def nbytes(self) -> int:
+        """Примерный объём памяти: матрица + тексты чанков (для бюджета кэша)"""
+        ann_bytes = self.ann.nbytes if self.ann is not None else 0
+        lexical_bytes = self.lexical.nbytes if self.lexical is not None else 0
+        clean_bytes = sum(sys.getsizeof(t) for t in self.clean_texts if t is not None)
+        token_bytes = sum(sys.getsizeof(t) + 8 * len(t) for t in self.token_sets if t is not None)
+        return (int(self.matrix.nbytes) + sum(sys.getsizeof(t) for t in self.chunk_texts)
+                + 8 * len(self.chunk_ids) + ann_bytes + lexical_bytes + clean_bytes + token_bytes)
+
+    def _normalize_query(self, query_embedding: Sequence[float]) -> Optional[np.ndarray]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+        return query / norm
+
+    def score(self, query_embedding: Sequence[float]) -> np.ndarray:
+        """Косинусная близость запроса ко всем чанкам одним matrix-vector произведением"""
+        if not self.chunk_texts:
+            return np.zeros(0, dtype=np.float32)
+        query = self._normalize_query(query_embedding)
+        if query is None:
+            return np.zeros(len(self.chunk_texts), dtype=np.float32)
+        return self.matrix @ query
+
+    def top_k_indices(self, query_embedding: Sequence[float], k: int, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (индексы строк, similarity) k лучших чанков по убыванию.
+        При наличии IVF-индекса считаются только строки из ANN_NPROBE ближайших списков.
+        """
+        if self.ann is None or exact or not self.chunk_texts:
+            scores = self.score(query_embedding)
+            best = select_top_k(scores, k)
+            return best, scores[best]
+
+        query = self._normalize_query(query_embedding)
+        if query is None:
+            return self.top_k_indices(query_embedding, k, exact=True)
+        rows = self.ann.candidates(query)
+        scores = self.matrix[rows] @ query
+        best = select_top_k(scores, k)
+        return rows[best], scores[best]
+
+    def top_k(self, query_embedding: Sequence[float], k: int, exact: bool = False) -> List[Tuple[str, float]]:
+        """Возвращает [(chunk_text, similarity)] для k лучших чанков по убыванию"""
+        rows, scores = self.top_k_indices(query_embedding, k, exact=exact)
+        return [(self.chunk_texts[i], float(s)) for i, s in zip(rows, scores)]
+
+    def hybrid_top_k_indices(self, query_embedding: Sequence[float], query_tokens: Sequence[str], k: int,
+                             weight: float = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (индексы строк, cosine similarity) k лучших чанков по гибридной оценке.
+        Порядок — по (1-w)·cos + w·нормированный BM25, similarity в ответе остаётся косинусной:
+        пороги quality gate рассчитаны на неё.
+        """
+        weight = RAG_HYBRID_WEIGHT if weight is None else weight
+        query = self._normalize_query(query_embedding)
+        if self.lexical is None or not query_tokens or weight <= 0 or query is None:
+            return self.top_k_indices(query_embedding, k)
+
+        bm25 = self.lexical.scores(query_tokens)
+        lexical_rows = select_top_k(bm25, RAG_LEXICAL_CANDIDATES)
+        lexical_rows = lexical_rows[bm25[lexical_rows] > 0]
+        if lexical_rows.shape[0] == 0:
+            return self.top_k_indices(query_embedding, k)
+
+        vector_rows, _ = self.top_k_indices(query_embedding, max(k, RAG_VECTOR_CANDIDATES))
+        rows = np.unique(np.concatenate([vector_rows, lexical_rows]))
+        cos = self.matrix[rows] @ query
+        lexical = bm25[rows] / bm25[lexical_rows[0]]
+        best = select_top_k((1.0 - weight) * cos + weight * lexical, k)
+        return rows[best], cos[best]
+
+    def retrieve(self, query_embedding: Sequence[float], k: int, query_tokens: Sequence[str] = None) -> 'RetrievalResult':
+        """Один отбор k кандидатов для всех попыток quality gate; с query_tokens — гибридный"""
+        if query_tokens:
+            rows, scores = self.hybrid_top_k_indices(query_embedding, query_tokens, k)
+        else:
+            rows, scores = self.top_k_indices(query_embedding, k)
+        return RetrievalResult(
+            [self.chunk_texts[i] for i in rows],
+            [float(x) for x in scores],
+            [self.chunk_ids[i] for i in rows],
+            self._chunk_tokens(rows),
+            [self.clean_texts[i] for i in rows]
+        )
+
+    def _chunk_tokens(self, rows) -> Optional[List[FrozenSet[str]]]:
+        """Токены из tenant_chunks.chunk_tokens, для непредобработанных строк — из лексического индекса"""
+        tokens = []
+        for i in rows:
+            stored = self.token_sets[i]
+            if stored is None:
+                if self.lexical is None:
+                    return None
+                stored = self.lexical.chunk_tokens(i)
+            tokens.append(stored)
+        return tokens
+
+
+class RetrievalResult:
+    """
+    Кандидаты одного поиска в порядке ранжирования. При векторном поиске это порядок
+    убывания sims; при гибридном — порядок убывания смешанной оценки с BM25, а sims
+    остаются косинусными и поэтому не обязательно убывают: sims[0] — не всегда максимум,
+    лучшее сходство — max(sims). Обе попытки quality gate (top_k по умолчанию
+    и RAG_TOPK_FALLBACK) берут префиксы этого списка. Очищенный текст берётся из tenant_chunks.chunk_clean; sanitize-регулярки
+    запускаются только для строк без него, и не больше одного раза на чанк.
+    """
+
+    def __init__(self, chunk_texts: List[str], sims: List[float], chunk_ids: List[int] = None,
+                 chunk_tokens: List[FrozenSet[str]] = None, clean_texts: List[Optional[str]] = None):
+        self.chunk_texts = chunk_texts
+        self.sims = sims
+        self.chunk_ids = chunk_ids if chunk_ids is not None else list(range(len(chunk_texts)))
+        # Токены чанков из лексического индекса — overlap без токенизации контекста
+        self.chunk_tokens = chunk_tokens
+        # tenant_chunks.chunk_clean по строкам; None — очищаем sanitize
+        self.stored_clean = clean_texts
+        self._clean: List[str] = []
+        self._clean_max_chars = None
+
+    @classmethod
+    def from_scored(cls, scored_chunks: List[Tuple[str, float]], k: int) -> 'RetrievalResult':
+        selected = top_k_scored(scored_chunks, k)
+        return cls([t for t, _ in selected], [s for _, s in selected])
+
+    def __len__(self) -> int:
+        return len(self.chunk_texts)
+
+    def scored(self, top_k: int = None) -> List[Tuple[str, float]]:
+        end = len(self.chunk_texts) if top_k is None else top_k
+        return list(zip(self.chunk_texts[:end], self.sims[:end]))
+
+    def clean_parts(self, top_k: int, sanitize: Callable[[str], str], max_chars_per_chunk: int) -> List[str]:
+        """Очищенные и обрезанные тексты первых top_k чанков (пустые строки для полностью вычищенных)"""
+        if self._clean_max_chars != max_chars_per_chunk:
+            self._clean = []
+            self._clean_max_chars = max_chars_per_chunk
+        end = min(top_k, len(self.chunk_texts))
+        for i in range(len(self._clean), end):
+            stored = self.stored_clean[i] if self.stored_clean is not None else None
+            if stored is not None and max_chars_per_chunk <= STORED_CLEAN_MAX_CHARS:
+                self._clean.append(stored[:max_chars_per_chunk].strip())
+                continue
+            clean = sanitize(self.chunk_texts[i])
+            self._clean.append(clean[:max_chars_per_chunk].strip() if clean else '')
+        return self._clean[:end]
+
+    def context(self, top_k: int, sanitize: Callable[[str], str], max_chars_per_chunk: int = 2200) -> Tuple[str, List[float]]:
+        """(контекст, similarities) для префикса top_k — то же, что build_context_with_scores"""
+        parts = [p for p in self.clean_parts(top_k, sanitize, max_chars_per_chunk) if p]
+        return "\n\n".join(parts).strip(), self.sims[:top_k]
+
+    def context_tokens(self, top_k: int) -> Optional[FrozenSet[str]]:
+        """Токены контекста префикса top_k из постингов; None, если индекса нет"""
+        if self.chunk_tokens is None:
+            return None
+        return frozenset().union(*self.chunk_tokens[:top_k])
+
+
+def top_k_scored(scored_chunks: List[Tuple[str, float]], k: int) -> List[Tuple[str, float]]:
+    """top-k для уже посчитанного списка (chunk_text, similarity) без полной сортировки"""
+    if not scored_chunks:
+        return []
+    scores = np.fromiter((s for _, s in scored_chunks), dtype=np.float64, count=len(scored_chunks))
+    return [scored_chunks[i] for i in select_top_k(scores, k)]
@@ -0,0 +1,197 @@
+"""
+Все настройки тенанта для chat одним запросом: ai_settings, эмбеддинги, quality gate,
+прокси, API ключи, форматирование по мессенджерам и дефолтный промпт.
+
+Кэш живёт между тёплыми вызовами: запись действует TENANT_CONTEXT_TTL секунд и пока
+tenant_settings.settings_version не изменилась. Версию увеличивают функции, меняющие
+настройки (update-ai-settings, manage-api-keys, manage-proxy-settings и т.д.), поэтому
+проверка свежести — одна выборка по PK, которая заодно отдаёт chunks_version.
+"""
+import os
+import json
+import time
+from typing import Dict, Optional, Tuple
+
+from system_prompt import DEFAULT_SYSTEM_PROMPT
+
+TENANT_CONTEXT_TTL = int(os.environ.get('TENANT_CONTEXT_TTL', '60'))
+
+# tenant_id -> (settings_version, expires_at, TenantContext)
+_contexts: Dict[int, Tuple[int, float, 'TenantContext']] = {}
+
+
+def parse_proxy(proxy_string: str):
+    """Парсит прокси из формата ip:port@login:pass в dict для httpx"""
+    if not proxy_string or not proxy_string.strip():
+        return None
+
+    try:
+        # Формат в БД: ip:port@login:pass
+        # Нужный формат: http://login:pass@ip:port
+        if '@' in proxy_string:
+            ip_port, login_pass = proxy_string.split('@', 1)
+            proxy_url = f'http://{login_pass}@{ip_port}'
+        else:
+            proxy_url = f'http://{proxy_string}'
+
+        return {
+            'http://': proxy_url,
+            'https://': proxy_url
+        }
+    except Exception as e:
+        print(f'Failed to parse proxy: {e}')
+        return None
+
+
+def default_formatting(messenger: str) -> dict:
+    return {
+        'use_emoji': True,
+        'use_markdown': messenger == 'telegram',
+        'use_lists_formatting': True,
+        'custom_emoji_map': {},
+        'list_bullet_char': '•',
+        'numbered_list_char': '▫️'
+    }
+
+
+def _json(value, default):
+    if value is None:
+        return default
+    if isinstance(value, (dict, list)):
+        return value
+    return json.loads(value)
+
+
+class TenantContext:
+    """Снимок настроек тенанта; заменяет get_proxy_settings, get_tenant_api_key и get_formatting_settings"""
+
+    def __init__(self, tenant_id: int, settings_version: int, row: Optional[Tuple]):
+        self.tenant_id = tenant_id
+        self.settings_version = settings_version
+        self.chunks_version = 0
+
+        (ai_settings, embedding_provider, embedding_query_model, quality_gate_settings,
+         use_proxy_deepseek, proxy_deepseek, use_proxy_openrouter, proxy_openrouter,
+         use_proxy_proxyapi, proxy_proxyapi, use_proxy_openai, proxy_openai,
+         has_settings, default_prompt, api_keys, formatting) = row
+
+        self.has_settings = bool(has_settings)
+        self.ai_settings = ai_settings or {}
+        self.embedding_provider = embedding_provider or 'yandex'
+        self.embedding_query_model = embedding_query_model or 'text-search-query'
+        self.quality_gate_settings = quality_gate_settings or {}
+        self.default_prompt = default_prompt or DEFAULT_SYSTEM_PROMPT
+
+        proxies = {
+            'deepseek': (use_proxy_deepseek, proxy_deepseek),
+            'openrouter': (use_proxy_openrouter, proxy_openrouter),
+            'proxyapi': (use_proxy_proxyapi, proxy_proxyapi),
+            'openai': (use_proxy_openai, proxy_openai),
+        }
+        self.proxy_settings = {} if not self.has_settings else {
+            provider: {
+                'enabled': enabled or False,
+                'proxy': parse_proxy(proxy) if enabled and proxy else None
+            }
+            for provider, (enabled, proxy) in proxies.items()
+        }
+
+        self.api_keys = {(provider, key_name): value for provider, key_name, value in _json(api_keys, [])}
+        self.formatting_settings = {}
+        for item in _json(formatting, []):
+            self.formatting_settings[item['messenger']] = {
+                'use_emoji': item['use_emoji'],
+                'use_markdown': item['use_markdown'],
+                'use_lists_formatting': item['use_lists_formatting'],
+                'custom_emoji_map': item['custom_emoji_map'] if item['custom_emoji_map'] else {},
+                'list_bullet_char': item['list_bullet_char'],
+                'numbered_list_char': item['numbered_list_char']
+            }
+
+    def api_key(self, provider: str, key_name: str) -> Tuple[Optional[str], Optional[dict]]:
+        """Тот же контракт, что у get_tenant_api_key: (значение, None) или (None, HTTP-ошибка)"""
+        value = self.api_keys.get((provider, key_name))
+
+        if value is None or (value == 'sk-proxy-placeholder' and provider == 'proxyapi'):
+            # Fallback на секреты проекта для ProxyAPI
+            if provider == 'proxyapi' and key_name == 'api_key':
+                project_key = os.environ.get('PROXYAPI_API_KEY')
+                if project_key:
+                    return project_key, None
+
+        if value is None:
+            print(f"❌ DEBUG: No key found for tenant_id={self.tenant_id}, provider={provider}, key_name={key_name}")
+            error_msg = f"API ключ не настроен: {provider}.{key_name}. Добавьте ключи в админ-панели."
+            return None, {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': error_msg}),
+                'isBase64Encoded': False
+            }
+        return value, None
+
+    def formatting(self, messenger: str) -> dict:
+        return self.formatting_settings.get(messenger) or default_formatting(messenger)
+
+
+def _fetch_versions(cur, tenant_id: int) -> Tuple[int, int]:
+    cur.execute("""
+        SELECT settings_version, chunks_version
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings
+        WHERE tenant_id = %s
+    """, (tenant_id,))
+    row = cur.fetchone()
+    if not row:
+        return 0, 0
+    return int(row[0] or 0), int(row[1] or 0)
+
+
+def _fetch_context(cur, tenant_id: int) -> Tuple[int, int, Tuple]:
+    """Один запрос: tenant_settings + default_settings + tenant_api_keys + messenger_formatting_settings"""
+    cur.execute("""
+        SELECT
+            ts.settings_version, ts.chunks_version,
+            ts.ai_settings, ts.embedding_provider, ts.embedding_query_model, ts.quality_gate_settings,
+            ts.use_proxy_deepseek, ts.proxy_deepseek,
+            ts.use_proxy_openrouter, ts.proxy_openrouter,
+            ts.use_proxy_proxyapi, ts.proxy_proxyapi,
+            ts.use_proxy_openai, ts.proxy_openai,
+            ts.tenant_id IS NOT NULL,
+            (SELECT setting_value FROM t_p56134400_telegram_ai_bot_pdf.default_settings
+             WHERE setting_key = 'default_system_prompt'),
+            (SELECT COALESCE(json_agg(json_build_array(k.provider, k.key_name, k.key_value)), '[]'::json)
+             FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys k
+             WHERE k.tenant_id = t.id AND k.is_active = true),
+            (SELECT COALESCE(json_agg(row_to_json(f)), '[]'::json)
+             FROM (
+                 SELECT messenger, use_emoji, use_markdown, use_lists_formatting,
+                        custom_emoji_map, list_bullet_char, numbered_list_char
+                 FROM t_p56134400_telegram_ai_bot_pdf.messenger_formatting_settings
+                 WHERE tenant_id = t.id
+             ) f)
+        FROM (SELECT %s::integer AS id) t
+        LEFT JOIN t_p56134400_telegram_ai_bot_pdf.tenant_settings ts ON ts.tenant_id = t.id
+    """, (tenant_id,))
+    row = cur.fetchone()
+    return int(row[0] or 0), int(row[1] or 0), row[2:]
+
+
+def load_tenant_context(cur, tenant_id: int) -> TenantContext:
+    """Контекст тенанта из кэша (проверка версии — одна выборка по PK) или одним полным запросом"""
+    now = time.time()
+    entry = _contexts.get(tenant_id)
+    if entry is not None and entry[1] > now:
+        settings_version, chunks_version = _fetch_versions(cur, tenant_id)
+        if settings_version == entry[0]:
+            ctx = entry[2]
+            ctx.chunks_version = chunks_version
+            print(f"[tenant_context] HIT tenant={tenant_id} settings_version={settings_version}")
+            return ctx
+
+    settings_version, chunks_version, row = _fetch_context(cur, tenant_id)
+    ctx = TenantContext(tenant_id, settings_version, row)
+    ctx.chunks_version = chunks_version
+    _contexts[tenant_id] = (settings_version, now + TENANT_CONTEXT_TTL, ctx)
+    print(f"[tenant_context] MISS tenant={tenant_id} settings_version={settings_version} api_keys={len(ctx.api_keys)}")
+    return ctx
+
@@ -1,6 +1,22 @@
-import psycopg2
-import os
-from typing import Optional
+"""
+Учёт токенов в token_usage.
+
+В обработчике, обёрнутом @buffered_token_usage, записи копятся в буфере своего вызова
+и пишутся одним многострочным INSERT в конце (и при исключении). Буфер хранится в
+contextvars: параллельные вызовы в одном контейнере не видят чужих записей, а фоновые
+потоки пишут в буфер вызова, только если задача запущена в копии его контекста
+(contextvars.copy_context().run). Вне буфера и после его сброса (например, токены
+проигравшего хедж-запроса) log_token_usage пишет сразу, как раньше.
+"""
+import json
+import functools
+import threading
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+from db_pool import get_connection, release_connection
 
 # Тарифы провайдеров (руб за 1000 токенов)
 # Курс: 1$ = 100₽ (примерно)
@@ -47,49 +63,126 @@ PRICING = {
     'anthropic/claude-3.5-sonnet': 0.300,
 }
 
+
+class _TokenUsageBatch:
+    """Записи одного вызова handler; после сброса (closed) новые записи пишутся сразу"""
+
+    def __init__(self):
+        self.rows: List[Tuple] = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def add(self, row: Tuple) -> bool:
+        with self.lock:
+            if self.closed:
+                return False
+            self.rows.append(row)
+            return True
+
+    def close(self) -> List[Tuple]:
+        with self.lock:
+            self.closed = True
+            rows, self.rows = self.rows, []
+        return rows
+
+
+# Буфер текущего вызова; None — писать сразу
+_batch: ContextVar[Optional[_TokenUsageBatch]] = ContextVar('token_usage_batch', default=None)
+
+
+def _insert_rows(rows: List[Tuple]):
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        execute_values(cur, """
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.token_usage
+            (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata)
+            VALUES %s
+        """, rows, page_size=500)
+        conn.commit()
+        cur.close()
+    finally:
+        release_connection(conn)
+
+
+def begin_token_usage_batch():
+    """Начинает буферизацию записей для текущего вызова; возвращает токен для flush_token_usage"""
+    return _batch.set(_TokenUsageBatch())
+
+
+def flush_token_usage(token=None) -> int:
+    """Пишет накопленные записи одним INSERT и выключает буферизацию; возвращает число записей"""
+    batch = _batch.get()
+    if token is not None:
+        _batch.reset(token)
+    else:
+        _batch.set(None)
+    if batch is None:
+        return 0
+    rows = batch.close()
+    if not rows:
+        return 0
+    try:
+        _insert_rows(rows)
+    except Exception as e:
+        print(f"Error flushing token usage ({len(rows)} rows): {e}")
+        return 0
+    return len(rows)
+
+
+def buffered_token_usage(handler):
+    """Декоратор handler: записи токенов за вызов пишутся одним INSERT, в том числе при исключении"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        token = begin_token_usage_batch()
+        try:
+            return handler(event, context)
+        finally:
+            flushed = flush_token_usage(token)
+            if flushed:
+                print(f"[token_logger] flushed {flushed} token_usage rows")
+    return wrapper
+
+
 def log_token_usage(
     tenant_id: int,
     operation_type: str,
     model: str,
     tokens_used: int,
     request_id: Optional[str] = None,
-    metadata: Optional[dict] = None
+    metadata: Optional[dict] = None,
+    cost_rubles: Optional[float] = None
 ):
     """
     Логирует использование токенов в БД
     
     Args:
         tenant_id: ID тенанта
-        operation_type: Тип операции ('embedding_create', 'embedding_query', 'gpt_response')
+        operation_type: Тип операции ('embedding_create', 'embedding_query', 'embedding_query_cache_hit', 'gpt_response')
         model: Название модели ('text-search-doc', 'yandexgpt-lite' и т.д.)
         tokens_used: Количество использованных токенов
         request_id: ID запроса (опционально)
         metadata: Дополнительная информация (опционально)
+        cost_rubles: Готовая стоимость, если тариф не по токенам (например, секунды аудио)
     """
     try:
-        # Вычисляем стоимость
-        price_per_1k = PRICING.get(model, 0)
-        cost_rubles = (tokens_used / 1000.0) * price_per_1k
-        
-        # Если цена не найдена, выводим предупреждение
-        if price_per_1k == 0 and model not in PRICING:
-            print(f"WARNING: No pricing found for model '{model}', cost set to 0")
-        
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        
-        import json
+        if cost_rubles is None:
+            # Вычисляем стоимость
+            price_per_1k = PRICING.get(model, 0)
+            cost_rubles = (tokens_used / 1000.0) * price_per_1k
+
+            # Если цена не найдена, выводим предупреждение
+            if price_per_1k == 0 and model not in PRICING:
+                print(f"WARNING: No pricing found for model '{model}', cost set to 0")
+
         metadata_json = json.dumps(metadata) if metadata else None
-        
-        cur.execute("""
-            INSERT INTO t_p56134400_telegram_ai_bot_pdf.token_usage 
-            (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata_json))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        
+        row = (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata_json)
+
+        batch = _batch.get()
+        if batch is not None and batch.add(row):
+            return
+
+        _insert_rows([row])
+
     except Exception as e:
-        print(f"Error logging token usage: {e}")
\ No newline at end of file
+        print(f"Error logging token usage: {e}")
@@ -0,0 +1,155 @@
+"""
+Стартовый top-k quality gate для каждого тенанта по его собственной статистике.
+
+Первая попытка gate идёт либо с базовым top-k (короче контекст), либо сразу
+с расширенным RAG_TOPK_FALLBACK (без второго прохода). Контроллер оценивает долю
+запросов тенанта, которым с базового top-k понадобился второй проход (EWMA), и стартует
+с расширенного, когда доля не ниже RAG_LOW_OVERLAP_THRESHOLD. В этом режиме каждый
+RAG_TOPK_PROBE_EVERY-й запрос всё равно начинается с базового, чтобы оценка не застывала.
+
+Состояние хранится в tenant_topk_state и кэшируется в процессе на RAG_TOPK_STATE_TTL секунд.
+Первое состояние тенанта считается по последним записям tenant_quality_gate_logs.
+Обновление — один UPSERT в транзакции записи лога gate, поэтому контейнеры не затирают
+наблюдения друг друга.
+"""
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+RAG_LOW_OVERLAP_WINDOW = int(os.environ.get('RAG_LOW_OVERLAP_WINDOW', '50'))
+RAG_LOW_OVERLAP_THRESHOLD = float(os.environ.get('RAG_LOW_OVERLAP_THRESHOLD', '0.25'))
+RAG_LOW_OVERLAP_START_TOPK5 = os.environ.get('RAG_LOW_OVERLAP_START_TOPK5', 'true').lower() == 'true'
+RAG_TOPK_PROBE_EVERY = int(os.environ.get('RAG_TOPK_PROBE_EVERY', '10'))
+RAG_TOPK_STATE_TTL = int(os.environ.get('RAG_TOPK_STATE_TTL', '60'))
+# Вес нового наблюдения: как у скользящего окна длиной RAG_LOW_OVERLAP_WINDOW
+TOPK_EWMA_ALPHA = 2.0 / (RAG_LOW_OVERLAP_WINDOW + 1)
+
+# tenant_id -> (expires_at, TopKState)
+_states: Dict[int, Tuple[float, 'TopKState']] = {}
+
+
+class TopKState:
+    """Доля вторых проходов при старте с базового top-k и счётчик до следующей пробы"""
+
+    def __init__(self, second_pass_rate: float = 0.0, samples: int = 0, since_probe: int = 0):
+        self.second_pass_rate = second_pass_rate
+        self.samples = samples
+        self.since_probe = since_probe
+
+    def start_top_k(self, default_top_k: int, fallback_top_k: int, fallback_allowed: bool = True) -> int:
+        if not (RAG_LOW_OVERLAP_START_TOPK5 and fallback_allowed) or fallback_top_k <= default_top_k:
+            return default_top_k
+        if self.second_pass_rate < RAG_LOW_OVERLAP_THRESHOLD:
+            return default_top_k
+        if self.since_probe + 1 >= RAG_TOPK_PROBE_EVERY:
+            return default_top_k
+        return fallback_top_k
+
+    def to_dict(self) -> dict:
+        return {
+            'second_pass_rate': round(self.second_pass_rate, 3),
+            'samples': self.samples,
+            'since_probe': self.since_probe,
+        }
+
+
+def _bootstrap_from_logs(cur, tenant_id: int, default_top_k: int) -> TopKState:
+    """
+    Оценка по последним RAG_LOW_OVERLAP_WINDOW записям лога gate (от старых к новым).
+    Второй проход — top_k_used > start_top_k. Для записей до появления start_top_k
+    используется прежний признак: итоговая причина low_overlap.
+    """
+    cur.execute("""
+        SELECT start_top_k, top_k_used, gate_reason
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_quality_gate_logs
+        WHERE tenant_id = %s
+        ORDER BY id DESC
+        LIMIT %s
+    """, (tenant_id, RAG_LOW_OVERLAP_WINDOW))
+    state = TopKState()
+    for start_top_k, top_k_used, gate_reason in reversed(cur.fetchall()):
+        if start_top_k is None:
+            observed = 1.0 if (gate_reason or '').startswith('low_overlap') else 0.0
+        elif start_top_k > default_top_k:
+            # Старт сразу с расширенного: про базовый top-k запись ничего не говорит
+            continue
+        else:
+            observed = 1.0 if top_k_used is not None and top_k_used > start_top_k else 0.0
+        rate = observed if not state.samples else (1 - TOPK_EWMA_ALPHA) * state.second_pass_rate + TOPK_EWMA_ALPHA * observed
+        state = TopKState(rate, state.samples + 1)
+    return state
+
+
+def load_topk_state(cur, tenant_id: int, default_top_k: int) -> TopKState:
+    """Состояние из кэша процесса, иначе из tenant_topk_state, иначе по логам gate"""
+    cached = _states.get(tenant_id)
+    if cached and cached[0] > time.time():
+        return cached[1]
+
+    try:
+        cur.execute("SAVEPOINT topk_controller")
+        cur.execute("""
+            SELECT second_pass_rate, samples, since_probe
+            FROM t_p56134400_telegram_ai_bot_pdf.tenant_topk_state
+            WHERE tenant_id = %s
+        """, (tenant_id,))
+        row = cur.fetchone()
+        if row:
+            state = TopKState(float(row[0]), int(row[1]), int(row[2]))
+        else:
+            state = _bootstrap_from_logs(cur, tenant_id, default_top_k)
+            cur.execute("""
+                INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_topk_state
+                (tenant_id, second_pass_rate, samples, since_probe, updated_at)
+                VALUES (%s, %s, %s, 0, NOW())
+                ON CONFLICT (tenant_id) DO NOTHING
+            """, (tenant_id, state.second_pass_rate, state.samples))
+            print(f"[topk_controller] tenant={tenant_id}: bootstrapped from gate logs {state.to_dict()}")
+        cur.execute("RELEASE SAVEPOINT topk_controller")
+    except Exception as e:
+        # Без состояния стартуем с базового top-k, транзакция запроса продолжается
+        print(f"[topk_controller] load error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT topk_controller")
+        state = TopKState()
+    _states[tenant_id] = (time.time() + RAG_TOPK_STATE_TTL, state)
+    return state
+
+
+def record_topk_outcome(cur, tenant_id: int, start_top_k: int, default_top_k: int,
+                        needed_fallback: bool) -> Optional[TopKState]:
+    """
+    Учитывает исход первой попытки gate (needed_fallback — low_overlap на базовом top-k,
+    даже если второй проход не делался из-за дедлайна). Наблюдение есть только при старте
+    с базового top-k; старт с расширенного лишь приближает следующую пробу.
+    Коммит — вместе с логом gate.
+    """
+    observed = start_top_k <= default_top_k
+    x = 1.0 if (observed and needed_fallback) else 0.0
+    try:
+        cur.execute("SAVEPOINT topk_controller")
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_topk_state AS s
+            (tenant_id, second_pass_rate, samples, since_probe, updated_at)
+            VALUES (%(tenant_id)s, %(x)s, %(n)s, %(probe)s, NOW())
+            ON CONFLICT (tenant_id) DO UPDATE SET
+                second_pass_rate = CASE WHEN %(observed)s
+                    THEN CASE WHEN s.samples = 0 THEN %(x)s
+                              ELSE (1 - %(alpha)s) * s.second_pass_rate + %(alpha)s * %(x)s END
+                    ELSE s.second_pass_rate END,
+                samples = s.samples + %(n)s,
+                since_probe = CASE WHEN %(observed)s THEN 0 ELSE s.since_probe + 1 END,
+                updated_at = NOW()
+            RETURNING second_pass_rate, samples, since_probe
+        """, {
+            'tenant_id': tenant_id, 'x': x, 'n': 1 if observed else 0, 'probe': 0 if observed else 1,
+            'observed': observed, 'alpha': TOPK_EWMA_ALPHA
+        })
+        row = cur.fetchone()
+        cur.execute("RELEASE SAVEPOINT topk_controller")
+    except Exception as e:
+        print(f"[topk_controller] update error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT topk_controller")
+        return None
+    state = TopKState(float(row[0]), int(row[1]), int(row[2]))
+    _states[tenant_id] = (time.time() + RAG_TOPK_STATE_TTL, state)
+    return state
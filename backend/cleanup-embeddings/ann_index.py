@@ -0,0 +1,185 @@
+"""
+IVF-индекс (сферический k-means) для приближённого поиска по чанкам крупных тенантов.
+
+Строится в process-pdf после загрузки документа и хранится в tenant_ann_index
+с той же chunks_version, что и tenant_chunks. chat использует его, только если
+у тенанта не меньше ANN_MIN_CHUNKS чанков и версия индекса совпадает с текущей.
+"""
+import os
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+# Ниже ~10k чанков точный поиск почти так же быстр (bench_ann_recall: при 2000 выигрыш ~1.1x
+# при nprobe=10), а индекс приходится хранить и перестраивать
+ANN_MIN_CHUNKS = int(os.environ.get('ANN_MIN_CHUNKS', '10000'))
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', '10'))
+ANN_KMEANS_ITERATIONS = int(os.environ.get('ANN_KMEANS_ITERATIONS', '12'))
+
+
+def default_n_lists(n_vectors: int) -> int:
+    return int(min(1024, max(1, round(np.sqrt(n_vectors)))))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class IVFIndex:
+    """Центроиды + номер списка для каждого чанка (по chunk_id)"""
+
+    def __init__(self, centroids: np.ndarray, chunk_ids: Sequence[int], assignments: np.ndarray):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        # Позиции строк матрицы движка по спискам; заполняется в bind()
+        self.lists = None
+
+    @property
+    def n_lists(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        total = self.centroids.nbytes + self.chunk_ids.nbytes + self.assignments.nbytes
+        if self.lists is not None:
+            total += sum(lst.nbytes for lst in self.lists)
+        return int(total)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, chunk_ids: Sequence[int], n_lists: int = None,
+              iterations: int = None, seed: int = 0) -> 'IVFIndex':
+        """Сферический k-means по нормированным векторам (matrix — строки эмбеддингов)"""
+        data = _normalize_rows(np.asarray(matrix, dtype=np.float32))
+        n = data.shape[0]
+        if n_lists is None:
+            n_lists = default_n_lists(n)
+        n_lists = max(1, min(n_lists, n))
+        if iterations is None:
+            iterations = ANN_KMEANS_ITERATIONS
+
+        rng = np.random.default_rng(seed)
+        centroids = data[rng.choice(n, size=n_lists, replace=False)].copy()
+        assignments = np.zeros(n, dtype=np.int32)
+
+        for iteration in range(iterations):
+            new_assignments = np.argmax(data @ centroids.T, axis=1).astype(np.int32)
+            if iteration > 0 and np.array_equal(new_assignments, assignments):
+                break
+            assignments = new_assignments
+
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, data)
+            counts = np.bincount(assignments, minlength=n_lists)
+            empty = np.flatnonzero(counts == 0)
+            if empty.size:
+                # Пустые кластеры пересеиваем случайными точками
+                sums[empty] = data[rng.choice(n, size=empty.size, replace=False)]
+            centroids = _normalize_rows(sums)
+
+        assignments = np.argmax(data @ centroids.T, axis=1).astype(np.int32)
+        return cls(centroids, chunk_ids, assignments)
+
+    def bind(self, engine_chunk_ids: Sequence[int]) -> bool:
+        """
+        Раскладывает строки матрицы движка по спискам IVF.
+        False, если индекс не покрывает все чанки движка (устарел) — тогда нужен точный поиск.
+        """
+        engine_ids = np.asarray(engine_chunk_ids, dtype=np.int64)
+        if engine_ids.shape[0] != self.chunk_ids.shape[0]:
+            return False
+
+        order = np.argsort(self.chunk_ids)
+        sorted_ids = self.chunk_ids[order]
+        pos = np.searchsorted(sorted_ids, engine_ids)
+        pos[pos >= sorted_ids.shape[0]] = 0
+        if not np.array_equal(sorted_ids[pos], engine_ids):
+            return False
+
+        row_lists = self.assignments[order][pos]
+        rows_by_list = np.argsort(row_lists, kind='stable')
+        bounds = np.searchsorted(row_lists[rows_by_list], np.arange(self.n_lists + 1))
+        self.lists = [rows_by_list[bounds[i]:bounds[i + 1]] for i in range(self.n_lists)]
+        return True
+
+    def candidates(self, query: np.ndarray, nprobe: int = None) -> np.ndarray:
+        """Строки матрицы из nprobe ближайших к запросу списков"""
+        if nprobe is None:
+            nprobe = ANN_NPROBE
+        nprobe = max(1, min(nprobe, self.n_lists))
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([self.lists[i] for i in probe]))
+
+    def to_db_row(self) -> Tuple[int, int, bytes, bytes, bytes]:
+        """(n_lists, dim, centroids, chunk_ids, assignments) для tenant_ann_index"""
+        return (
+            self.n_lists,
+            int(self.centroids.shape[1]),
+            self.centroids.astype('<f4').tobytes(),
+            self.chunk_ids.astype('<i8').tobytes(),
+            self.assignments.astype('<i4').tobytes(),
+        )
+
+    @classmethod
+    def from_db_row(cls, n_lists: int, dim: int, centroids, chunk_ids, assignments) -> 'IVFIndex':
+        return cls(
+            np.frombuffer(centroids, dtype='<f4').reshape(n_lists, dim),
+            np.frombuffer(chunk_ids, dtype='<i8'),
+            np.frombuffer(assignments, dtype='<i4'),
+        )
+
+
+def load_ann_index(cur, tenant_id: int, chunks_version: int) -> Optional[IVFIndex]:
+    """Индекс из БД, только если он построен для текущей версии чанков"""
+    cur.execute("""
+        SELECT n_lists, dim, centroids, chunk_ids, assignments
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_ann_index
+        WHERE tenant_id = %s AND chunks_version = %s
+    """, (tenant_id, chunks_version))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return IVFIndex.from_db_row(*row)
+
+
+def save_ann_index(cur, tenant_id: int, chunks_version: int, index: IVFIndex):
+    n_lists, dim, centroids, chunk_ids, assignments = index.to_db_row()
+    cur.execute("""
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_ann_index
+        (tenant_id, chunks_version, n_lists, dim, centroids, chunk_ids, assignments, built_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (tenant_id) DO UPDATE SET
+            chunks_version = EXCLUDED.chunks_version,
+            n_lists = EXCLUDED.n_lists,
+            dim = EXCLUDED.dim,
+            centroids = EXCLUDED.centroids,
+            chunk_ids = EXCLUDED.chunk_ids,
+            assignments = EXCLUDED.assignments,
+            built_at = EXCLUDED.built_at
+    """, (tenant_id, chunks_version, n_lists, dim, centroids, chunk_ids, assignments))
+
+
+def rebuild_ann_index(cur, tenant_id: int, chunks_version: int) -> Optional[IVFIndex]:
+    """Перестраивает индекс тенанта по всем его чанкам (вызывается из process-pdf)"""
+    from embedding_codec import decode_row_embedding
+
+    cur.execute("""
+        SELECT id, embedding_bin, embedding_dim,
+               CASE WHEN embedding_bin IS NULL THEN embedding_text END
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        WHERE tenant_id = %s AND (embedding_bin IS NOT NULL OR embedding_text IS NOT NULL)
+        ORDER BY id
+    """, (tenant_id,))
+    rows = cur.fetchall()
+
+    if len(rows) < ANN_MIN_CHUNKS:
+        cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_ann_index WHERE tenant_id = %s", (tenant_id,))
+        return None
+
+    matrix = np.vstack([decode_row_embedding(row[1], row[2], row[3]) for row in rows])
+    index = IVFIndex.build(matrix, [row[0] for row in rows])
+    save_ann_index(cur, tenant_id, chunks_version, index)
+    return index
@@ -2,6 +2,10 @@ import json
 import os
 import psycopg2
 from auth_middleware import require_auth
+from search_indexes import rebuild_search_indexes
+
+# Сколько дней хранить в embedding_store векторы, на которые не ссылается ни один чанк
+EMBEDDING_STORE_RETENTION_DAYS = int(os.environ.get('EMBEDDING_STORE_RETENTION_DAYS', '30'))
 
 def handler(event: dict, context) -> dict:
     """Очистка устаревших эмбеддингов удалённых документов"""
@@ -56,9 +60,22 @@ def handler(event: dict, context) -> dict:
             WHERE document_id NOT IN (
                 SELECT id FROM t_p56134400_telegram_ai_bot_pdf.tenant_documents
             )
+            RETURNING tenant_id
         """)
         
         deleted_tenant_chunks = cur.rowcount
+        affected_tenant_ids = sorted({row[0] for row in cur.fetchall()})
+        
+        # Инвалидируем кэш матриц эмбеддингов в тёплых контейнерах chat
+        tenant_versions = []
+        if affected_tenant_ids:
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+                SET chunks_version = chunks_version + 1
+                WHERE tenant_id = ANY(%s)
+                RETURNING tenant_id, chunks_version
+            """, (affected_tenant_ids,))
+            tenant_versions = cur.fetchall()
         
         cur.execute("""
             DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunks
@@ -68,7 +85,34 @@ def handler(event: dict, context) -> dict:
         """)
         
         deleted_count = deleted_tenant_chunks + cur.rowcount
+
+        # Векторы embedding_store, на которые больше не ссылается ни один чанк и которые давно
+        # не запрашивались; свежие остаются — повторная загрузка документа возьмёт их отсюда
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.embedding_store s
+            WHERE COALESCE(s.last_hit_at, s.created_at) < NOW() - make_interval(days => %s)
+              AND NOT EXISTS (
+                  SELECT 1 FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks c
+                  WHERE c.embedding_key = s.content_hash
+              )
+        """, (EMBEDDING_STORE_RETENTION_DAYS,))
+        deleted_store = cur.rowcount
+
+        # Импортированные из резервной копии векторы, на которые не ссылается ни один чанк тенанта
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_imported_embeddings i
+            WHERE i.created_at < NOW() - make_interval(days => %s)
+              AND NOT EXISTS (
+                  SELECT 1 FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks c
+                  WHERE c.tenant_id = i.tenant_id AND c.embedding_key = i.content_hash
+              )
+        """, (EMBEDDING_STORE_RETENTION_DAYS,))
+        deleted_store += cur.rowcount
         conn.commit()
+
+        # Индексы под новую версию чанков, как после загрузки в process-pdf
+        for affected_tenant_id, chunks_version in tenant_versions:
+            rebuild_search_indexes(cur, affected_tenant_id, chunks_version)
         
         cur.close()
         conn.close()
@@ -76,6 +120,7 @@ def handler(event: dict, context) -> dict:
         result = {
             'ok': True,
             'deleted_embeddings': deleted_count,
+            'deleted_store_embeddings': deleted_store,
             'message': f'Удалено {deleted_count} устаревших эмбеддингов'
         }
         
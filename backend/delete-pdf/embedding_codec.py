@@ -0,0 +1,30 @@
+"""Бинарное хранение эмбеддингов: сырой little-endian float32 (bytea) + размерность"""
+import json
+from typing import Optional, Sequence
+
+import numpy as np
+
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+
+def encode_embedding(vector: Sequence[float]) -> bytes:
+    """Вектор → bytes для колонки embedding_bin"""
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embedding(data, dim: Optional[int] = None) -> np.ndarray:
+    """
+    bytea (memoryview/bytes из psycopg2) → np.ndarray без копирования буфера.
+    Массив read-only и ссылается на память исходного значения.
+    """
+    vector = np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+    if dim is not None and vector.shape[0] != dim:
+        raise ValueError(f"Embedding dim mismatch: expected {dim}, got {vector.shape[0]}")
+    return vector
+
+
+def decode_row_embedding(embedding_bin, embedding_dim, embedding_text) -> np.ndarray:
+    """Читает бинарную колонку, а для ещё не мигрированных строк — JSON из embedding_text"""
+    if embedding_bin is not None:
+        return decode_embedding(embedding_bin, embedding_dim)
+    return np.asarray(json.loads(embedding_text), dtype=EMBEDDING_DTYPE)
@@ -5,6 +5,7 @@ import boto3
 import sys
 sys.path.insert(0, '/function/code/shared')
 from auth_middleware import get_tenant_id_from_request
+from search_indexes import rebuild_search_indexes
 
 def handler(event: dict, context) -> dict:
     """Удаление PDF документа и всех связанных данных"""
@@ -94,16 +95,39 @@ def handler(event: dict, context) -> dict:
                 WHERE document_id = %s AND tenant_id = %s
             """, (document_id, tenant_id))
 
+            # Незавершённая потоковая обработка документа (process-pdf)
+            cur.execute("""
+                DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunk_staging
+                WHERE document_id = %s AND tenant_id = %s
+            """, (document_id, tenant_id))
+            cur.execute("""
+                DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_ingest_state
+                WHERE document_id = %s AND tenant_id = %s
+            """, (document_id, tenant_id))
+
             cur.execute("""
                 DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_documents 
                 WHERE id = %s AND tenant_id = %s
             """, (document_id, tenant_id))
 
+            # Инвалидируем кэш матриц эмбеддингов в тёплых контейнерах chat
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+                SET chunks_version = chunks_version + 1
+                WHERE tenant_id = %s
+                RETURNING chunks_version
+            """, (tenant_id,))
+            version_row = cur.fetchone()
+
             conn.commit()
         except Exception as db_error:
             conn.rollback()
             raise
 
+        # Индексы под новую версию чанков, как после загрузки в process-pdf
+        if version_row:
+            rebuild_search_indexes(cur, tenant_id, version_row[0])
+
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -0,0 +1,259 @@
+"""
+Лексический индекс чанков тенанта: токен → постинги (chunk_id, tf) со статистикой BM25.
+
+Строится в process-pdf по тем же правилам токенизации и очистки, что и quality_gate,
+и хранится в tenant_lexical_index с chunks_version. chat использует его для гибридного
+отбора кандидатов (BM25 + вектор) и для overlap в quality gate без повторной токенизации.
+
+Там же, при загрузке, каждый чанк предобрабатывается (preprocess_chunk): очищенный текст,
+язык и множество токенов пишутся в tenant_chunks, и chat собирает контекст из них.
+"""
+import re
+import json
+import math
+from collections import Counter
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Столько же символов чанка попадает в контекст (build_context_with_scores)
+INDEX_MAX_CHARS_PER_CHUNK = 2200
+# Увеличивать при изменении sanitize_chunk / tokenize — бэкфилл пересчитает сохранённые строки
+PREPROCESS_VERSION = 1
+PREPROCESS_BACKFILL_BATCH = 500
+
+STOPWORDS_RU = {
+    "и","в","во","на","по","к","ко","с","со","у","из","за","для","о","об","от","до","или",
+    "а","но","что","это","как","где","когда","сколько","какой","какая","какие","какое",
+    "я","мы","вы","они","он","она","оно","мне","нам","вам","их","его","ее","этот","эта","эти",
+    "тут","там","здесь","вот","ли","же","бы","то","не","нет","да"
+}
+
+STOPWORDS_EN = {
+    "the","a","an","and","or","to","of","in","on","for","with","about","is","are","was","were",
+    "be","been","being","as","at","by","from","this","that","these","those","it","its","i","we","you","they",
+    "my","our","your","their","me","us","them","please"
+}
+
+
+def detect_lang_simple(text: str) -> str:
+    cyr = len(re.findall(r"[А-Яа-яЁё]", text))
+    lat = len(re.findall(r"[A-Za-z]", text))
+    if cyr == 0 and lat == 0:
+        return "other"
+    if cyr >= lat:
+        return "ru"
+    return "en"
+
+
+def tokenize(text: str, lang: str) -> List[str]:
+    text = text.lower()
+    text = re.sub(r"[^a-zа-я0-9\s\-]+", " ", text, flags=re.IGNORECASE)
+    raw = [t for t in text.split() if len(t) >= 3]
+
+    if lang == "ru":
+        return [t for t in raw if t not in STOPWORDS_RU]
+    if lang == "en":
+        return [t for t in raw if t not in STOPWORDS_EN]
+    return raw
+
+
+def sanitize_chunk(text: str) -> str:
+    patterns = [
+        r"\bpage_number\b\s*[:=]\s*\d+",
+        r"\bsimilarity\b\s*[:=]\s*[0-9.]+",
+        r"\bid\b\s*[:=]\s*\d+",
+        r"\bfile_name\b\s*[:=]\s*\S+",
+        r"\bresults\b\s*[:=]\s*\[",
+        r"\.pdf\b",
+        r"\bстр\.?\s*\d+\b",
+        r"\bстраниц[аы]\b\s*\d+\b",
+        r"\bна\s+стр\.?\s*\d+\b",
+    ]
+    out = text
+    for p in patterns:
+        out = re.sub(p, " ", out, flags=re.IGNORECASE)
+    out = re.sub(r"\s{2,}", " ", out).strip()
+    return out
+
+
+def clean_chunk(chunk_text: str) -> str:
+    """Текст чанка в том виде, в каком он попадёт в контекст: sanitize → обрезка"""
+    clean = sanitize_chunk(chunk_text)
+    return clean[:INDEX_MAX_CHARS_PER_CHUNK].strip() if clean else ''
+
+
+def chunk_index_tokens(chunk_text: str, clean: Optional[str] = None) -> List[str]:
+    """
+    Токены чанка в том виде, в каком он попадёт в контекст: sanitize → обрезка → tokenize.
+    Стоп-слова не убираются: запросные токены их уже не содержат, а пересечение
+    с ними даёт ровно тот же overlap, что токенизация всего контекста.
+    clean — уже очищенный текст (tenant_chunks.chunk_clean), тогда sanitize не нужен.
+    """
+    if clean is None:
+        clean = clean_chunk(chunk_text)
+    if not clean:
+        return []
+    return tokenize(clean, "other")
+
+
+def preprocess_chunk(chunk_text: str) -> Tuple[str, str, List[str]]:
+    """(chunk_clean, chunk_lang, chunk_tokens) для tenant_chunks; токены — уникальные, отсортированные"""
+    clean = clean_chunk(chunk_text)
+    return clean, detect_lang_simple(clean), sorted(set(chunk_index_tokens(chunk_text, clean)))
+
+
+def backfill_chunk_preprocessing(cur, tenant_id: int, batch_size: int = PREPROCESS_BACKFILL_BATCH) -> int:
+    """Дозаполняет chunk_clean/chunk_lang/chunk_tokens у строк тенанта без них или с устаревшей версией"""
+    updated = 0
+    while True:
+        cur.execute("""
+            SELECT id, chunk_text
+            FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+            WHERE tenant_id = %s AND (preprocess_version IS NULL OR preprocess_version < %s)
+            ORDER BY id
+            LIMIT %s
+        """, (tenant_id, PREPROCESS_VERSION, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            return updated
+        params = []
+        for chunk_id, chunk_text in rows:
+            clean, lang, tokens = preprocess_chunk(chunk_text or '')
+            params.append((clean, lang, tokens, PREPROCESS_VERSION, chunk_id))
+        cur.executemany("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+            SET chunk_clean = %s, chunk_lang = %s, chunk_tokens = %s, preprocess_version = %s
+            WHERE id = %s
+        """, params)
+        updated += len(rows)
+        if len(rows) < batch_size:
+            return updated
+
+
+def build_postings(chunks: Sequence[Tuple]) -> Tuple[Dict[str, List[List[int]]], List[List[int]]]:
+    """
+    [(chunk_id, chunk_text[, chunk_clean])] → (postings {token: [[chunk_id, tf], ...]}, doc_lens [[chunk_id, len], ...]).
+    Сохранённый chunk_clean (если не NULL) избавляет от повторного sanitize.
+    """
+    postings: Dict[str, List[List[int]]] = {}
+    doc_lens: List[List[int]] = []
+    for chunk in chunks:
+        chunk_id, chunk_text = chunk[0], chunk[1]
+        tokens = chunk_index_tokens(chunk_text, chunk[2] if len(chunk) > 2 else None)
+        doc_lens.append([chunk_id, len(tokens)])
+        for token, tf in Counter(tokens).items():
+            postings.setdefault(token, []).append([chunk_id, tf])
+    return postings, doc_lens
+
+
+class LexicalIndex:
+    """Постинги по строкам матрицы RetrievalEngine (а не по chunk_id)"""
+
+    def __init__(self, postings: Dict[str, Tuple[np.ndarray, np.ndarray]], doc_lens: np.ndarray):
+        self.postings = postings
+        self.doc_lens = doc_lens.astype(np.float32)
+        self.n_docs = int(doc_lens.shape[0])
+        self.avgdl = float(self.doc_lens.mean()) if self.n_docs and self.doc_lens.mean() > 0 else 1.0
+        self._chunk_tokens: Optional[List[FrozenSet[str]]] = None
+
+    @classmethod
+    def from_postings(cls, postings: Dict[str, List[List[int]]], doc_lens: List[List[int]],
+                      engine_chunk_ids: Sequence[int]) -> Optional['LexicalIndex']:
+        """Привязывает постинги из БД к строкам движка; None, если индекс не покрывает все чанки"""
+        row_of = {chunk_id: row for row, chunk_id in enumerate(engine_chunk_ids)}
+        if len(doc_lens) != len(row_of):
+            return None
+        lens = np.zeros(len(row_of), dtype=np.float32)
+        for chunk_id, length in doc_lens:
+            row = row_of.get(chunk_id)
+            if row is None:
+                return None
+            lens[row] = length
+
+        bound = {}
+        for token, entries in postings.items():
+            rows = np.fromiter((row_of.get(e[0], -1) for e in entries), dtype=np.int64, count=len(entries))
+            tfs = np.fromiter((e[1] for e in entries), dtype=np.float32, count=len(entries))
+            keep = rows >= 0
+            bound[token] = (rows[keep], tfs[keep])
+        return cls(bound, lens)
+
+    @classmethod
+    def build(cls, chunk_texts: Sequence[str], clean_texts: Sequence[Optional[str]] = None) -> 'LexicalIndex':
+        """Индекс в памяти по текстам движка (если сохранённый индекс устарел)"""
+        if clean_texts is None:
+            clean_texts = [None] * len(chunk_texts)
+        postings, doc_lens = build_postings([(i, text, clean) for i, (text, clean) in enumerate(zip(chunk_texts, clean_texts))])
+        return cls.from_postings(postings, doc_lens, range(len(chunk_texts)))
+
+    @property
+    def nbytes(self) -> int:
+        total = self.doc_lens.nbytes
+        for token, (rows, tfs) in self.postings.items():
+            total += rows.nbytes + tfs.nbytes + len(token) * 2 + 64
+        return int(total)
+
+    def scores(self, query_tokens: Sequence[str]) -> np.ndarray:
+        """BM25 по всем строкам; для строк без совпадений — 0"""
+        result = np.zeros(self.n_docs, dtype=np.float32)
+        for token in set(query_tokens):
+            entry = self.postings.get(token)
+            if entry is None:
+                continue
+            rows, tfs = entry
+            df = rows.shape[0]
+            idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lens[rows] / self.avgdl)
+            result[rows] += idf * tfs * (BM25_K1 + 1.0) / (tfs + norm)
+        return result
+
+    def chunk_tokens(self, row: int) -> FrozenSet[str]:
+        """Множество токенов чанка (строки движка) — для overlap в quality gate"""
+        if self._chunk_tokens is None:
+            per_row: List[set] = [set() for _ in range(self.n_docs)]
+            for token, (rows, _) in self.postings.items():
+                for r in rows.tolist():
+                    per_row[r].add(token)
+            self._chunk_tokens = [frozenset(tokens) for tokens in per_row]
+        return self._chunk_tokens[row]
+
+
+def load_lexical_index(cur, tenant_id: int, chunks_version: int, engine_chunk_ids: Sequence[int]) -> Optional[LexicalIndex]:
+    """Индекс из БД, только если он построен для текущей версии чанков"""
+    cur.execute("""
+        SELECT postings, doc_lens
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_lexical_index
+        WHERE tenant_id = %s AND chunks_version = %s
+    """, (tenant_id, chunks_version))
+    row = cur.fetchone()
+    if not row:
+        return None
+    postings = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+    doc_lens = row[1] if isinstance(row[1], list) else json.loads(row[1])
+    return LexicalIndex.from_postings(postings, doc_lens, engine_chunk_ids)
+
+
+def rebuild_lexical_index(cur, tenant_id: int, chunks_version: int) -> int:
+    """Перестраивает индекс тенанта по всем его чанкам (вызывается из process-pdf); возвращает число токенов"""
+    cur.execute("""
+        SELECT id, chunk_text, CASE WHEN preprocess_version = %s THEN chunk_clean END
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        WHERE tenant_id = %s AND (embedding_bin IS NOT NULL OR embedding_text IS NOT NULL)
+        ORDER BY id
+    """, (PREPROCESS_VERSION, tenant_id))
+    postings, doc_lens = build_postings(cur.fetchall())
+    cur.execute("""
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_lexical_index
+        (tenant_id, chunks_version, n_docs, postings, doc_lens, built_at)
+        VALUES (%s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (tenant_id) DO UPDATE SET
+            chunks_version = EXCLUDED.chunks_version,
+            n_docs = EXCLUDED.n_docs,
+            postings = EXCLUDED.postings,
+            doc_lens = EXCLUDED.doc_lens,
+            built_at = EXCLUDED.built_at
+    """, (tenant_id, chunks_version, len(doc_lens), json.dumps(postings, ensure_ascii=False), json.dumps(doc_lens)))
+    return len(postings)
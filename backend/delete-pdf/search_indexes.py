@@ -0,0 +1,41 @@
+"""
+Перестройка поисковых индексов тенанта под новую chunks_version: IVF (ann_index) и BM25
+(lexical_index). Вызывается везде, где меняется набор чанков тенанта: process-pdf после
+загрузки документа, delete-pdf и cleanup-embeddings после удаления чанков.
+Ошибка построения не фатальна: до появления индекса chat ищет точно и строит BM25 в памяти.
+"""
+from ann_index import rebuild_ann_index
+from lexical_index import rebuild_lexical_index
+
+
+def _finish(cur, ok: bool):
+    # Вне autocommit каждый индекс — своя транзакция: ошибка одного не откатывает другой
+    if cur.connection.autocommit:
+        return
+    if ok:
+        cur.connection.commit()
+    else:
+        cur.connection.rollback()
+
+
+def rebuild_search_indexes(cur, tenant_id: int, chunks_version: int):
+    """Перестраивает оба индекса тенанта; ошибки только логируются"""
+    # IVF-индекс для крупных тенантов (у мелких удаляется)
+    try:
+        ann = rebuild_ann_index(cur, tenant_id, chunks_version)
+        _finish(cur, True)
+        if ann is not None:
+            print(f"🧭 ANN index rebuilt: {ann.n_lists} lists, tenant={tenant_id}, version={chunks_version}")
+    except Exception as ann_error:
+        _finish(cur, False)
+        # Без индекса chat просто использует точный поиск
+        print(f"⚠️ ANN index build failed for tenant {tenant_id}: {ann_error}")
+    # Лексический индекс (BM25 + токены для quality gate) — те же правила tokenize/sanitize, что в chat
+    try:
+        n_tokens = rebuild_lexical_index(cur, tenant_id, chunks_version)
+        _finish(cur, True)
+        print(f"🔤 Lexical index rebuilt: {n_tokens} tokens, tenant={tenant_id}, version={chunks_version}")
+    except Exception as lexical_error:
+        _finish(cur, False)
+        # chat построит индекс в памяти по текстам чанков
+        print(f"⚠️ Lexical index build failed for tenant {tenant_id}: {lexical_error}")
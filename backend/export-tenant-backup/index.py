@@ -1,5 +1,6 @@
 import json
 import os
+import base64
 import psycopg2
 from datetime import datetime
 from auth_middleware import get_tenant_id_from_request
@@ -133,6 +134,37 @@ def handler(event: dict, context) -> dict:
                 'created_at': row[8].isoformat() if row[8] else None
             }
 
+        # 7. Векторы чанков из embedding_store (по запросу: ?include_embeddings=true).
+        # import-tenant-backup сохранит их для этого тенанта, и повторная загрузка тех же
+        # документов обойдётся без вызовов textEmbedding. Вместе с общим хранилищем выгружаются
+        # векторы, импортированные тенантом раньше
+        query_params = event.get('queryStringParameters') or {}
+        if str(query_params.get('include_embeddings', '')).lower() == 'true':
+            cur.execute("""
+                SELECT s.content_hash, s.model_uri, s.embedding_bin, s.embedding_dim
+                FROM t_p56134400_telegram_ai_bot_pdf.embedding_store s
+                WHERE s.content_hash IN (
+                    SELECT embedding_key FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks WHERE tenant_id = %s
+                )
+                UNION
+                SELECT i.content_hash, i.model_uri, i.embedding_bin, i.embedding_dim
+                FROM t_p56134400_telegram_ai_bot_pdf.tenant_imported_embeddings i
+                WHERE i.tenant_id = %s AND i.content_hash IN (
+                    SELECT embedding_key FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks WHERE tenant_id = %s
+                ) AND NOT EXISTS (
+                    SELECT 1 FROM t_p56134400_telegram_ai_bot_pdf.embedding_store s WHERE s.content_hash = i.content_hash
+                )
+            """, (tenant_id, tenant_id, tenant_id))
+            backup_data['embeddings'] = [
+                {
+                    'content_hash': row[0].strip(),
+                    'model_uri': row[1],
+                    'embedding_f32le': base64.b64encode(bytes(row[2])).decode('ascii'),
+                    'embedding_dim': row[3]
+                }
+                for row in cur.fetchall()
+            ]
+
         cur.close()
         conn.close()
 
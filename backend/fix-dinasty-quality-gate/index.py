@@ -69,7 +69,8 @@ def handler(event: dict, context) -> dict:
 
         cur.execute("""
             UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
-            SET quality_gate_settings = %s
+            SET quality_gate_settings = %s,
+                settings_version = settings_version + 1
             WHERE tenant_id = %s
         """, (json.dumps(new_settings), tenant_id))
 
@@ -7,6 +7,45 @@ sys.path.append('/function/code')
 from timezone_helper import moscow_naive
 from auth_middleware import get_tenant_id_from_request
 
+
+def get_cache_stats(cur, tenant_id: int, start_date) -> dict:
+    """Эффективность кэшей chat: попадания, доля попаданий, сэкономленные токены и время"""
+    cur.execute("""
+        SELECT 
+            COUNT(*) FILTER (WHERE operation_type = 'answer_cache_hit'),
+            -- Ответ проигравшего хеджа — второй вызов того же запроса, а не промах кэша
+            COUNT(*) FILTER (WHERE operation_type = 'gpt_response'
+                             AND COALESCE((metadata::jsonb)->>'hedge', '') <> 'abandoned'),
+            COALESCE(SUM(((metadata::jsonb)->>'saved_tokens')::numeric) FILTER (WHERE operation_type = 'answer_cache_hit'), 0),
+            COALESCE(SUM(((metadata::jsonb)->>'saved_ms')::numeric) FILTER (WHERE operation_type = 'answer_cache_hit'), 0),
+            COUNT(*) FILTER (WHERE operation_type = 'embedding_query_cache_hit'),
+            COUNT(*) FILTER (WHERE operation_type = 'embedding_query'),
+            COALESCE(SUM(((metadata::jsonb)->>'saved_tokens')::numeric) FILTER (WHERE operation_type = 'embedding_query_cache_hit'), 0),
+            COALESCE(SUM(((metadata::jsonb)->>'saved_ms')::numeric) FILTER (WHERE operation_type = 'embedding_query_cache_hit'), 0)
+        FROM t_p56134400_telegram_ai_bot_pdf.token_usage
+        WHERE tenant_id = %s AND created_at >= %s
+          AND operation_type IN ('answer_cache_hit', 'gpt_response', 'embedding_query_cache_hit', 'embedding_query')
+    """, (tenant_id, start_date))
+    row = cur.fetchone()
+    
+    answer_hits, answer_misses = row[0] or 0, row[1] or 0
+    embedding_hits, embedding_misses = row[4] or 0, row[5] or 0
+    return {
+        'answerCache': {
+            'hits': answer_hits,
+            'hitRate': answer_hits / (answer_hits + answer_misses) if (answer_hits + answer_misses) else 0.0,
+            'savedTokens': int(row[2]),
+            'savedLatencyMs': int(row[3])
+        },
+        'queryEmbeddingCache': {
+            'hits': embedding_hits,
+            'hitRate': embedding_hits / (embedding_hits + embedding_misses) if (embedding_hits + embedding_misses) else 0.0,
+            'savedTokens': int(row[6]),
+            'savedLatencyMs': int(row[7])
+        }
+    }
+
+
 def handler(event: dict, context) -> dict:
     """API для получения статистики расходов токенов для тенанта"""
     method = event.get('httpMethod', 'GET')
@@ -105,6 +144,8 @@ def handler(event: dict, context) -> dict:
                 'tokens': row[2]
             })
         
+        cache_stats = get_cache_stats(cur, int(tenant_id), start_date)
+        
         cur.close()
         conn.close()
         
@@ -115,7 +156,8 @@ def handler(event: dict, context) -> dict:
             'totalCost': float(total_row[1] or 0),
             'totalOperations': total_row[2] or 0,
             'breakdown': breakdown,
-            'dailyStats': daily_stats
+            'dailyStats': daily_stats,
+            'cacheStats': cache_stats
         }
         
         return {
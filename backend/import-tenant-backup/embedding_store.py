@@ -0,0 +1,130 @@
+"""
+Хранилище эмбеддингов документов с адресацией по содержимому (таблица embedding_store).
+
+Ключ — sha256(modelUri + '\n' + enriched_text): тот же текст той же модели даёт тот же
+вектор, поэтому повторная загрузка документа и переиндексация берут неизменившиеся чанки
+отсюда, а не из textEmbedding. Векторы хранятся как в tenant_chunks: little-endian float32.
+В общее хранилище попадают только векторы, полученные от API. Векторы из резервной копии
+тенанта лежат в tenant_imported_embeddings и видны только этому тенанту.
+Ошибки хранилища не прерывают обработку — чанк просто уходит в API.
+"""
+import hashlib
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+EMBEDDING_STORE_BATCH = 1000
+
+
+def embedding_key(model_uri: str, text: str) -> str:
+    return hashlib.sha256(f"{model_uri}\n{text}".encode('utf-8')).hexdigest()
+
+
+def _savepoint(cur, action: str):
+    # В autocommit (process-pdf) каждая команда — своя транзакция, savepoint не нужен
+    if not cur.connection.autocommit:
+        cur.execute(f"{action} embedding_store")
+
+
+def lookup_embeddings(cur, keys: Sequence[str], tenant_id: Optional[int] = None) -> Dict[str, Tuple[bytes, int]]:
+    """
+    {ключ: (embedding_bin, embedding_dim)} для найденных ключей; попадания в общее хранилище
+    считаются. С tenant_id ключи, которых там нет, ищутся среди импортированных векторов тенанта.
+    """
+    found: Dict[str, Tuple[bytes, int]] = {}
+    unique = list(dict.fromkeys(keys))
+    try:
+        _savepoint(cur, 'SAVEPOINT')
+        for start in range(0, len(unique), EMBEDDING_STORE_BATCH):
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.embedding_store
+                SET hits = hits + 1, last_hit_at = NOW()
+                WHERE content_hash = ANY(%s)
+                RETURNING content_hash, embedding_bin, embedding_dim
+            """, (unique[start:start + EMBEDDING_STORE_BATCH],))
+            for key, embedding_bin, embedding_dim in cur.fetchall():
+                found[key.strip()] = (bytes(embedding_bin), embedding_dim)
+        missing = [key for key in unique if key not in found]
+        if tenant_id is not None and missing:
+            for start in range(0, len(missing), EMBEDDING_STORE_BATCH):
+                cur.execute("""
+                    SELECT content_hash, embedding_bin, embedding_dim
+                    FROM t_p56134400_telegram_ai_bot_pdf.tenant_imported_embeddings
+                    WHERE tenant_id = %s AND content_hash = ANY(%s)
+                """, (tenant_id, missing[start:start + EMBEDDING_STORE_BATCH]))
+                for key, embedding_bin, embedding_dim in cur.fetchall():
+                    found[key.strip()] = (bytes(embedding_bin), embedding_dim)
+        _savepoint(cur, 'RELEASE SAVEPOINT')
+    except Exception as e:
+        print(f"[embedding_store] lookup error: {e}")
+        _savepoint(cur, 'ROLLBACK TO SAVEPOINT')
+        return {}
+    return found
+
+
+def stored_keys(cur, keys: Sequence[str]) -> Set[str]:
+    """Ключи, уже лежащие в общем хранилище; только чтение, попадания не считаются"""
+    present: Set[str] = set()
+    unique = list(dict.fromkeys(keys))
+    try:
+        _savepoint(cur, 'SAVEPOINT')
+        for start in range(0, len(unique), EMBEDDING_STORE_BATCH):
+            cur.execute("""
+                SELECT content_hash FROM t_p56134400_telegram_ai_bot_pdf.embedding_store
+                WHERE content_hash = ANY(%s)
+            """, (unique[start:start + EMBEDDING_STORE_BATCH],))
+            present.update(row[0].strip() for row in cur.fetchall())
+        _savepoint(cur, 'RELEASE SAVEPOINT')
+    except Exception as e:
+        print(f"[embedding_store] lookup error: {e}")
+        _savepoint(cur, 'ROLLBACK TO SAVEPOINT')
+        return set()
+    return present
+
+
+def store_embeddings(cur, model_uri: str, items: List[Tuple[str, bytes, int]]) -> int:
+    """Сохраняет [(ключ, embedding_bin, embedding_dim)]; возвращает число новых записей"""
+    if not items:
+        return 0
+    try:
+        _savepoint(cur, 'SAVEPOINT')
+        inserted = execute_values(cur, """
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.embedding_store
+            (content_hash, model_uri, embedding_bin, embedding_dim)
+            VALUES %s
+            ON CONFLICT (content_hash) DO NOTHING
+            RETURNING content_hash
+        """, [(key, model_uri, psycopg2.Binary(data), dim) for key, data, dim in items],
+            page_size=EMBEDDING_STORE_BATCH, fetch=True)
+        _savepoint(cur, 'RELEASE SAVEPOINT')
+        return len(inserted)
+    except Exception as e:
+        print(f"[embedding_store] store error: {e}")
+        _savepoint(cur, 'ROLLBACK TO SAVEPOINT')
+        return 0
+
+
+def store_imported_embeddings(cur, tenant_id: int, model_uri: str, items: List[Tuple[str, bytes, int]]) -> int:
+    """
+    Сохраняет векторы из резервной копии тенанта [(ключ, embedding_bin, embedding_dim)] —
+    только для этого тенанта; возвращает число новых записей
+    """
+    if not items:
+        return 0
+    try:
+        _savepoint(cur, 'SAVEPOINT')
+        inserted = execute_values(cur, """
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_imported_embeddings
+            (tenant_id, content_hash, model_uri, embedding_bin, embedding_dim)
+            VALUES %s
+            ON CONFLICT (tenant_id, content_hash) DO NOTHING
+            RETURNING content_hash
+        """, [(tenant_id, key, model_uri, psycopg2.Binary(data), dim) for key, data, dim in items],
+            page_size=EMBEDDING_STORE_BATCH, fetch=True)
+        _savepoint(cur, 'RELEASE SAVEPOINT')
+        return len(inserted)
+    except Exception as e:
+        print(f"[embedding_store] store error: {e}")
+        _savepoint(cur, 'ROLLBACK TO SAVEPOINT')
+        return 0
@@ -1,7 +1,9 @@
 import json
 import os
+import base64
 import psycopg2
 from auth_middleware import get_tenant_id_from_request
+from embedding_store import store_imported_embeddings, stored_keys
 
 def handler(event: dict, context) -> dict:
     """Импорт резервной копии данных тенанта из JSON"""
@@ -121,6 +123,36 @@ def handler(event: dict, context) -> dict:
             if keys_imported > 0:
                 imported_items.append(f'api_keys ({keys_imported} new keys)')
 
+        # 5. Векторы чанков (export-tenant-backup?include_embeddings=true) — в tenant_imported_embeddings.
+        # Проверить вектор из копии нечем (текста чанка в ней нет), поэтому он доступен только
+        # этому тенанту и в общий embedding_store не попадает. Ключи из общего хранилища пропускаются
+        embedding_store_stats = None
+        if backup_data.get('embeddings'):
+            entries = [e for e in backup_data['embeddings'] if e.get('content_hash') and e.get('embedding_f32le')]
+            present = stored_keys(cur, [e['content_hash'] for e in entries])
+            by_model = {}
+            for e in entries:
+                if e['content_hash'] in present:
+                    continue
+                data = base64.b64decode(e['embedding_f32le'])
+                dim = int(e.get('embedding_dim') or len(data) // 4)
+                if len(data) != dim * 4:
+                    print(f"[import] skip embedding {e['content_hash']}: {len(data)} bytes for dim {dim}")
+                    continue
+                by_model.setdefault(e.get('model_uri') or '', []).append((e['content_hash'], data, dim))
+            added = sum(store_imported_embeddings(cur, tenant_id, model_uri, items)
+                        for model_uri, items in by_model.items())
+            embedding_store_stats = {'store_hits': len(present), 'added': added, 'total': len(entries)}
+            imported_items.append(f'embeddings ({added} new, {len(present)} already stored)')
+
+        # Сбрасываем кэш настроек тенанта в chat (TenantContext): настройки и ключи из копии
+        if 'tenant_settings' in backup_data or 'api_keys' in backup_data:
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+                SET settings_version = settings_version + 1
+                WHERE tenant_id = %s
+            """, (tenant_id,))
+
         conn.commit()
         cur.close()
         conn.close()
@@ -131,7 +163,8 @@ def handler(event: dict, context) -> dict:
             'body': json.dumps({
                 'success': True,
                 'message': 'Backup imported successfully',
-                'imported_items': imported_items
+                'imported_items': imported_items,
+                'embedding_store': embedding_store_stats
             }),
             'isBase64Encoded': False
         }
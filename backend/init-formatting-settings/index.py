@@ -83,6 +83,13 @@ def handler(event: dict, context) -> dict:
                 (%s, 'max', true, false, true, %s, '•', '▫️'),
                 (%s, 'widget', true, false, true, '{}', '•', '▫️')
         """, (tenant_id, json.dumps(default_telegram_emoji), tenant_id, tenant_id, json.dumps(default_max_emoji), tenant_id))
+
+        # Сбрасываем кэш настроек тенанта в chat (TenantContext)
+        cur.execute("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+            SET settings_version = settings_version + 1
+            WHERE tenant_id = %s
+        """, (tenant_id,))
         
         conn.commit()
         cur.close()
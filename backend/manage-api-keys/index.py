@@ -109,6 +109,13 @@ def handler(event: dict, context) -> dict:
                                   updated_at = CURRENT_TIMESTAMP
                 """, (tenant_id, provider, key_name, key_value))
                 saved_count += 1
+
+            # Сбрасываем кэш настроек тенанта в chat (TenantContext)
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+                SET settings_version = settings_version + 1
+                WHERE tenant_id = %s
+            """, (tenant_id,))
             
             conn.commit()
             cur.close()
@@ -107,6 +107,7 @@ def handler(event: dict, context) -> dict:
                     consent_text = %s,
                     consent_messenger_text = %s,
                     privacy_policy_text = %s,
+                    settings_version = settings_version + 1,
                     updated_at = CURRENT_TIMESTAMP
                 WHERE tenant_id = %s
             """, (
@@ -159,6 +160,7 @@ def handler(event: dict, context) -> dict:
                             '"yandexgpt-lite"',
                             true
                         ),
+                        settings_version = settings_version + 1,
                         updated_at = CURRENT_TIMESTAMP
                     WHERE tenant_id = %s
                 """, (tenant_id,))
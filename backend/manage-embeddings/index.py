@@ -3,6 +3,11 @@ import os
 import psycopg2
 from auth_middleware import require_auth
 
+# Стратегии разбиения документов на чанки (process-pdf/chunker.py) и допустимый размер чанка
+CHUNKING_STRATEGIES = ('fixed', 'structured')
+CHUNK_TARGET_MIN = 200
+CHUNK_TARGET_MAX = 4000
+
 def handler(event: dict, context) -> dict:
     """Управление настройками эмбеддингов для суперадмина"""
     method = event.get('httpMethod', 'GET')
@@ -59,7 +64,10 @@ def handler(event: dict, context) -> dict:
                         ts.embedding_provider,
                         ts.embedding_doc_model,
                         ts.embedding_query_model,
-                        t.fz152_enabled
+                        t.fz152_enabled,
+                        ts.chunking_strategy,
+                        ts.chunk_target_chars,
+                        ts.chunk_overlap_chars
                     FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings ts
                     JOIN t_p56134400_telegram_ai_bot_pdf.tenants t ON t.id = ts.tenant_id
                     WHERE ts.tenant_id = %s
@@ -80,7 +88,10 @@ def handler(event: dict, context) -> dict:
                     'embedding_provider': row[0] or 'yandex',
                     'embedding_doc_model': row[1] or 'text-search-doc',
                     'embedding_query_model': row[2] or 'text-search-query',
-                    'fz152_enabled': row[3] if row[3] is not None else False
+                    'fz152_enabled': row[3] if row[3] is not None else False,
+                    'chunking_strategy': row[4] or 'fixed',
+                    'chunk_target_chars': row[5],
+                    'chunk_overlap_chars': row[6]
                 }
 
                 cur.close()
@@ -100,7 +111,10 @@ def handler(event: dict, context) -> dict:
                         t.fz152_enabled,
                         ts.embedding_provider,
                         ts.embedding_doc_model,
-                        ts.embedding_query_model
+                        ts.embedding_query_model,
+                        ts.chunking_strategy,
+                        ts.chunk_target_chars,
+                        ts.chunk_overlap_chars
                     FROM t_p56134400_telegram_ai_bot_pdf.tenants t
                     LEFT JOIN t_p56134400_telegram_ai_bot_pdf.tenant_settings ts ON t.id = ts.tenant_id
                     WHERE t.is_super_admin = false
@@ -116,7 +130,10 @@ def handler(event: dict, context) -> dict:
                         'fz152_enabled': row[2] if row[2] is not None else False,
                         'embedding_provider': row[3] or 'yandex',
                         'embedding_doc_model': row[4] or 'text-search-doc',
-                        'embedding_query_model': row[5] or 'text-search-query'
+                        'embedding_query_model': row[5] or 'text-search-query',
+                        'chunking_strategy': row[6] or 'fixed',
+                        'chunk_target_chars': row[7],
+                        'chunk_overlap_chars': row[8]
                     })
 
                 cur.close()
@@ -135,6 +152,10 @@ def handler(event: dict, context) -> dict:
             embedding_provider = body.get('embedding_provider')
             embedding_doc_model = body.get('embedding_doc_model')
             embedding_query_model = body.get('embedding_query_model')
+            # Разбиение на чанки: не переданное поле не меняется
+            chunking_strategy = body.get('chunking_strategy')
+            chunk_target_chars = body.get('chunk_target_chars')
+            chunk_overlap_chars = body.get('chunk_overlap_chars')
 
             if not target_tenant_id:
                 cur.close()
@@ -146,6 +167,25 @@ def handler(event: dict, context) -> dict:
                     'isBase64Encoded': False
                 }
 
+            chunking_error = None
+            if chunking_strategy is not None and chunking_strategy not in CHUNKING_STRATEGIES:
+                chunking_error = f'chunking_strategy must be one of: {", ".join(CHUNKING_STRATEGIES)}'
+            elif chunk_target_chars is not None and not (isinstance(chunk_target_chars, int)
+                                                         and CHUNK_TARGET_MIN <= chunk_target_chars <= CHUNK_TARGET_MAX):
+                chunking_error = f'chunk_target_chars must be between {CHUNK_TARGET_MIN} and {CHUNK_TARGET_MAX}'
+            elif chunk_overlap_chars is not None and not (isinstance(chunk_overlap_chars, int)
+                                                          and 0 <= chunk_overlap_chars <= CHUNK_TARGET_MAX // 2):
+                chunking_error = f'chunk_overlap_chars must be between 0 and {CHUNK_TARGET_MAX // 2}'
+            if chunking_error:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': chunking_error}),
+                    'isBase64Encoded': False
+                }
+
             cur.execute("""
                 SELECT fz152_enabled 
                 FROM t_p56134400_telegram_ai_bot_pdf.tenants 
@@ -180,9 +220,14 @@ def handler(event: dict, context) -> dict:
                     embedding_provider = %s,
                     embedding_doc_model = %s,
                     embedding_query_model = %s,
-                    updated_at = CURRENT_TIMESTAMP
+                    chunking_strategy = COALESCE(%s, chunking_strategy),
+                    chunk_target_chars = COALESCE(%s, chunk_target_chars),
+                    chunk_overlap_chars = COALESCE(%s, chunk_overlap_chars),
+                    updated_at = CURRENT_TIMESTAMP,
+                    settings_version = settings_version + 1
                 WHERE tenant_id = %s
-            """, (embedding_provider, embedding_doc_model, embedding_query_model, target_tenant_id))
+            """, (embedding_provider, embedding_doc_model, embedding_query_model,
+                  chunking_strategy, chunk_target_chars, chunk_overlap_chars, target_tenant_id))
 
             conn.commit()
             cur.close()
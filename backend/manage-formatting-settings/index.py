@@ -161,6 +161,13 @@ def handler(event: dict, context) -> dict:
                     SET custom_emoji_map = %s, updated_at = NOW()
                     WHERE tenant_id = %s
                 """, (json.dumps(emoji_map), tenant_id))
+
+                # Сбрасываем кэш настроек тенанта в chat (TenantContext)
+                cur.execute("""
+                    UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+                    SET settings_version = settings_version + 1
+                    WHERE tenant_id = %s
+                """, (tenant_id,))
                 
                 conn.commit()
                 cur.close()
@@ -206,6 +213,13 @@ def handler(event: dict, context) -> dict:
                     updated_at = NOW()
             """, (tenant_id, messenger, use_emoji, use_markdown, use_lists_formatting,
                   json.dumps(custom_emoji_map), list_bullet_char, numbered_list_char))
+
+            # Сбрасываем кэш настроек тенанта в chat (TenantContext)
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+                SET settings_version = settings_version + 1
+                WHERE tenant_id = %s
+            """, (tenant_id,))
             
             conn.commit()
             cur.close()
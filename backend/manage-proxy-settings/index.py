@@ -128,7 +128,8 @@ def handler(event: dict, context) -> dict:
                     use_proxy_openrouter = %s,
                     proxy_openrouter = %s,
                     use_proxy_proxyapi = %s,
-                    proxy_proxyapi = %s
+                    proxy_proxyapi = %s,
+                    settings_version = settings_version + 1
                 WHERE tenant_id = %s
             """, (
                 body.get('use_proxy_openai', False),
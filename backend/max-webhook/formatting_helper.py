@@ -1,13 +1,12 @@
 """Утилита для загрузки настроек форматирования из БД"""
-import os
 import json
-import psycopg2
+from db_pool import get_connection, release_connection
 import re
 
 def get_formatting_settings(tenant_id: int, messenger: str) -> dict:
     """Получить настройки форматирования для тенанта и мессенджера"""
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         cur.execute("""
@@ -19,7 +18,7 @@ def get_formatting_settings(tenant_id: int, messenger: str) -> dict:
         
         row = cur.fetchone()
         cur.close()
-        conn.close()
+        release_connection(conn)
         
         if not row:
             # Дефолтные настройки
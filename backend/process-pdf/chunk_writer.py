@@ -0,0 +1,137 @@
+"""
+Запись чанков документа одной транзакцией: удаление старых строк, вставка новых
+в document_chunks и tenant_chunks (по одному execute_values на таблицу), новая
+chunks_version и статус документа 'ready'. Читатели видят либо прежний набор чанков
+документа, либо новый целиком; коммит делает вызывающий.
+
+Документ, который обрабатывается за несколько вызовов, копит чанки в
+document_chunk_staging (stage_chunks), а после последней страницы promote_staged_chunks
+переносит их в document_chunks/tenant_chunks на стороне БД — так же одной транзакцией.
+"""
+import os
+from typing import List, Optional, Sequence, Tuple
+
+from psycopg2.extras import execute_values
+
+from lexical_index import PREPROCESS_VERSION, preprocess_chunk
+
+# Строк в одном INSERT; при большем числе чанков execute_values разобьёт вставку на страницы
+CHUNK_WRITE_PAGE_SIZE = int(os.environ.get('CHUNK_WRITE_PAGE_SIZE', '2000'))
+
+# (chunk_text, enriched_text, embedding_json, embedding_bin, embedding_dim, embedding_key)
+ChunkEmbedding = Tuple[str, str, Optional[str], Optional[object], Optional[int], Optional[str]]
+
+
+def document_chunk_rows(document_id: int, chunk_embeddings: Sequence[ChunkEmbedding], start: int = 0) -> List[Tuple]:
+    """Строки document_chunks: оригинальный chunk_text и вектор"""
+    return [
+        (document_id, chunk_text, idx, embedding_json, embedding_bin, embedding_dim)
+        for idx, (chunk_text, _, embedding_json, embedding_bin, embedding_dim, _) in enumerate(chunk_embeddings, start)
+    ]
+
+
+def tenant_chunk_rows(tenant_id: int, document_id: int, chunk_embeddings: Sequence[ChunkEmbedding],
+                      start: int = 0) -> List[Tuple]:
+    """
+    Строки tenant_chunks:
+    - chunk_text: оригинальный текст для показа пользователю
+    - enriched_text: обогащенный текст с датами (используется для embedding)
+    - embedding_text: JSON вектор (рассчитан на основе enriched_text)
+    - embedding_bin/embedding_dim: тот же вектор в float32 little-endian для чтения в chat
+    - chunk_clean/chunk_lang/chunk_tokens: очищенный текст для контекста и токены для quality gate
+    - embedding_key: ключ вектора в embedding_store
+    """
+    rows = []
+    for idx, (chunk_text, enriched_text, embedding_json, embedding_bin, embedding_dim, chunk_key) in enumerate(chunk_embeddings, start):
+        chunk_clean, chunk_lang, chunk_tokens = preprocess_chunk(chunk_text)
+        rows.append((tenant_id, document_id, chunk_text, idx, embedding_json, enriched_text, embedding_bin, embedding_dim,
+                     chunk_clean, chunk_lang, chunk_tokens, PREPROCESS_VERSION, chunk_key))
+    return rows
+
+
+def replace_document_chunks(cur, tenant_id: int, document_id: int, chunk_embeddings: Sequence[ChunkEmbedding],
+                            pages_count: int) -> Optional[int]:
+    """Заменяет чанки документа и отмечает его готовым; возвращает новую chunks_version тенанта"""
+    cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunks WHERE document_id = %s", (document_id,))
+    cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks WHERE document_id = %s", (document_id,))
+
+    if chunk_embeddings:
+        execute_values(cur, """
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_chunks
+            (document_id, chunk_text, chunk_index, embedding_text, embedding_bin, embedding_dim)
+            VALUES %s
+        """, document_chunk_rows(document_id, chunk_embeddings), page_size=CHUNK_WRITE_PAGE_SIZE)
+        execute_values(cur, """
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+            (tenant_id, document_id, chunk_text, chunk_index, embedding_text, enriched_text, embedding_bin, embedding_dim,
+             chunk_clean, chunk_lang, chunk_tokens, preprocess_version, embedding_key)
+            VALUES %s
+        """, tenant_chunk_rows(tenant_id, document_id, chunk_embeddings), page_size=CHUNK_WRITE_PAGE_SIZE)
+
+    return _finish_document(cur, tenant_id, document_id, pages_count)
+
+
+def stage_chunks(cur, tenant_id: int, document_id: int, chunk_embeddings: Sequence[ChunkEmbedding], start: int):
+    """Чанки очередной пачки страниц в document_chunk_staging с номерами от start"""
+    if not chunk_embeddings:
+        return
+    # Повтор пачки после сбоя до коммита чекпоинта перезаписывает те же номера
+    execute_values(cur, """
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_chunk_staging
+        (tenant_id, document_id, chunk_text, chunk_index, embedding_text, enriched_text, embedding_bin, embedding_dim,
+         chunk_clean, chunk_lang, chunk_tokens, preprocess_version, embedding_key)
+        VALUES %s
+        ON CONFLICT (document_id, chunk_index) DO UPDATE SET
+            chunk_text = EXCLUDED.chunk_text, embedding_text = EXCLUDED.embedding_text,
+            enriched_text = EXCLUDED.enriched_text, embedding_bin = EXCLUDED.embedding_bin,
+            embedding_dim = EXCLUDED.embedding_dim, chunk_clean = EXCLUDED.chunk_clean,
+            chunk_lang = EXCLUDED.chunk_lang, chunk_tokens = EXCLUDED.chunk_tokens,
+            preprocess_version = EXCLUDED.preprocess_version, embedding_key = EXCLUDED.embedding_key
+    """, tenant_chunk_rows(tenant_id, document_id, chunk_embeddings, start), page_size=CHUNK_WRITE_PAGE_SIZE)
+
+
+def promote_staged_chunks(cur, tenant_id: int, document_id: int, pages_count: int) -> Optional[int]:
+    """Заменяет чанки документа накопленными в document_chunk_staging; возвращает новую chunks_version"""
+    cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunks WHERE document_id = %s", (document_id,))
+    cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks WHERE document_id = %s", (document_id,))
+    cur.execute("""
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_chunks
+        (document_id, chunk_text, chunk_index, embedding_text, embedding_bin, embedding_dim)
+        SELECT document_id, chunk_text, chunk_index, embedding_text, embedding_bin, embedding_dim
+        FROM t_p56134400_telegram_ai_bot_pdf.document_chunk_staging
+        WHERE document_id = %s
+        ORDER BY chunk_index
+    """, (document_id,))
+    cur.execute("""
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        (tenant_id, document_id, chunk_text, chunk_index, embedding_text, enriched_text, embedding_bin, embedding_dim,
+         chunk_clean, chunk_lang, chunk_tokens, preprocess_version, embedding_key)
+        SELECT %s, document_id, chunk_text, chunk_index, embedding_text, enriched_text, embedding_bin, embedding_dim,
+               chunk_clean, chunk_lang, chunk_tokens, preprocess_version, embedding_key
+        FROM t_p56134400_telegram_ai_bot_pdf.document_chunk_staging
+        WHERE document_id = %s
+        ORDER BY chunk_index
+    """, (tenant_id, document_id))
+    return _finish_document(cur, tenant_id, document_id, pages_count)
+
+
+def _finish_document(cur, tenant_id: int, document_id: int, pages_count: int) -> Optional[int]:
+    # Обработка документа завершена: чекпоинт и промежуточные чанки больше не нужны
+    cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunk_staging WHERE document_id = %s", (document_id,))
+    cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_ingest_state WHERE document_id = %s", (document_id,))
+
+    # Инвалидируем кэш матриц эмбеддингов в тёплых контейнерах chat — в той же транзакции
+    cur.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+        SET chunks_version = chunks_version + 1
+        WHERE tenant_id = %s
+        RETURNING chunks_version
+    """, (tenant_id,))
+    version_row = cur.fetchone()
+
+    cur.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_documents
+        SET status = 'ready', pages = %s
+        WHERE id = %s
+    """, (pages_count, document_id))
+    return version_row[0] if version_row else None
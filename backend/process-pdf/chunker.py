@@ -0,0 +1,280 @@
+"""
+Инкрементальное разбиение текста документа на чанки по мере извлечения страниц.
+
+Чанкер получает текст страниц по одной (feed) и отдаёт готовые чанки сразу, держа
+в памяти только хвост, не набравший на чанк. Хвост сохраняется в чекпоинте обработки
+(state()), чтобы следующий вызов process-pdf продолжил с той же страницы.
+
+Стратегия выбирается для тенанта в tenant_settings.chunking_strategy:
+- fixed — срезы по CHUNK_SIZE символов, как раньше;
+- structured — чанки из целых абзацев, заголовков и строк таблиц размером около
+  target символов с перекрытием overlap символов (целыми предложениями/строками).
+"""
+import os
+import re
+from typing import List, Optional
+
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', '1000'))
+CHUNK_TARGET_CHARS = int(os.environ.get('CHUNK_TARGET_CHARS', '1200'))
+CHUNK_OVERLAP_CHARS = int(os.environ.get('CHUNK_OVERLAP_CHARS', '100'))
+
+CHUNKING_STRATEGIES = ('fixed', 'structured')
+
+HEADING_MAX_CHARS = 80
+TABLE_ROW_MAX_CHARS = 200
+# Заполненность чанка, после которой заголовок начинает новый чанк, а абзац не режется по предложениям
+CHUNK_MIN_FILL = 0.5
+
+# Конец предложения: знак препинания, пробел и заглавная буква, цифра или кавычка
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…])\s+(?=[A-ZА-ЯЁ0-9«"(])')
+# Нумерованный заголовок: «1.», «2.3)», «IV.», «Раздел …» и название
+_NUMBERED_HEADING_RE = re.compile(r'^(?:\d+(?:\.\d+)*[.)]?|[IVX]+\.|Раздел|Глава|Section|Chapter)\s+(\S.*)$', re.IGNORECASE)
+# Колонки таблицы в извлечённом тексте: несколько пробелов, табуляция или « | »
+_COLUMN_GAP_RE = re.compile(r'\S(\s{2,}|\t|\s\|\s)\S')
+
+
+class FixedChunker:
+    """
+    Чанки по CHUNK_SIZE символов подряд по тексту всех страниц (страницы разделены '\\n\\n'),
+    чанки из одних пробелов пропускаются — то же, что прежнее разбиение склеенного текста.
+    """
+
+    name = 'fixed'
+
+    def __init__(self, size: int = CHUNK_SIZE, state: Optional[dict] = None):
+        self.size = size
+        self.carry = (state or {}).get('carry', '')
+
+    @property
+    def spec(self) -> str:
+        return self.name
+
+    def feed(self, page_text: str) -> List[str]:
+        self.carry += (page_text or '') + "\n\n"
+        chunks = []
+        while len(self.carry) >= self.size:
+            chunk, self.carry = self.carry[:self.size], self.carry[self.size:]
+            if chunk.strip():
+                chunks.append(chunk)
+        return chunks
+
+    def finish(self) -> List[str]:
+        chunk, self.carry = self.carry, ''
+        return [chunk] if chunk.strip() else []
+
+    def state(self) -> dict:
+        return {'carry': self.carry}
+
+
+def _is_heading(line: str) -> bool:
+    if len(line) > HEADING_MAX_CHARS or line[-1] in '.,;':
+        return False
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 3 and all(c.isupper() for c in letters):
+        return True
+    if line.endswith(':'):
+        return True
+    # «2. Тарифы» — заголовок, «2. Завтрак с 7:00 до 10:00» — пункт списка
+    match = _NUMBERED_HEADING_RE.match(line)
+    return bool(match) and len(match.group(1).split()) <= 5 and not any(c.isdigit() for c in match.group(1))
+
+
+def _is_table_row(raw: str, line: str) -> bool:
+    if len(line) > TABLE_ROW_MAX_CHARS:
+        return False
+    if _COLUMN_GAP_RE.search(raw.strip()):
+        return True
+    # Строка тарифа: даты, периоды, цены — не меньше трети «ячеек» с цифрами
+    tokens = line.split()
+    numeric = sum(1 for t in tokens if any(c.isdigit() for c in t))
+    return len(tokens) >= 2 and numeric >= 2 and numeric * 3 >= len(tokens)
+
+
+def _hard_split(text: str, limit: int) -> List[str]:
+    """Режет по пробелу не дальше limit символов (для предложений и строк длиннее чанка)"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind(' ', 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+def _split_paragraph(text: str, limit: int) -> List[str]:
+    """Абзац длиннее limit — группами целых предложений (длинные предложения режутся по пробелу)"""
+    if len(text) <= limit:
+        return [text]
+    pieces, current = [], ''
+    for sentence in _SENTENCE_SPLIT_RE.split(text):
+        for part in _hard_split(sentence, limit):
+            if current and len(current) + 1 + len(part) > limit:
+                pieces.append(current)
+                current = part
+            else:
+                current = f'{current} {part}' if current else part
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _take_sentences(text: str, limit: int, from_end: bool = False):
+    """(взятые предложения не длиннее limit, остаток) с начала или с конца абзаца"""
+    sentences = _SENTENCE_SPLIT_RE.split(text)
+    if from_end:
+        sentences.reverse()
+    taken, size = [], 0
+    for sentence in sentences:
+        if size + len(sentence) + 1 > limit:
+            break
+        taken.append(sentence)
+        size += len(sentence) + 1
+    rest = sentences[len(taken):]
+    if from_end:
+        taken.reverse()
+        rest.reverse()
+    return ' '.join(taken), ' '.join(rest)
+
+
+class StructuredChunker:
+    """
+    Чанки из целых единиц текста: заголовков, абзацев (длинные — группами предложений)
+    и строк таблиц. Заголовок начинает новый чанк, если текущий заполнен хотя бы наполовину,
+    и повторяется в начале следующих чанков своего раздела. Следующий чанк начинается
+    с перекрытия — последних предложений или строк предыдущего, не длиннее overlap.
+    """
+
+    name = 'structured'
+
+    def __init__(self, target: int = CHUNK_TARGET_CHARS, overlap: int = CHUNK_OVERLAP_CHARS,
+                 state: Optional[dict] = None):
+        state = state or {}
+        self.target = max(200, target)
+        self.overlap = max(0, min(overlap, self.target // 2))
+        # Единицы [вид, текст], ещё не попавшие в чанк: 'h' — заголовок, 'p' — абзац, 'r' — строка таблицы
+        self.units: List[list] = state.get('units', [])
+        self.tail: List[str] = state.get('tail', [])
+        self.heading: Optional[str] = state.get('heading')
+
+    @property
+    def spec(self) -> str:
+        return f'{self.name}:{self.target}:{self.overlap}'
+
+    def _page_units(self, page_text: str) -> List[list]:
+        units = []
+        paragraph = []
+
+        def close_paragraph():
+            if paragraph:
+                units.extend(['p', piece] for piece in _split_paragraph(' '.join(paragraph), self.target))
+                paragraph.clear()
+
+        for raw in (page_text or '').split('\n'):
+            line = ' '.join(raw.split())
+            if not line:
+                close_paragraph()
+            elif _is_table_row(raw, line):
+                close_paragraph()
+                units.extend(['r', part] for part in _hard_split(line, self.target))
+            elif _is_heading(line):
+                close_paragraph()
+                units.append(['h', line])
+            else:
+                paragraph.append(line)
+        close_paragraph()
+        return units
+
+    def _next_chunk(self, final: bool) -> Optional[str]:
+        """Следующий чанк из очереди единиц; None — для него пока мало текста"""
+        units = self.units
+        if not units:
+            return None
+        if units[0][0] == 'h':
+            # Чанк с нового заголовка начинается без перекрытия: прежний раздел к нему не относится
+            prefix = []
+        else:
+            prefix = ([self.heading] if self.heading else []) + self.tail
+        length = sum(len(text) + 1 for text in prefix)
+        min_fill = self.target * CHUNK_MIN_FILL
+
+        body = []
+        rest = None
+        closed = False
+        for i, (kind, text) in enumerate(units):
+            size = len(text) + 1
+            if body and kind == 'h' and length >= min_fill:
+                closed, rest = True, units[i:]
+                break
+            if body and length + size > self.target:
+                closed, rest = True, units[i:]
+                # Полупустой чанк добираем первыми предложениями абзаца
+                if kind == 'p' and length < min_fill:
+                    head, remainder = _take_sentences(text, self.target - length)
+                    if head and remainder:
+                        body.append(['p', head])
+                        rest = [['p', remainder]] + units[i + 1:]
+                break
+            body.append([kind, text])
+            length += size
+        if not closed:
+            if not final:
+                return None
+            rest = []
+        # Заголовок в конце чанка относится к следующему
+        while len(body) > 1 and body[-1][0] == 'h':
+            rest.insert(0, body.pop())
+
+        self.units = rest
+        for kind, text in body:
+            if kind == 'h':
+                self.heading = text
+        self.tail = self._overlap_tail(body)
+        return '\n'.join(prefix + [text for _, text in body])
+
+    def _overlap_tail(self, body: List[list]) -> List[str]:
+        tail, size = [], 0
+        for kind, text in reversed(body):
+            if kind == 'h':
+                break
+            if size + len(text) + 1 <= self.overlap:
+                tail.insert(0, text)
+                size += len(text) + 1
+                continue
+            if kind == 'p':
+                taken, _ = _take_sentences(text, self.overlap - size, from_end=True)
+                if taken:
+                    tail.insert(0, taken)
+            break
+        return tail
+
+    def _drain(self, final: bool) -> List[str]:
+        chunks = []
+        while True:
+            chunk = self._next_chunk(final)
+            if chunk is None:
+                return chunks
+            if chunk.strip():
+                chunks.append(chunk)
+
+    def feed(self, page_text: str) -> List[str]:
+        self.units.extend(self._page_units(page_text))
+        return self._drain(final=False)
+
+    def finish(self) -> List[str]:
+        chunks = self._drain(final=True)
+        self.tail = []
+        return chunks
+
+    def state(self) -> dict:
+        return {'units': self.units, 'tail': self.tail, 'heading': self.heading}
+
+
+def make_chunker(strategy: Optional[str], target: Optional[int] = None, overlap: Optional[int] = None,
+                 state: Optional[dict] = None):
+    """Чанкер стратегии тенанта; неизвестная стратегия — fixed"""
+    if strategy == 'structured':
+        return StructuredChunker(target or CHUNK_TARGET_CHARS, CHUNK_OVERLAP_CHARS if overlap is None else overlap, state)
+    return FixedChunker(state=state)
@@ -0,0 +1,162 @@
+"""
+Параллельная генерация эмбеддингов чанков в Yandex Foundation Models.
+
+Запросы идут из ограниченного пула потоков (EMBED_WORKERS) через общий token bucket:
+не больше EMBED_RATE_PER_SECOND запросов в секунду с всплеском до EMBED_BURST —
+под квоту textEmbedding каталога. Ответы 429 и 5xx, а также сетевые ошибки повторяются
+с экспоненциальной задержкой и полным джиттером (Retry-After, если он есть, важнее).
+Результаты возвращаются в порядке чанков; чанк, который так и не удалось обработать,
+получает None, как и раньше при ошибке эмбеддинга.
+"""
+import os
+import time
+import random
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+YANDEX_EMBEDDING_URL = 'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding'
+
+EMBED_WORKERS = int(os.environ.get('EMBED_WORKERS', '8'))
+EMBED_RATE_PER_SECOND = float(os.environ.get('EMBED_RATE_PER_SECOND', '10'))
+EMBED_BURST = int(os.environ.get('EMBED_BURST', '10'))
+EMBED_MAX_RETRIES = int(os.environ.get('EMBED_MAX_RETRIES', '4'))
+EMBED_BACKOFF_BASE_MS = int(os.environ.get('EMBED_BACKOFF_BASE_MS', '500'))
+EMBED_BACKOFF_MAX_MS = int(os.environ.get('EMBED_BACKOFF_MAX_MS', '8000'))
+EMBED_TIMEOUT = int(os.environ.get('EMBED_TIMEOUT', '30'))
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: acquire() ждёт, пока не накопится токен"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+
+class EmbeddingError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+def backoff_seconds(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Полный джиттер: random(0, min(max, base * 2^attempt)); Retry-After в секундах — как есть"""
+    if retry_after:
+        try:
+            return min(float(retry_after), EMBED_BACKOFF_MAX_MS / 1000)
+        except ValueError:
+            pass
+    cap_ms = min(EMBED_BACKOFF_MAX_MS, EMBED_BACKOFF_BASE_MS * (2 ** attempt))
+    return random.uniform(0, cap_ms) / 1000
+
+
+class YandexEmbedder:
+    """Один HTTP-пул и один лимит на все потоки обработки документа"""
+
+    def __init__(self, api_key: str, model_uri: str, workers: int = EMBED_WORKERS,
+                 rate: float = EMBED_RATE_PER_SECOND, burst: int = EMBED_BURST):
+        self.api_key = api_key
+        self.model_uri = model_uri
+        self.workers = max(1, workers)
+        self.bucket = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self.retries = 0
+
+    def _post(self, text: str) -> List[float]:
+        try:
+            response = self.session.post(
+                YANDEX_EMBEDDING_URL,
+                headers={'Authorization': f'Api-Key {self.api_key}', 'Content-Type': 'application/json'},
+                json={'modelUri': self.model_uri, 'text': text},
+                timeout=EMBED_TIMEOUT
+            )
+        except requests.RequestException as e:
+            raise EmbeddingError(f'request failed: {e}')
+        if response.status_code != 200:
+            raise EmbeddingError(f'Yandex API error: {response.status_code}, {response.text[:300]}',
+                                 response.status_code, response.headers.get('Retry-After'))
+        data = response.json()
+        if 'embedding' not in data:
+            raise EmbeddingError(f"Missing 'embedding' in response: {str(data)[:300]}", 200)
+        return data['embedding']
+
+    def embed(self, text: str) -> List[float]:
+        """Эмбеддинг с повторами на 429/5xx/сетевых ошибках"""
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                return self._post(text)
+            except EmbeddingError as e:
+                if not e.retryable or attempt >= EMBED_MAX_RETRIES:
+                    raise
+                delay = backoff_seconds(attempt, e.retry_after)
+                with self._lock:
+                    self.retries += 1
+                print(f"[embedding_pool] retry {attempt + 1}/{EMBED_MAX_RETRIES} in {delay:.2f}s: {e}")
+                time.sleep(delay)
+                attempt += 1
+
+    def embed_all(self, texts: Sequence[str],
+                  on_done: Optional[Callable[[int, List[float]], None]] = None) -> Tuple[List[Optional[List[float]]], dict]:
+        """
+        ([вектор или None по каждому тексту, в исходном порядке], статистика).
+        on_done(index, vector) вызывается из рабочего потока после каждого успеха.
+        """
+        started = time.perf_counter()
+        retries_before = self.retries
+
+        def run(item):
+            idx, text = item
+            try:
+                vector = self.embed(text)
+            except Exception as e:
+                print(f"❌ Embedding error for chunk {idx}: {e}")
+                return None
+            if on_done is not None:
+                on_done(idx, vector)
+            return vector
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, max(1, len(texts))), thread_name_prefix='embed') as pool:
+            # Каждая задача — в копии контекста вызова: on_done пишет токены в буфер token_logger вызова
+            futures = [pool.submit(contextvars.copy_context().run, run, item) for item in enumerate(texts)]
+            vectors = [future.result() for future in futures]
+
+        seconds = time.perf_counter() - started
+        embedded = sum(1 for v in vectors if v is not None)
+        stats = {
+            'embedded': embedded,
+            'failed': len(vectors) - embedded,
+            'retries': self.retries - retries_before,
+            'seconds': round(seconds, 2),
+            'chunks_per_second': round(len(vectors) / seconds, 2) if seconds > 0 else None,
+        }
+        return vectors, stats
@@ -1,18 +1,173 @@
 import json
 import os
+import re
+import time
 import boto3
 import psycopg2
-from io import BytesIO
 import sys
 sys.path.insert(0, '/function/code/shared')
 from auth_middleware import get_tenant_id_from_request
 sys.path.append('/function/code')
 from api_keys_helper import get_tenant_api_key
-from token_logger import log_token_usage
+from token_logger import log_token_usage, buffered_token_usage
 from timezone_helper import moscow_naive
+from embedding_codec import encode_embedding, decode_embedding
+from lexical_index import backfill_chunk_preprocessing
+from search_indexes import rebuild_search_indexes
+from chunk_writer import replace_document_chunks, stage_chunks, promote_staged_chunks
+from chunker import make_chunker
+from ingest_checkpoint import IngestCheckpoint, load_checkpoint, start_checkpoint, save_checkpoint, claim_final_checkpoint
+from s3_range_file import S3RangeFile
+from db_pool import get_connection, release_connection
+from embedding_pool import YandexEmbedder
+from embedding_store import embedding_key, lookup_embeddings, store_embeddings
 
+# Страниц больше этого не обрабатываем вовсе (загрузка и так ограничена 10 МБ)
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', '1000'))
+# Страниц за один вызов: держит в пределах и время вызова, и кэш объектов PdfReader
+PDF_PAGES_PER_INVOCATION = int(os.environ.get('PDF_PAGES_PER_INVOCATION', '60'))
+# Чанков в пачке, после которой они уходят в эмбеддинги и staging, а чекпоинт сдвигается
+PDF_STAGE_BATCH_CHUNKS = int(os.environ.get('PDF_STAGE_BATCH_CHUNKS', '64'))
+# Бюджет вызова (не больше остатка времени функции) и запас на последнюю пачку и индексы
+PDF_INVOCATION_BUDGET_MS = int(os.environ.get('PDF_INVOCATION_BUDGET_MS', '90000'))
+PDF_FINISH_RESERVE_MS = int(os.environ.get('PDF_FINISH_RESERVE_MS', '20000'))
+
+
+def enrich_with_dates(text):
+    """Добавляет явные упоминания дат для периодов в формате DD.MM.YYYY-DD.MM.YYYY"""
+    # Паттерн для поиска периодов типа "01.03.2026-31.03.2026"
+    period_pattern = r'(\d{2})\.(\d{2})\.(\d{4})-(\d{2})\.(\d{2})\.(\d{4})'
+    matches = re.findall(period_pattern, text)
+    
+    if not matches:
+        return text
+    
+    enriched = text
+    month_names = {
+        '01': 'января', '02': 'февраля', '03': 'марта', '04': 'апреля',
+        '05': 'мая', '06': 'июня', '07': 'июля', '08': 'августа',
+        '09': 'сентября', '10': 'октября', '11': 'ноября', '12': 'декабря'
+    }
+    month_names_nom = {
+        '01': 'январь', '02': 'февраль', '03': 'март', '04': 'апрель',
+        '05': 'май', '06': 'июнь', '07': 'июль', '08': 'август',
+        '09': 'сентябрь', '10': 'октябрь', '11': 'ноябрь', '12': 'декабрь'
+    }
+    
+    for match in matches:
+        start_day, start_month, start_year, end_day, end_month, end_year = match
+        
+        # Генерируем список дат (каждый день в периоде)
+        dates_list = []
+        dates_list.append(f"{month_names_nom[start_month]} {start_year}")
+        
+        # Если период в пределах одного месяца — добавляем все даты
+        if start_month == end_month and start_year == end_year:
+            for day in range(1, int(end_day) + 1):
+                dates_list.append(f"{day} {month_names[start_month]}")
+        else:
+            # Период через несколько месяцев
+            dates_list.append(f"{month_names_nom[end_month]} {end_year}")
+            # Добавляем пример дат из начала и конца
+            for day in [1, 5, 10, 15, 20, 25, int(end_day)]:
+                if day <= int(end_day):
+                    dates_list.append(f"{day} {month_names[end_month]}")
+        
+        # Добавляем обогащенный текст
+        dates_text = ", ".join(dates_list)
+        enriched += f"\n\nДаты в этом периоде: {dates_text}"
+        break  # Обрабатываем только первый период в chunk
+    
+    return enriched
+
+
+def embed_chunks(cur, embedder, tenant_id, document_id, embedding_doc_model, chunks, start, totals):
+    """
+    Эмбеддинги пачки чанков с номерами от start: неизменившиеся — из embedding_store, остальные — в API.
+    Возвращает [(chunk_text, enriched_text, embedding_json, embedding_bin, embedding_dim, embedding_key)],
+    статистику прибавляет к totals. Без embedder чанки сохраняются без векторов.
+    """
+    # Обогащаем тексты датами ПЕРЕД созданием embedding
+    enriched_texts = [enrich_with_dates(chunk_text) for chunk_text in chunks]
+    vectors = [None] * len(chunks)
+    embedding_keys = [None] * len(chunks)
+    if embedder is not None and chunks:
+        embedding_started = time.perf_counter()
+        embedding_keys = [embedding_key(embedder.model_uri, text) for text in enriched_texts]
+
+        # Неизменившиеся чанки (та же модель, тот же enriched_text) — из embedding_store
+        # или из векторов, импортированных этим тенантом; в общее хранилище идут только ответы API
+        stored = lookup_embeddings(cur, embedding_keys, tenant_id)
+        for idx, key in enumerate(embedding_keys):
+            if key in stored:
+                vectors[idx] = decode_embedding(*stored[key]).tolist()
+        # Остальные — в API, одинаковые тексты внутри пачки один раз
+        missing = {}
+        for idx, key in enumerate(embedding_keys):
+            if vectors[idx] is None and key not in missing:
+                missing[key] = idx
+        missing_idx = list(missing.values())
+        print(f"🗄️ EMBEDDING STORE: {len(chunks) - sum(1 for v in vectors if v is None)} hits, {len(missing_idx)} to embed")
+
+        def on_embedded(pos, vector):
+            # Логируем использование токенов (примерно 256 токенов на chunk)
+            idx = missing_idx[pos]
+            tokens_estimate = min(len(chunks[idx]) // 4, 256)
+            log_token_usage(
+                tenant_id=tenant_id,
+                operation_type='embedding_create',
+                model=embedding_doc_model,
+                tokens_used=tokens_estimate,
+                metadata={'document_id': document_id, 'chunk_index': start + idx}
+            )
+
+        batch_stats = {'embedded': 0, 'failed': 0, 'retries': 0}
+        if missing_idx:
+            new_vectors, batch_stats = embedder.embed_all([enriched_texts[i] for i in missing_idx], on_done=on_embedded)
+            fresh = {}
+            for idx, vector in zip(missing_idx, new_vectors):
+                if vector is not None:
+                    fresh[embedding_keys[idx]] = vector
+            for idx, key in enumerate(embedding_keys):
+                if vectors[idx] is None and key in fresh:
+                    vectors[idx] = fresh[key]
+            store_embeddings(cur, embedder.model_uri, [
+                (key, encode_embedding(vector), len(vector)) for key, vector in fresh.items()
+            ])
+
+        store_hits = sum(1 for key in embedding_keys if key in stored)
+        called = set(missing_idx)
+        for name in ('embedded', 'failed', 'retries'):
+            totals[name] += batch_stats[name]
+        totals['store_hits'] += store_hits
+        totals['deduplicated'] += len(chunks) - store_hits - len(missing_idx)
+        totals['api_calls'] += len(missing_idx)
+        totals['saved_tokens_estimate'] += sum(min(len(chunks[i]) // 4, 256) for i in range(len(chunks)) if i not in called)
+        totals['seconds'] += time.perf_counter() - embedding_started
+
+    chunk_embeddings = []
+    for chunk_text, embedding_text, embedding_vector, chunk_key in zip(chunks, enriched_texts, vectors, embedding_keys):
+        embedding_json = None
+        embedding_bin = None
+        embedding_dim = None
+        if embedding_vector is not None:
+            embedding_json = json.dumps(embedding_vector)
+            embedding_bin = psycopg2.Binary(encode_embedding(embedding_vector))
+            embedding_dim = len(embedding_vector)
+
+        # Сохраняем ОРИГИНАЛЬНЫЙ chunk_text и обогащенный embedding_text отдельно
+        chunk_embeddings.append((chunk_text, embedding_text, embedding_json, embedding_bin, embedding_dim,
+                                 chunk_key if embedding_vector is not None else None))
+    return chunk_embeddings
+
+
+@buffered_token_usage
 def handler(event: dict, context) -> dict:
-    """Обработка PDF: извлечение текста, разбиение на чанки и создание эмбеддингов"""
+    """
+    Обработка PDF: извлечение текста по страницам, разбиение на чанки и создание эмбеддингов.
+    Большой документ обрабатывается за несколько вызовов: пока ответ status='processing',
+    вызывающий повторяет запрос с тем же documentId, и обработка продолжается с чекпоинта.
+    """
     method = event.get('httpMethod', 'POST')
 
     if method == 'OPTIONS':
@@ -44,11 +199,28 @@ def handler(event: dict, context) -> dict:
         print(f"✅ AUTH SUCCESS in process-pdf: tenant_id={tenant_id}")
         
         import PyPDF2
-        from openai import OpenAI
         
         body = json.loads(event.get('body', '{}'))
         document_id = body.get('documentId')
 
+        # Бэкфилл предобработки чанков тенанта без повторной загрузки документов
+        if body.get('action') == 'backfill_chunks':
+            conn = get_connection()
+            conn.autocommit = True
+            cur = conn.cursor()
+            try:
+                backfilled = backfill_chunk_preprocessing(cur, tenant_id)
+            finally:
+                cur.close()
+                release_connection(conn)
+            print(f"🧹 Preprocessed {backfilled} chunks of tenant {tenant_id}")
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'backfilled': backfilled}),
+                'isBase64Encoded': False
+            }
+
         if not document_id:
             return {
                 'statusCode': 400,
@@ -57,7 +229,7 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         conn.autocommit = True
         cur = conn.cursor()
         
@@ -69,7 +241,7 @@ def handler(event: dict, context) -> dict:
         if not result:
             print(f"❌ Document not found: document_id={document_id}, tenant_id={tenant_id}")
             cur.close()
-            conn.close()
+            release_connection(conn)
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -78,6 +250,8 @@ def handler(event: dict, context) -> dict:
             }
 
         file_key = result[0]
+        # restart=true — обработать документ с первой страницы, не продолжая прерванную попытку
+        restart = bool(body.get('restart'))
 
         s3 = boto3.client('s3',
             endpoint_url='https://bucket.poehali.dev',
@@ -85,15 +259,15 @@ def handler(event: dict, context) -> dict:
             aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
         )
         
-        print(f"📦 TRYING TO GET FILE FROM S3: Bucket='files', Key='{file_key}'")
+        print(f"📦 OPENING FILE IN S3: Bucket='files', Key='{file_key}'")
         try:
-            obj = s3.get_object(Bucket='files', Key=file_key)
-            pdf_data = obj['Body'].read()
-            print(f"✅ FILE DOWNLOADED FROM S3: {len(pdf_data)} bytes")
+            # Файл читается диапазонами по мере надобности, а не целиком в память
+            pdf_file = S3RangeFile(s3, 'files', file_key)
+            print(f"✅ FILE FOUND IN S3: {pdf_file.size} bytes, etag={pdf_file.etag}")
         except Exception as s3_error:
             print(f"❌ S3 ERROR: {s3_error}")
             cur.close()
-            conn.close()
+            release_connection(conn)
             return {
                 'statusCode': 500,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -101,48 +275,24 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        print(f"📖 PARSING PDF: {len(pdf_data)} bytes")
-        pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_data))
+        print(f"📖 PARSING PDF: {pdf_file.size} bytes")
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
         pages_count = len(pdf_reader.pages)
         print(f"📄 PDF HAS {pages_count} PAGES")
         
-        if pages_count > 20:
+        if pages_count > PDF_MAX_PAGES:
             cur.close()
-            conn.close()
+            release_connection(conn)
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': f'PDF слишком большой: {pages_count} страниц. Максимум: 20 страниц'}),
-                'isBase64Encoded': False
-            }
-        
-        print(f"🔤 EXTRACTING TEXT FROM {pages_count} PAGES...")
-        full_text = ""
-        for page in pdf_reader.pages:
-            full_text += page.extract_text() + "\n\n"
-        print(f"✅ TEXT EXTRACTED: {len(full_text)} chars")
-
-        chunk_size = 1000
-        chunks = []
-        for i in range(0, len(full_text), chunk_size):
-            chunk = full_text[i:i + chunk_size]
-            if chunk.strip():
-                chunks.append(chunk)
-        print(f"✂️ CREATED {len(chunks)} CHUNKS")
-        
-        if len(chunks) > 200:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': f'Слишком много текста: {len(chunks)} фрагментов. Максимум: 200'}),
+                'body': json.dumps({'error': f'PDF слишком большой: {pages_count} страниц. Максимум: {PDF_MAX_PAGES} страниц'}),
                 'isBase64Encoded': False
             }
 
         # Получаем настройки эмбеддингов ДО транзакции
         cur.execute("""
-            SELECT embedding_provider, embedding_doc_model
+            SELECT embedding_provider, embedding_doc_model, chunking_strategy, chunk_target_chars, chunk_overlap_chars
             FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings
             WHERE tenant_id = %s
         """, (tenant_id,))
@@ -151,8 +301,9 @@ def handler(event: dict, context) -> dict:
         embedding_provider = settings_row[0] if settings_row and settings_row[0] else 'yandex'
         embedding_doc_model = settings_row[1] if settings_row and settings_row[1] else 'text-search-doc'
         print(f"⚙️ EMBEDDING SETTINGS: provider={embedding_provider}, model={embedding_doc_model}")
-        
-        import requests
+        chunking = settings_row[2:5] if settings_row else (None, None, None)
+        chunk_spec = make_chunker(*chunking).spec
+        print(f"✂️ CHUNKING: {chunk_spec}")
         
         # Получаем API ключи ДО транзакции (ВСЕГДА используем PROJECT секреты для эмбеддингов)
         yandex_api_key = None
@@ -165,193 +316,154 @@ def handler(event: dict, context) -> dict:
                 print(f"⚠️ No PROJECT Yandex API keys found, skipping embeddings")
                 yandex_api_key = None
                 yandex_folder_id = None
-        
-        # Генерируем все эмбеддинги ДО транзакции (если есть API ключи)
-        import time
-        import re
-        print(f"🚀 STARTING EMBEDDING GENERATION for {len(chunks)} chunks...")
-        
-        # Функция для обогащения текста датами из периодов
-        def enrich_with_dates(text):
-            """Добавляет явные упоминания дат для периодов в формате DD.MM.YYYY-DD.MM.YYYY"""
-            # Паттерн для поиска периодов типа "01.03.2026-31.03.2026"
-            period_pattern = r'(\d{2})\.(\d{2})\.(\d{4})-(\d{2})\.(\d{2})\.(\d{4})'
-            matches = re.findall(period_pattern, text)
-            
-            if not matches:
-                return text
-            
-            enriched = text
-            month_names = {
-                '01': 'января', '02': 'февраля', '03': 'марта', '04': 'апреля',
-                '05': 'мая', '06': 'июня', '07': 'июля', '08': 'августа',
-                '09': 'сентября', '10': 'октября', '11': 'ноября', '12': 'декабря'
-            }
-            month_names_nom = {
-                '01': 'январь', '02': 'февраль', '03': 'март', '04': 'апрель',
-                '05': 'май', '06': 'июнь', '07': 'июль', '08': 'август',
-                '09': 'сентябрь', '10': 'октябрь', '11': 'ноябрь', '12': 'декабрь'
-            }
-            
-            for match in matches:
-                start_day, start_month, start_year, end_day, end_month, end_year = match
-                
-                # Генерируем список дат (каждый день в периоде)
-                dates_list = []
-                dates_list.append(f"{month_names_nom[start_month]} {start_year}")
-                
-                # Если период в пределах одного месяца — добавляем все даты
-                if start_month == end_month and start_year == end_year:
-                    for day in range(1, int(end_day) + 1):
-                        dates_list.append(f"{day} {month_names[start_month]}")
-                else:
-                    # Период через несколько месяцев
-                    dates_list.append(f"{month_names_nom[end_month]} {end_year}")
-                    # Добавляем пример дат из начала и конца
-                    for day in [1, 5, 10, 15, 20, 25, int(end_day)]:
-                        if day <= int(end_day):
-                            dates_list.append(f"{day} {month_names[end_month]}")
-                
-                # Добавляем обогащенный текст
-                dates_text = ", ".join(dates_list)
-                enriched += f"\n\nДаты в этом периоде: {dates_text}"
-                break  # Обрабатываем только первый период в chunk
-            
-            return enriched
-        
-        chunk_embeddings = []
-        for idx, chunk_text in enumerate(chunks):
-            # Обогащаем текст датами ПЕРЕД созданием embedding
-            embedding_text = enrich_with_dates(chunk_text)
-            embedding_json = None
+
+        embedder = None
+        embedding_stats = None
+        if embedding_provider == 'yandex' and yandex_api_key and yandex_folder_id:
+            # Пул потоков с общим лимитом запросов вместо последовательных запросов и sleep
+            embedder = YandexEmbedder(yandex_api_key, f'emb://{yandex_folder_id}/{embedding_doc_model}/latest')
+            embedding_stats = {'embedded': 0, 'failed': 0, 'retries': 0, 'store_hits': 0, 'deduplicated': 0,
+                               'api_calls': 0, 'saved_tokens_estimate': 0, 'seconds': 0.0}
+        else:
+            print(f"Embeddings disabled: provider={embedding_provider}, has_key={bool(yandex_api_key)}")
+
+        # Продолжаем прерванную обработку, если файл тот же
+        checkpoint = load_checkpoint(cur, document_id)
+        if checkpoint and (restart or checkpoint.file_etag != pdf_file.etag or checkpoint.pages_total != pages_count
+                           or checkpoint.chunker != chunk_spec):
+            print(f"♻️ Discarding checkpoint of document_id={document_id}: {checkpoint.to_dict()}")
+            checkpoint = None
+        # staged — чанки документа копятся в document_chunk_staging (обработка заняла больше одной пачки)
+        staged = checkpoint is not None
+        if checkpoint is None:
+            checkpoint = IngestCheckpoint(document_id, pdf_file.etag, pages_count, chunker=chunk_spec)
+        checkpoint.invocations += 1
+        chunker = make_chunker(*chunking, state=checkpoint.chunker_state)
+        print(f"🔤 EXTRACTING TEXT FROM PAGE {checkpoint.next_page + 1}/{pages_count} (invocation {checkpoint.invocations})")
+
+        budget_ms = PDF_INVOCATION_BUDGET_MS
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
             try:
-                if embedding_provider == 'yandex' and yandex_api_key and yandex_folder_id:
-                    # Используем обогащенный текст для embedding
-                    emb_response = requests.post(
-                        'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding',
-                        headers={
-                            'Authorization': f'Api-Key {yandex_api_key}',
-                            'Content-Type': 'application/json'
-                        },
-                        json={
-                            'modelUri': f'emb://{yandex_folder_id}/{embedding_doc_model}/latest',
-                            'text': embedding_text
-                        },
-                        timeout=30
-                    )
-                    if emb_response.status_code != 200:
-                        print(f"❌ YANDEX API ERROR for chunk {idx}: {emb_response.status_code}, {emb_response.text}")
-                        raise Exception(f"Yandex API error: {emb_response.status_code}")
-                    
-                    emb_data = emb_response.json()
-                    if 'embedding' not in emb_data:
-                        print(f"❌ NO 'embedding' in response for chunk {idx}: {emb_data}")
-                        raise Exception(f"Missing 'embedding' in response")
-                    
-                    embedding_vector = emb_data['embedding']
-                    embedding_json = json.dumps(embedding_vector)
-                    
-                    if (idx + 1) % 5 == 0:
-                        print(f"✅ Processed {idx + 1}/{len(chunks)} chunks")
-                    
-                    # Логируем использование токенов (примерно 256 токенов на chunk)
-                    tokens_estimate = min(len(chunk_text) // 4, 256)
-                    log_token_usage(
-                        tenant_id=tenant_id,
-                        operation_type='embedding_create',
-                        model=embedding_doc_model,
-                        tokens_used=tokens_estimate,
-                        metadata={'document_id': document_id, 'chunk_index': idx}
-                    )
-                    
-                    if (idx + 1) % 10 == 0:
-                        time.sleep(0.5)
+                budget_ms = min(budget_ms, float(context.get_remaining_time_in_millis()))
+            except Exception:
+                pass
+        invocation_started = time.perf_counter()
+
+        def out_of_budget(pages_here):
+            elapsed_ms = (time.perf_counter() - invocation_started) * 1000
+            return pages_here >= PDF_PAGES_PER_INVOCATION or elapsed_ms > budget_ms - PDF_FINISH_RESERVE_MS
+
+        def write_pending(pending, next_page, final):
+            """Эмбеддинги накопленных чанков и их запись одной транзакцией с чекпоинтом на границе next_page"""
+            nonlocal staged
+            start = checkpoint.next_chunk_index
+            chunk_embeddings = embed_chunks(cur, embedder, tenant_id, document_id, embedding_doc_model,
+                                            pending, start, embedding_stats)
+            version = None
+            conn.autocommit = False
+            try:
+                if final and not staged:
+                    # Документ уложился в одну пачку: удаление, вставка, chunks_version и статус — сразу
+                    version = replace_document_chunks(cur, tenant_id, document_id, chunk_embeddings, pages_count)
                 else:
-                    if idx == 0:
-                        print(f"Embeddings disabled: provider={embedding_provider}, has_key={bool(yandex_api_key)}")
-            except Exception as emb_error:
-                print(f"❌ Embedding error for chunk {idx}: {emb_error}")
-                import traceback
-                traceback.print_exc()
-                embedding_json = None
-            
-            # Сохраняем ОРИГИНАЛЬНЫЙ chunk_text и обогащенный embedding_text отдельно
-            chunk_embeddings.append((chunk_text, embedding_text, embedding_json))
-        
-        print(f"✅ EMBEDDING GENERATION COMPLETE: {len(chunk_embeddings)} chunks processed")
+                    if not staged:
+                        start_checkpoint(cur, tenant_id, document_id, pdf_file.etag, pages_count, chunker.spec)
+                        staged = True
+                    stage_chunks(cur, tenant_id, document_id, chunk_embeddings, start)
+                    from_page = checkpoint.next_page
+                    checkpoint.next_page = next_page
+                    checkpoint.next_chunk_index = start + len(chunk_embeddings)
+                    checkpoint.chunker_state = chunker.state()
+                    # Чекпоинт сдвигается или снимается, только если его не опередил параллельный вызов
+                    if final:
+                        if not claim_final_checkpoint(cur, document_id, from_page):
+                            raise RuntimeError(f'document {document_id} is being processed by another invocation')
+                        version = promote_staged_chunks(cur, tenant_id, document_id, pages_count)
+                    elif not save_checkpoint(cur, checkpoint, from_page):
+                        raise RuntimeError(f'document {document_id} is being processed by another invocation')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = True
+            print(f"📝 {'Replaced' if final else 'Staged'} chunks {start}..{start + len(chunk_embeddings) - 1} "
+                  f"of document_id={document_id} up to page {next_page}/{pages_count}")
+            return version
 
-        # Операции с чанками (удаление + вставка)
+        # Страницы по одной: чанки копятся до PDF_STAGE_BATCH_CHUNKS и уходят в эмбеддинги и БД
         print(f"💾 STARTING CHUNKS OPERATIONS...")
+        chunks_version = None
+        first_chunk = checkpoint.next_chunk_index
         try:
-            # Удаляем старые чанки
-            cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunks WHERE document_id = %s", (document_id,))
-            cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks WHERE document_id = %s", (document_id,))
-            print(f"🗑️ Deleted old chunks for document_id={document_id}")
-            
-            # Вставляем все новые чанки
-            for idx, (chunk_text, enriched_text, embedding_json) in enumerate(chunk_embeddings):
-                # В document_chunks сохраняем оригинальный chunk_text
-                cur.execute("""
-                    INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_chunks 
-                    (document_id, chunk_text, chunk_index, embedding_text)
-                    VALUES (%s, %s, %s, %s)
-                """, (document_id, chunk_text, idx, embedding_json))
-                
-                # В tenant_chunks сохраняем:
-                # - chunk_text: оригинальный текст для показа пользователю
-                # - enriched_text: обогащенный текст с датами (используется для embedding)
-                # - embedding_text: JSON вектор (рассчитан на основе enriched_text)
-                cur.execute("""
-                    INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunks 
-                    (tenant_id, document_id, chunk_text, chunk_index, embedding_text, enriched_text)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (tenant_id, document_id, chunk_text, idx, embedding_json, enriched_text))
-            
-            print(f"📝 Inserted {len(chunk_embeddings)} chunks into database")
-            
+            page = checkpoint.next_page
+            pages_here = 0
+            pending = []
+            while page < pages_count and (pages_here == 0 or not out_of_budget(pages_here)):
+                pending.extend(chunker.feed(pdf_reader.pages[page].extract_text()))
+                page += 1
+                pages_here += 1
+                if page == pages_count:
+                    pending.extend(chunker.finish())
+                elif len(pending) >= PDF_STAGE_BATCH_CHUNKS:
+                    write_pending(pending, page, final=False)
+                    pending = []
+            finished = page >= pages_count
+            total_chunks = checkpoint.next_chunk_index + len(pending)
+            chunks_version = write_pending(pending, page, final=finished)
         except Exception as chunks_error:
             print(f"❌ CHUNKS ERROR: {chunks_error}")
             import traceback
             traceback.print_exc()
             cur.close()
-            conn.close()
+            release_connection(conn)
             raise chunks_error
-        
-        # Закрываем первое соединение
-        cur.close()
-        conn.close()
-        print(f"🔌 Closed first connection after chunks")
-        
-        # Открываем НОВОЕ соединение для UPDATE документа
-        print(f"🔌 Opening NEW connection for document UPDATE...")
-        conn2 = psycopg2.connect(os.environ['DATABASE_URL'])
-        conn2.autocommit = True
-        cur2 = conn2.cursor()
-        
+
+        if embedding_stats is not None:
+            seconds = embedding_stats['seconds']
+            embedding_stats['seconds'] = round(seconds, 2)
+            embedding_stats['chunks_per_second'] = round((total_chunks - first_chunk) / seconds, 2) if seconds > 0 else None
+            print(f"⚡ EMBEDDINGS: {embedding_stats}")
+        ingest_stats = {'invocation': checkpoint.invocations, 'pages_processed': pages_here,
+                        'seconds': round(time.perf_counter() - invocation_started, 2), 's3': pdf_file.stats()}
+        print(f"📚 INGEST: {ingest_stats}")
+
+        if not finished:
+            # Следующий вызов с тем же documentId продолжит со страницы page
+            cur.close()
+            release_connection(conn)
+            print(f"⏸️ Document {document_id} paused at page {page}/{pages_count}, {total_chunks} chunks staged")
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'documentId': document_id,
+                    'pages': pages_count,
+                    'nextPage': page,
+                    'chunks': total_chunks,
+                    'status': 'processing',
+                    'embedding': embedding_stats,
+                    'ingest': ingest_stats
+                }),
+                'isBase64Encoded': False
+            }
+
+        # Чанки других документов тенанта, загруженные до предобработки (или по старым правилам)
         try:
-            # Обновляем статус документа
-            print(f"📝 Updating document status: doc_id={document_id}, pages={pages_count}")
-            
-            cur2.execute("""
-                UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_documents 
-                SET status = 'ready', pages = %s
-                WHERE id = %s
-                RETURNING id, status
-            """, (pages_count, document_id))
-            updated_doc = cur2.fetchone()
-            print(f"✅ Updated document status to 'ready': {updated_doc}")
-            
-            print(f"✅ ALL OPERATIONS COMPLETED SUCCESSFULLY")
-            
-        except Exception as update_error:
-            print(f"❌ UPDATE ERROR: {update_error}")
-            import traceback
-            traceback.print_exc()
-            raise update_error
-        finally:
-            cur2.close()
-            conn2.close()
-            print(f"🔌 Closed second connection")
+            backfilled = backfill_chunk_preprocessing(cur, tenant_id)
+            if backfilled:
+                print(f"🧹 Preprocessed {backfilled} older chunks of tenant {tenant_id}")
+        except Exception as backfill_error:
+            # chat очистит такие чанки сам
+            print(f"⚠️ Chunk preprocessing backfill failed: {backfill_error}")
+
+        # Индексы строятся под новую версию чанков; до их появления chat ищет точно и строит BM25 в памяти
+        if chunks_version is not None:
+            rebuild_search_indexes(cur, tenant_id, chunks_version)
+
+        cur.close()
+        release_connection(conn)
+        print(f"✅ ALL OPERATIONS COMPLETED SUCCESSFULLY")
 
         return {
             'statusCode': 200,
@@ -359,12 +471,14 @@ def handler(event: dict, context) -> dict:
             'body': json.dumps({
                 'documentId': document_id,
                 'pages': pages_count,
-                'chunks': len(chunks),
-                'status': 'ready'
+                'chunks': total_chunks,
+                'chunking': chunk_spec,
+                'status': 'ready',
+                'embedding': embedding_stats,
+                'ingest': ingest_stats
             }),
             'isBase64Encoded': False
         }
-
     except Exception as e:
         return {
             'statusCode': 500,
@@ -0,0 +1,97 @@
+"""
+Чекпоинт потоковой обработки документа (таблица document_ingest_state).
+
+Вызов process-pdf обрабатывает страницы, пока хватает бюджета времени, и после каждой
+пачки страниц одной транзакцией пишет их чанки в document_chunk_staging и сдвигает
+чекпоинт на границу страницы. Следующий вызов с тем же documentId продолжает с next_page;
+упавший вызов теряет только незафиксированную пачку.
+"""
+import json
+from typing import Optional
+
+
+class IngestCheckpoint:
+    """Следующая страница, следующий номер чанка и состояние чанкера на этой границе"""
+
+    def __init__(self, document_id: int, file_etag: Optional[str], pages_total: int, next_page: int = 0,
+                 next_chunk_index: int = 0, chunker: str = 'fixed', chunker_state: Optional[dict] = None,
+                 invocations: int = 0):
+        self.document_id = document_id
+        self.file_etag = file_etag
+        self.pages_total = pages_total
+        self.next_page = next_page
+        self.next_chunk_index = next_chunk_index
+        self.chunker = chunker
+        self.chunker_state = chunker_state or {}
+        self.invocations = invocations
+
+    def to_dict(self) -> dict:
+        return {
+            'pages': self.pages_total,
+            'next_page': self.next_page,
+            'chunks': self.next_chunk_index,
+            'invocations': self.invocations,
+        }
+
+
+def load_checkpoint(cur, document_id: int) -> Optional[IngestCheckpoint]:
+    cur.execute("""
+        SELECT file_etag, pages_total, next_page, next_chunk_index, chunker, chunker_state, invocations
+        FROM t_p56134400_telegram_ai_bot_pdf.document_ingest_state
+        WHERE document_id = %s
+    """, (document_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    chunker_state = row[5] if isinstance(row[5], dict) else json.loads(row[5] or '{}')
+    return IngestCheckpoint(document_id, row[0], row[1], row[2], row[3], row[4], chunker_state, row[6])
+
+
+def start_checkpoint(cur, tenant_id: int, document_id: int, file_etag: Optional[str], pages_total: int, chunker: str):
+    """Начинает обработку документа с первой страницы, отбрасывая чанки прерванной попытки"""
+    cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunk_staging WHERE document_id = %s",
+                (document_id,))
+    cur.execute("""
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_ingest_state
+        (document_id, tenant_id, file_etag, pages_total, next_page, next_chunk_index, chunker, chunker_state, invocations)
+        VALUES (%s, %s, %s, %s, 0, 0, %s, '{}'::jsonb, 0)
+        ON CONFLICT (document_id) DO UPDATE SET
+            tenant_id = EXCLUDED.tenant_id,
+            file_etag = EXCLUDED.file_etag,
+            pages_total = EXCLUDED.pages_total,
+            next_page = 0,
+            next_chunk_index = 0,
+            chunker = EXCLUDED.chunker,
+            chunker_state = '{}'::jsonb,
+            invocations = 0,
+            started_at = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+    """, (document_id, tenant_id, file_etag, pages_total, chunker))
+
+
+def save_checkpoint(cur, checkpoint: IngestCheckpoint, from_page: int) -> bool:
+    """
+    Сдвигает чекпоинт, если он всё ещё на from_page; False — его уже сдвинул
+    параллельный вызов для того же документа.
+    """
+    cur.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.document_ingest_state
+        SET next_page = %s, next_chunk_index = %s, chunker_state = %s::jsonb,
+            invocations = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE document_id = %s AND next_page = %s
+    """, (checkpoint.next_page, checkpoint.next_chunk_index, json.dumps(checkpoint.chunker_state, ensure_ascii=False),
+          checkpoint.invocations, checkpoint.document_id, from_page))
+    return cur.rowcount == 1
+
+
+def claim_final_checkpoint(cur, document_id: int, from_page: int) -> bool:
+    """
+    Перед заменой чанков документа накопленными: удаляет чекпоинт, если он всё ещё на from_page
+    (строка блокируется до конца транзакции). False — документ уже завершил или сдвинул
+    параллельный вызов, и его чанки заменять нельзя.
+    """
+    cur.execute("""
+        DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_ingest_state
+        WHERE document_id = %s AND next_page = %s
+    """, (document_id, from_page))
+    return cur.rowcount == 1
@@ -0,0 +1,97 @@
+"""
+Файл-объект поверх объекта S3: чтение диапазонами (Range) вместо загрузки целиком.
+
+PdfReader читает таблицу xref с конца файла и дальше только объекты нужных страниц,
+поэтому для страничной обработки достаточно seek/read. Прочитанные блоки по
+PDF_RANGE_BLOCK_BYTES держатся в LRU-кэше из PDF_RANGE_CACHE_BLOCKS блоков — память
+ограничена им, а не размером документа.
+"""
+import io
+import os
+from collections import OrderedDict
+
+PDF_RANGE_BLOCK_BYTES = int(os.environ.get('PDF_RANGE_BLOCK_BYTES', str(256 * 1024)))
+PDF_RANGE_CACHE_BLOCKS = int(os.environ.get('PDF_RANGE_CACHE_BLOCKS', '16'))
+
+
+class S3RangeFile(io.RawIOBase):
+    """Только чтение; size и etag берутся из head_object при открытии"""
+
+    mode = 'rb'
+
+    def __init__(self, s3, bucket: str, key: str, block_size: int = PDF_RANGE_BLOCK_BYTES,
+                 cache_blocks: int = PDF_RANGE_CACHE_BLOCKS):
+        super().__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        head = s3.head_object(Bucket=bucket, Key=key)
+        self.size = int(head['ContentLength'])
+        self.etag = (head.get('ETag') or '').strip('"')
+        self.block_size = block_size
+        self.cache_blocks = max(1, cache_blocks)
+        self._blocks: 'OrderedDict[int, bytes]' = OrderedDict()
+        self._pos = 0
+        self.range_requests = 0
+        self.bytes_fetched = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f'invalid whence: {whence}')
+        if pos < 0:
+            raise OSError('negative seek position')
+        self._pos = pos
+        return pos
+
+    def _block(self, index: int) -> bytes:
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+            return block
+        start = index * self.block_size
+        end = min(self.size, start + self.block_size) - 1
+        obj = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={start}-{end}')
+        block = obj['Body'].read()
+        self.range_requests += 1
+        self.bytes_fetched += len(block)
+        self._blocks[index] = block
+        if len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        written = 0
+        while written < len(view) and self._pos < self.size:
+            index, offset = divmod(self._pos, self.block_size)
+            block = self._block(index)
+            n = min(len(block) - offset, len(view) - written)
+            view[written:written + n] = block[offset:offset + n]
+            written += n
+            self._pos += n
+        return written
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._pos
+        buffer = bytearray(max(0, min(size, self.size - self._pos)))
+        n = self.readinto(buffer)
+        return bytes(buffer[:n])
+
+    def stats(self) -> dict:
+        return {'size': self.size, 'range_requests': self.range_requests, 'bytes_fetched': self.bytes_fetched}
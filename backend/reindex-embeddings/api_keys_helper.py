@@ -1,5 +1,5 @@
 import json
-import psycopg2
+from db_pool import get_connection, release_connection
 import os
 from typing import Tuple, Optional
 
@@ -16,7 +16,7 @@ def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> Tuple[Op
         (key_value: str or None, error_response: dict or None)
     """
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         cur.execute("""
@@ -28,7 +28,7 @@ def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> Tuple[Op
         
         result = cur.fetchone()
         cur.close()
-        conn.close()
+        release_connection(conn)
         
         if result:
             return result[0], None
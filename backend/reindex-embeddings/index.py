@@ -1,9 +1,12 @@
 import json
 import os
-import psycopg2
 import sys
 sys.path.append('/function/code')
 from api_keys_helper import get_tenant_api_key
+from db_pool import get_connection, release_connection
+
+# Вызовов process-pdf на один документ (каждый обрабатывает очередную порцию страниц)
+PROCESS_PDF_MAX_CALLS = int(os.environ.get('PROCESS_PDF_MAX_CALLS', '20'))
 
 def handler(event: dict, context) -> dict:
     """Переиндексация эмбеддингов после смены модели"""
@@ -41,7 +44,7 @@ def handler(event: dict, context) -> dict:
         tenant_id = int(tenant_id)
         print(f"[Reindex] Parsed tenant_id={tenant_id}, method={method}")
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
 
         if method == 'GET':
@@ -59,7 +62,7 @@ def handler(event: dict, context) -> dict:
             
             if not row:
                 cur.close()
-                conn.close()
+                release_connection(conn)
                 return {
                     'statusCode': 404,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -76,7 +79,7 @@ def handler(event: dict, context) -> dict:
             }
 
             cur.close()
-            conn.close()
+            release_connection(conn)
 
             return {
                 'statusCode': 200,
@@ -99,7 +102,7 @@ def handler(event: dict, context) -> dict:
                 
                 if not settings_row:
                     cur.close()
-                    conn.close()
+                    release_connection(conn)
                     return {
                         'statusCode': 404,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -120,7 +123,7 @@ def handler(event: dict, context) -> dict:
 
                 if total_docs == 0:
                     cur.close()
-                    conn.close()
+                    release_connection(conn)
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -160,7 +163,7 @@ def handler(event: dict, context) -> dict:
 
                 conn.commit()
                 cur.close()
-                conn.close()
+                release_connection(conn)
 
                 import requests
                 process_pdf_url = 'https://functions.poehali.dev/44b9c312-5377-4fa7-8b4c-522f4bbbf201'
@@ -179,26 +182,40 @@ def handler(event: dict, context) -> dict:
                 # Обрабатываем максимум 10 документов за раз, чтобы уложиться в таймаут
                 batch_size = 10
                 success_count = 0
+                # Сколько чанков process-pdf взял из embedding_store вместо textEmbedding
+                store_totals = {'store_hits': 0, 'api_calls': 0, 'saved_tokens_estimate': 0}
                 
                 for i, doc_id in enumerate(document_ids[:batch_size]):
                     try:
-                        response = requests.post(
-                            process_pdf_url,
-                            headers={
-                                'X-Authorization': auth_token,
-                                'Content-Type': 'application/json'
-                            },
-                            json={'documentId': doc_id, 'tenant_id': tenant_id},
-                            timeout=120
-                        )
-                        
-                        print(f"[Reindex] Document {doc_id} ({i+1}/{min(batch_size, len(document_ids))}): status={response.status_code}, response={response.text[:200]}")
+                        # Большой документ process-pdf обрабатывает за несколько вызовов (status='processing')
+                        for call in range(PROCESS_PDF_MAX_CALLS):
+                            response = requests.post(
+                                process_pdf_url,
+                                headers={
+                                    'X-Authorization': auth_token,
+                                    'Content-Type': 'application/json'
+                                },
+                                json={'documentId': doc_id, 'tenant_id': tenant_id},
+                                timeout=120
+                            )
+                            
+                            print(f"[Reindex] Document {doc_id} ({i+1}/{min(batch_size, len(document_ids))}), call {call + 1}: status={response.status_code}, response={response.text[:200]}")
+                            
+                            try:
+                                doc_data = response.json() if response.ok else {}
+                            except ValueError:
+                                doc_data = {}
+                            doc_stats = doc_data.get('embedding') or {}
+                            for key in store_totals:
+                                store_totals[key] += doc_stats.get(key) or 0
+                            if doc_data.get('status') != 'processing':
+                                break
                         
-                        if response.ok:
+                        if response.ok and doc_data.get('status') != 'processing':
                             success_count += 1
                         
                         # Обновляем прогресс после каждого документа (текущий прогресс + успешные в этом batch)
-                        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                        conn = get_connection()
                         cur = conn.cursor()
                         cur.execute("""
                             UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
@@ -207,7 +224,7 @@ def handler(event: dict, context) -> dict:
                         """, (current_progress + success_count, tenant_id))
                         conn.commit()
                         cur.close()
-                        conn.close()
+                        release_connection(conn)
                         
                     except Exception as e:
                         print(f"[Reindex] Error reindexing document {doc_id}: {e}")
@@ -220,13 +237,15 @@ def handler(event: dict, context) -> dict:
                     # TODO: можно добавить фоновую очередь через Cloud Tasks
                     # Пока просто отмечаем прогресс
 
-                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                conn = get_connection()
                 cur = conn.cursor()
                 
                 # Проверяем, остались ли ещё документы
                 final_progress = current_progress + success_count
                 is_completed = final_progress >= len(all_document_ids)
                 
+                # chunks_version не трогаем: process-pdf уже сдвинул её по каждому документу
+                # и построил под неё индексы ANN/BM25 — лишний сдвиг оставил бы их устаревшими
                 cur.execute("""
                     UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
                     SET 
@@ -236,9 +255,10 @@ def handler(event: dict, context) -> dict:
                 """, ('completed' if is_completed else 'in_progress', final_progress, tenant_id))
                 conn.commit()
                 cur.close()
-                conn.close()
+                release_connection(conn)
                 
                 print(f"[Reindex] Batch complete: processed {success_count}, total progress: {final_progress}/{len(all_document_ids)}, status: {'completed' if is_completed else 'in_progress'}")
+                print(f"[Reindex] Embedding store: {store_totals}")
 
                 return {
                     'statusCode': 200,
@@ -246,14 +266,15 @@ def handler(event: dict, context) -> dict:
                     'body': json.dumps({
                         'success': True,
                         'reindexed': success_count,
-                        'total': total_docs
+                        'total': total_docs,
+                        'embedding_store': store_totals
                     }),
                     'isBase64Encoded': False
                 }
 
             else:
                 cur.close()
-                conn.close()
+                release_connection(conn)
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -263,7 +284,7 @@ def handler(event: dict, context) -> dict:
 
         else:
             cur.close()
-            conn.close()
+            release_connection(conn)
             return {
                 'statusCode': 405,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
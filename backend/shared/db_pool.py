@@ -0,0 +1,151 @@
+"""
+Пул соединений с Postgres на процесс функции, живущий между тёплыми вызовами.
+
+Вместо psycopg2.connect(os.environ['DATABASE_URL']) на каждую операцию:
+
+    conn = get_connection()
+    try:
+        ...
+    finally:
+        release_connection(conn)
+
+Пул создаётся лениво. При выдаче соединение проверяется (закрыто / простаивало
+дольше DB_POOL_PING_AFTER — SELECT 1), при возврате откатывается незавершённая
+транзакция и сбрасывается autocommit. Счётчики — pool_stats().
+"""
+import os
+import time
+import threading
+import weakref
+from typing import List, Tuple
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '10'))
+
+_lock = threading.Condition()
+# Свободные соединения: (conn, время возврата)
+_idle: List[Tuple[object, float]] = []
+# Выданные соединения; забытое без release_connection соединение уйдёт отсюда вместе с объектом
+_in_use = weakref.WeakSet()
+# Соединения, которые открываются прямо сейчас (вне блокировки), — тоже занимают слот
+_opening = 0
+_stats = {
+    'connects': 0,
+    'reuses': 0,
+    'health_check_failures': 0,
+    'discarded': 0,
+    'waits': 0,
+    'wait_ms': 0.0,
+}
+
+
+def _connect():
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise ValueError('DATABASE_URL not configured')
+    conn = psycopg2.connect(dsn)
+    _stats['connects'] += 1
+    return conn
+
+
+def _close_quietly(conn):
+    _stats['discarded'] += 1
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _healthy(conn, idle_since: float) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - idle_since < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except Exception as e:
+        print(f"[db_pool] health check failed: {e}")
+        return False
+
+
+def get_connection():
+    """Соединение из пула (или новое, если свободных нет и лимит DB_POOL_MAX не достигнут)"""
+    global _opening
+    waited_from = None
+    with _lock:
+        while True:
+            while _idle:
+                conn, idle_since = _idle.pop()
+                if _healthy(conn, idle_since):
+                    _stats['reuses'] += 1
+                    _in_use.add(conn)
+                    if waited_from is not None:
+                        _stats['wait_ms'] += (time.monotonic() - waited_from) * 1000
+                    return conn
+                _stats['health_check_failures'] += 1
+                _close_quietly(conn)
+
+            if len(_in_use) + _opening < DB_POOL_MAX:
+                _opening += 1
+                break
+
+            if waited_from is None:
+                waited_from = time.monotonic()
+                _stats['waits'] += 1
+            remaining = DB_POOL_WAIT_TIMEOUT - (time.monotonic() - waited_from)
+            if remaining <= 0:
+                _stats['wait_ms'] += (time.monotonic() - waited_from) * 1000
+                raise psycopg2.pool.PoolError(f"no free connection in {DB_POOL_WAIT_TIMEOUT}s (max {DB_POOL_MAX})")
+            _lock.wait(remaining)
+
+    if waited_from is not None:
+        _stats['wait_ms'] += (time.monotonic() - waited_from) * 1000
+    try:
+        conn = _connect()
+    finally:
+        with _lock:
+            _opening -= 1
+    with _lock:
+        _in_use.add(conn)
+    return conn
+
+
+def release_connection(conn):
+    """Возвращает соединение в пул; незакоммиченная транзакция откатывается, как при close()"""
+    if conn is None:
+        return
+    with _lock:
+        if conn not in _in_use:
+            # Уже возвращено (повторный release в finally/except)
+            return
+        _in_use.discard(conn)
+        try:
+            if conn.closed:
+                _stats['discarded'] += 1
+            else:
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+                if len(_idle) < DB_POOL_MAX:
+                    _idle.append((conn, time.monotonic()))
+                else:
+                    _close_quietly(conn)
+        except Exception as e:
+            print(f"[db_pool] connection reset failed: {e}")
+            _close_quietly(conn)
+        _lock.notify()
+
+
+def pool_stats() -> dict:
+    """Счётчики пула: connects — новых соединений (TCP/TLS/auth), reuses — выдач без них"""
+    with _lock:
+        return {**_stats, 'wait_ms': round(_stats['wait_ms'], 1), 'idle': len(_idle), 'in_use': len(_in_use)}
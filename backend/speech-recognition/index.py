@@ -3,20 +3,17 @@ API для распознавания голосовых сообщений че
 Поддерживает Yandex SpeechKit, OpenAI Whisper, Google Speech-to-Text.
 """
 import json
-import os
 import base64
-import psycopg2
 from typing import Dict, Any, Optional
 import requests
 import time
+from db_pool import get_connection, release_connection
+from token_logger import log_token_usage, buffered_token_usage
 
 
 def get_db_connection():
-    """Создает подключение к БД"""
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        raise ValueError('DATABASE_URL not configured')
-    return psycopg2.connect(dsn)
+    """Подключение к БД из пула (возвращать через release_connection)"""
+    return get_connection()
 
 
 def get_tenant_settings(tenant_id: int) -> Dict[str, Any]:
@@ -59,7 +56,7 @@ def get_tenant_settings(tenant_id: int) -> Dict[str, Any]:
                 'proxy_google': row[6]
             }
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 def get_api_key(tenant_id: int, provider: str, key_name: str) -> Optional[str]:
@@ -78,7 +75,7 @@ def get_api_key(tenant_id: int, provider: str, key_name: str) -> Optional[str]:
             row = cur.fetchone()
             return row[0] if row else None
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 def parse_proxy(proxy_string: str) -> Optional[Dict[str, str]]:
@@ -104,25 +101,15 @@ def parse_proxy(proxy_string: str) -> Optional[Dict[str, str]]:
 
 
 def log_usage(tenant_id: int, provider: str, audio_duration_seconds: float, cost: float):
-    """Записывает использование распознавания речи в token_usage"""
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO t_p56134400_telegram_ai_bot_pdf.token_usage 
-                (tenant_id, operation_type, model, tokens_used, cost_rubles, metadata)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                tenant_id,
-                'speech_recognition',
-                provider,
-                int(audio_duration_seconds),
-                cost,
-                json.dumps({'audio_duration_seconds': audio_duration_seconds})
-            ))
-            conn.commit()
-    finally:
-        conn.close()
+    """Записывает использование распознавания речи в token_usage (через буфер token_logger)"""
+    log_token_usage(
+        tenant_id=tenant_id,
+        operation_type='speech_recognition',
+        model=provider,
+        tokens_used=int(audio_duration_seconds),
+        metadata={'audio_duration_seconds': audio_duration_seconds},
+        cost_rubles=cost
+    )
 
 
 def calculate_cost(provider: str, audio_duration_seconds: float) -> float:
@@ -207,6 +194,7 @@ def transcribe_google(audio_base64: str, api_key: str, proxies: Optional[Dict[st
     return ''
 
 
+@buffered_token_usage
 def handler(event: dict, context) -> dict:
     """
     Распознает голосовое сообщение через выбранный провайдер.
@@ -303,7 +291,7 @@ def handler(event: dict, context) -> dict:
                     """, (body['enabled'], provider, tenant_id))
                     conn.commit()
             finally:
-                conn.close()
+                release_connection(conn)
             
             return {
                 'statusCode': 200,
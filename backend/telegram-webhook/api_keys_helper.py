@@ -1,7 +1,7 @@
 """Утилита для работы с API ключами клиентов"""
 import os
 import json
-import psycopg2
+from db_pool import get_connection, release_connection
 
 def get_tenant_id_by_bot_token(bot_token: str) -> int | None:
     """
@@ -21,7 +21,7 @@ def get_tenant_id_by_bot_token(bot_token: str) -> int | None:
         if bot_token.startswith('/bot'):
             bot_token = bot_token[4:]
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         cur.execute("""
@@ -35,7 +35,7 @@ def get_tenant_id_by_bot_token(bot_token: str) -> int | None:
         
         row = cur.fetchone()
         cur.close()
-        conn.close()
+        release_connection(conn)
         
         return row[0] if row else None
         
@@ -56,7 +56,7 @@ def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[st
         (key_value, error_response) - либо значение ключа, либо HTTP ошибка
     """
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         cur.execute("""
@@ -70,7 +70,7 @@ def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[st
         
         row = cur.fetchone()
         cur.close()
-        conn.close()
+        release_connection(conn)
         
         if not row:
             error_msg = f"API ключ не настроен: {provider}.{key_name}. Добавьте ключи в админ-панели."
@@ -8,6 +8,9 @@ sys.path.append('/function/code')
 from api_keys_helper import get_tenant_api_key, get_tenant_id_by_bot_token
 from formatting_helper import get_formatting_settings, format_with_settings
 
+# Сколько ждём ответа chat; передаётся ему как дедлайн, чтобы он уложился сам
+CHAT_TIMEOUT_SECONDS = 60
+
 def handler(event: dict, context) -> dict:
     """Webhook для Telegram-бота: принимает сообщения и отвечает через AI-консьержа"""
     method = event.get('httpMethod', 'POST')
@@ -230,10 +233,11 @@ def handler(event: dict, context) -> dict:
                     'message': user_message,
                     'sessionId': session_id,
                     'tenantId': tenant_id,
-                    'channel': 'telegram'
+                    'channel': 'telegram',
+                    'deadlineMs': CHAT_TIMEOUT_SECONDS * 1000
                 },
                 headers={'Content-Type': 'application/json'},
-                timeout=60
+                timeout=CHAT_TIMEOUT_SECONDS
             )
             chat_response.raise_for_status()
             chat_data = chat_response.json()
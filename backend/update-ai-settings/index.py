@@ -1,11 +1,51 @@
 import json
 import os
+import re
 import psycopg2
 from datetime import datetime
 import sys
 sys.path.insert(0, '/function/code/shared')
 from auth_middleware import get_tenant_id_from_request
 
+# Шаблоны query_date_patterns объединяются в chat в одно выражение (chat/query_preprocessing.py):
+# глобальные флаги в середине выражения не компилируются, номерные ссылки указывают на чужие группы
+_GLOBAL_FLAGS_RE = re.compile(r'\(\?[aiLmsux]+\)')
+_NUMBERED_BACKREF_RE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+
+def query_date_patterns_error(config) -> str:
+    """Текст ошибки для ai_settings.query_date_patterns или '' если настройка корректна"""
+    if config is None:
+        return ''
+    if not isinstance(config, dict):
+        return 'query_date_patterns must be an object'
+    patterns = [spec.get('pattern') if isinstance(spec, dict) else spec for spec in config.get('relative') or []]
+    patterns += list(config.get('history') or [])
+    for pattern in patterns:
+        if not isinstance(pattern, str) or not pattern:
+            return 'query_date_patterns: pattern must be a non-empty string'
+        if _GLOBAL_FLAGS_RE.search(pattern):
+            return f'query_date_patterns: inline global flags are not allowed in {pattern!r}, use (?i:...)'
+        if _NUMBERED_BACKREF_RE.search(pattern):
+            return f'query_date_patterns: numbered backreferences are not allowed in {pattern!r}'
+        try:
+            re.compile(f'(?=(?P<t0>{pattern}))', re.IGNORECASE)
+        except re.error as e:
+            return f'query_date_patterns: invalid pattern {pattern!r}: {e}'
+    return ''
+
+
+def answer_cache_threshold_error(value) -> str:
+    """Порог косинуса семантического кэша ответов: как в chat/answer_cache.py, от 0.5 до 1"""
+    try:
+        threshold = float(value)
+    except (TypeError, ValueError):
+        return 'answer_cache_threshold must be a number'
+    if not 0.5 <= threshold <= 1.0:
+        return 'answer_cache_threshold must be between 0.5 and 1'
+    return ''
+
+
 def handler(event: dict, context) -> dict:
     """Обновление настроек AI провайдеров"""
     method = event.get('httpMethod', 'POST')
@@ -42,6 +82,17 @@ def handler(event: dict, context) -> dict:
         if not settings and body:
             settings = body
 
+        settings_error = query_date_patterns_error(settings.get('query_date_patterns'))
+        if not settings_error and 'answer_cache_threshold' in settings:
+            settings_error = answer_cache_threshold_error(settings['answer_cache_threshold'])
+        if settings_error:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': settings_error}),
+                'isBase64Encoded': False
+            }
+
         conn = psycopg2.connect(os.environ['DATABASE_URL'])
         cur = conn.cursor()
 
@@ -86,7 +137,7 @@ def handler(event: dict, context) -> dict:
         for key, value in settings.items():
             if key in ['temperature', 'top_p', 'frequency_penalty', 'presence_penalty']:
                 ai_settings[key] = str(value)
-            elif key in ['provider', 'chat_provider', 'chat_model', 'embedding_provider', 'embedding_model', 'system_prompt', 'max_tokens', 'system_priority', 'creative_mode', 'model', 'enable_pure_prompt_mode', 'rag_topk_default', 'rag_topk_fallback']:
+            elif key in ['provider', 'chat_provider', 'chat_model', 'embedding_provider', 'embedding_model', 'system_prompt', 'max_tokens', 'system_priority', 'creative_mode', 'model', 'enable_pure_prompt_mode', 'rag_topk_default', 'rag_topk_fallback', 'fallback_provider', 'fallback_model', 'voice_fallback_provider', 'voice_fallback_model', 'voice_hedge_ms', 'query_date_patterns', 'prompt_token_budget', 'answer_cache_enabled', 'answer_cache_threshold']:
                 ai_settings[key] = value
         
         # Синхронизация новой и старой схемы (обратная совместимость)
@@ -105,7 +156,8 @@ def handler(event: dict, context) -> dict:
             ON CONFLICT (tenant_id) 
             DO UPDATE SET 
                 ai_settings = EXCLUDED.ai_settings,
-                updated_at = CURRENT_TIMESTAMP
+                updated_at = CURRENT_TIMESTAMP,
+                settings_version = tenant_settings.settings_version + 1
         """, (tenant_id, ai_settings_json))
 
         conn.commit()
@@ -1,14 +1,14 @@
 """Утилита для работы с API ключами клиентов"""
 import os
 import json
-import psycopg2
+from db_pool import get_connection, release_connection
 
 def get_tenant_id_by_secret(secret: str) -> int | None:
     """
     Определяет tenant_id по VK secret_key.
     """
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         cur.execute("""
@@ -22,7 +22,7 @@ def get_tenant_id_by_secret(secret: str) -> int | None:
         
         row = cur.fetchone()
         cur.close()
-        conn.close()
+        release_connection(conn)
         
         return row[0] if row else None
         
@@ -43,7 +43,7 @@ def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[st
         (key_value, error_response) - либо значение ключа, либо HTTP ошибка
     """
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         cur.execute("""
@@ -57,7 +57,7 @@ def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[st
         
         row = cur.fetchone()
         cur.close()
-        conn.close()
+        release_connection(conn)
         
         if not row:
             error_msg = f"API ключ не настроен: {provider}.{key_name}. Добавьте ключи в админ-панели."
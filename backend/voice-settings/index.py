@@ -155,7 +155,8 @@ def handler(event: dict, context) -> dict:
 
             cur.execute(f"""
                 UPDATE {schema}.tenant_settings
-                SET ai_settings = COALESCE(ai_settings, '{{}}'::jsonb) || %s::jsonb
+                SET ai_settings = COALESCE(ai_settings, '{{}}'::jsonb) || %s::jsonb,
+                    settings_version = settings_version + 1
                 WHERE tenant_id = %s
             """, (json.dumps(ai_update), int(tenant_id)))
 
@@ -1,14 +1,15 @@
 import json
-import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import requests
 from datetime import datetime
 from pathlib import Path
+from db_pool import get_connection, release_connection
 
 # URL функции chat для отправки сообщений в AI
 # Обновляется автоматически при sync_backend
 CHAT_FUNCTION_URL = 'https://functions.poehali.dev/7b58f4fb-5db0-4f85-bb3b-55bafa4cbf73'
+# Сколько ждём ответа chat; передаётся ему как дедлайн, чтобы он уложился сам
+CHAT_TIMEOUT_SECONDS = 30
 
 def handler(event: dict, context) -> dict:
     """Webhook для обработки входящих звонков от Voximplant и взаимодействия с AI-ботом"""
@@ -56,7 +57,7 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         schema = 't_p56134400_telegram_ai_bot_pdf'
 
@@ -72,7 +73,7 @@ def handler(event: dict, context) -> dict:
 
         if not tenant:
             cur.close()
-            conn.close()
+            release_connection(conn)
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -132,7 +133,7 @@ def handler(event: dict, context) -> dict:
                         """)
                         conn.commit()
                         cur.close()
-                        conn.close()
+                        release_connection(conn)
                         
                         return {
                             'statusCode': 200,
@@ -153,7 +154,8 @@ def handler(event: dict, context) -> dict:
                     'tenantSlug': tenant_slug,
                     'sessionId': f"voice_{call_id}",
                     'message': speech_text,
-                    'channel': 'voice'
+                    'channel': 'voice',
+                    'deadlineMs': CHAT_TIMEOUT_SECONDS * 1000
                 }
                 print(f"[Voximplant] Отправка в AI: url={chat_url}, payload={request_payload}")
                 
@@ -162,7 +164,7 @@ def handler(event: dict, context) -> dict:
                         chat_url,
                         json=request_payload,
                         headers={'Content-Type': 'application/json'},
-                        timeout=30
+                        timeout=CHAT_TIMEOUT_SECONDS
                     )
                     
                     print(f"[Voximplant] AI response: status={ai_response.status_code}, body={ai_response.text[:500]}")
@@ -200,7 +202,7 @@ def handler(event: dict, context) -> dict:
                             """)
                             conn.commit()
                             cur.close()
-                            conn.close()
+                            release_connection(conn)
                             
                             return {
                                 'statusCode': 200,
@@ -243,7 +245,7 @@ def handler(event: dict, context) -> dict:
             conn.commit()
             
             cur.close()
-            conn.close()
+            release_connection(conn)
             
             return {
                 'statusCode': 200,
@@ -255,7 +257,7 @@ def handler(event: dict, context) -> dict:
             response_text = "Извините, произошла ошибка."
 
         cur.close()
-        conn.close()
+        release_connection(conn)
 
         response_data = {
             'text': response_text,
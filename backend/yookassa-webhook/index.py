@@ -185,6 +185,13 @@ def handler(event: dict, context) -> dict:
                             VALUES (%s)
                         """, (tenant_id,))
                     
+                    # Версия 1, а не 0: chat мог закэшировать «пустой» контекст этого tenant_id с версией 0
+                    cur.execute("""
+                        UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+                        SET settings_version = settings_version + 1
+                        WHERE tenant_id = %s
+                    """, (tenant_id,))
+                    
                     # Копируем API-ключи из шаблона (для эмбеддингов и AI)
                     cur.execute("""
                         SELECT provider, key_name, key_value, is_active
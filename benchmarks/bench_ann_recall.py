@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Recall@k и скорость IVF-индекса (backend/chat/ann_index.py) против точного поиска.
+
+Запуск:
+    python benchmarks/bench_ann_recall.py                 # синтетические кластеризованные векторы
+    python benchmarks/bench_ann_recall.py --tenant-id 3   # реальные эмбеддинги тенанта (нужен DATABASE_URL)
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'chat'))
+from retrieval_engine import RetrievalEngine  # noqa: E402
+from ann_index import IVFIndex  # noqa: E402
+
+
+def synthetic_embeddings(n: int, dim: int, n_topics: int, seed: int) -> np.ndarray:
+    """Смесь гауссиан на сфере — похоже на эмбеддинги документов с несколькими темами"""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim))
+    labels = rng.integers(0, n_topics, size=n)
+    return (topics[labels] + 0.6 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+def tenant_embeddings(tenant_id: int) -> np.ndarray:
+    import psycopg2
+    from embedding_codec import decode_row_embedding
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT embedding_bin, embedding_dim, CASE WHEN embedding_bin IS NULL THEN embedding_text END
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        WHERE tenant_id = %s AND (embedding_bin IS NOT NULL OR embedding_text IS NOT NULL)
+        ORDER BY id
+    """, (tenant_id,))
+    matrix = np.vstack([decode_row_embedding(*row) for row in cur.fetchall()])
+    cur.close()
+    conn.close()
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='2000,10000,50000')
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--k', type=int, default=15)
+    parser.add_argument('--nprobe', default='4,10,20')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--tenant-id', type=int)
+    args = parser.parse_args()
+
+    datasets = []
+    if args.tenant_id:
+        datasets.append((f'tenant {args.tenant_id}', tenant_embeddings(args.tenant_id)))
+    else:
+        for n in (int(x) for x in args.sizes.split(',')):
+            datasets.append((f'synthetic n={n}', synthetic_embeddings(n, args.dim, n_topics=max(8, n // 250), seed=n)))
+
+    rng = np.random.default_rng(42)
+    for name, matrix in datasets:
+        n = matrix.shape[0]
+        engine = RetrievalEngine([''] * n, matrix, chunk_ids=range(n))
+
+        t0 = time.perf_counter()
+        index = IVFIndex.build(matrix, range(n))
+        build_s = time.perf_counter() - t0
+        index.bind(engine.chunk_ids)
+
+        # Запросы — зашумлённые векторы из самой коллекции
+        picks = rng.integers(0, n, size=args.queries)
+        queries = matrix[picks] + 0.3 * rng.normal(size=(args.queries, matrix.shape[1])).astype(np.float32)
+
+        t0 = time.perf_counter()
+        exact = [set(engine.top_k_indices(q, args.k, exact=True)[0].tolist()) for q in queries]
+        exact_ms = (time.perf_counter() - t0) * 1000 / args.queries
+
+        print(f"\n{name}: dim={matrix.shape[1]} lists={index.n_lists} build={build_s:.2f}s exact={exact_ms:.3f} ms/query")
+        for nprobe in (int(x) for x in args.nprobe.split(',')):
+            hits = 0
+            t0 = time.perf_counter()
+            for q, truth in zip(queries, exact):
+                qn = q / np.linalg.norm(q)
+                rows = index.candidates(qn, nprobe)
+                scores = engine.matrix[rows] @ qn
+                found = rows[np.argsort(-scores)[:args.k]]
+                hits += len(truth & set(found.tolist()))
+            ann_ms = (time.perf_counter() - t0) * 1000 / args.queries
+            recall = hits / (args.k * args.queries)
+            print(f"  nprobe={nprobe:<3} recall@{args.k}={recall:.3f}  ann={ann_ms:.3f} ms/query  speedup={exact_ms / ann_ms:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
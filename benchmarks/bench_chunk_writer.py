@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Запись чанков документа в process-pdf (backend/process-pdf/chunk_writer.py).
+
+old — как было: autocommit, два INSERT на каждый чанк (document_chunks + tenant_chunks),
+      chunks_version отдельной командой и статус документа через второе соединение.
+new — replace_document_chunks: по одному execute_values на таблицу, всё в одной транзакции.
+
+Без базы (по умолчанию) команды пишутся в курсор-заглушку: проверяется, что строки
+совпадают с прежним циклом, и считаются команды, коммиты и объём SQL. Время — измеренная
+подготовка строк на Python плюс модель сети: BENCH_RTT_MS на команду и BENCH_COMMIT_MS
+на коммит (в autocommit каждая команда — свой сброс WAL).
+
+С BENCH_DATABASE_URL обе версии выполняются на настоящей базе (нужны миграции; строки
+пишутся под несуществующими tenant_id/document_id и удаляются после замера).
+
+Запуск:
+    python benchmarks/bench_chunk_writer.py
+    BENCH_DATABASE_URL=postgres://... python benchmarks/bench_chunk_writer.py
+"""
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'process-pdf'))
+import chunk_writer  # noqa: E402
+from chunk_writer import replace_document_chunks  # noqa: E402
+from lexical_index import PREPROCESS_VERSION, preprocess_chunk  # noqa: E402
+
+BENCH_RTT_MS = float(os.environ.get('BENCH_RTT_MS', '1.0'))
+BENCH_COMMIT_MS = float(os.environ.get('BENCH_COMMIT_MS', '0.5'))
+BENCH_DATABASE_URL = os.environ.get('BENCH_DATABASE_URL')
+
+TENANT_ID = -23
+DOCUMENT_ID = -23
+DIM = 256
+
+WORDS = ('номер', 'завтрак', 'парковка', 'заезд', 'выезд', 'бассейн', 'трансфер', 'check-in',
+         'breakfast', 'ресторан', '14:00', '12:00', 'стоимость', 'рублей', 'сауна', 'Wi-Fi')
+
+
+def make_chunks(n):
+    rng = random.Random(n)
+    chunks = []
+    for i in range(n):
+        text = ' '.join(rng.choice(WORDS) for _ in range(140))[:1000]
+        vector = [rng.uniform(-1, 1) for _ in range(DIM)]
+        embedding_bin = struct.pack(f'<{DIM}f', *vector)
+        chunks.append((text, text + ' [даты]', '[' + ','.join(f'{v:.6f}' for v in vector) + ']',
+                       embedding_bin, DIM, f'{i:064x}'))
+    return chunks
+
+
+# --- old: прежний цикл из process-pdf/index.py ---
+
+def old_write(cur, cur2, tenant_id, document_id, chunk_embeddings, pages_count):
+    cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunks WHERE document_id = %s", (document_id,))
+    cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks WHERE document_id = %s", (document_id,))
+    for idx, (chunk_text, enriched_text, embedding_json, embedding_bin, embedding_dim, chunk_key) in enumerate(chunk_embeddings):
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_chunks
+            (document_id, chunk_text, chunk_index, embedding_text, embedding_bin, embedding_dim)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (document_id, chunk_text, idx, embedding_json, embedding_bin, embedding_dim))
+        chunk_clean, chunk_lang, chunk_tokens = preprocess_chunk(chunk_text)
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+            (tenant_id, document_id, chunk_text, chunk_index, embedding_text, enriched_text, embedding_bin, embedding_dim,
+             chunk_clean, chunk_lang, chunk_tokens, preprocess_version, embedding_key)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (tenant_id, document_id, chunk_text, idx, embedding_json, enriched_text, embedding_bin, embedding_dim,
+              chunk_clean, chunk_lang, chunk_tokens, PREPROCESS_VERSION, chunk_key))
+    cur.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+        SET chunks_version = chunks_version + 1
+        WHERE tenant_id = %s
+        RETURNING chunks_version
+    """, (tenant_id,))
+    cur.fetchone()
+    cur2.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_documents
+        SET status = 'ready', pages = %s
+        WHERE id = %s
+        RETURNING id, status
+    """, (pages_count, document_id))
+    cur2.fetchone()
+
+
+# --- курсор-заглушка: пишет команды вместо отправки в базу ---
+
+def _quote(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "'\\x" + bytes(value).hex() + "'::bytea"
+    if isinstance(value, (list, tuple)):
+        return 'ARRAY[' + ','.join(_quote(v) for v in value) + ']'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+class RecordingConnection:
+    encoding = 'UTF8'
+
+    def __init__(self, autocommit):
+        self.autocommit = autocommit
+
+
+class RecordingCursor:
+    def __init__(self, autocommit):
+        self.connection = RecordingConnection(autocommit)
+        self.statements = []  # (sql, params) для execute, (bytes, None) для execute_values
+        self.sql_bytes = 0
+
+    def mogrify(self, template, args):
+        return template % tuple(_quote(a).encode('utf-8') for a in args)
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+        if isinstance(sql, bytes):
+            self.sql_bytes += len(sql)
+        else:
+            self.sql_bytes += len(sql.encode('utf-8')) + len(_quote(tuple(params or ())).encode('utf-8'))
+
+    def fetchone(self):
+        return (1,)
+
+    def fetchall(self):
+        return []
+
+
+def old_rows(cur):
+    """Параметры INSERT прежнего цикла по таблицам"""
+    doc, tenant = [], []
+    for sql, params in cur.statements:
+        if isinstance(sql, str) and 'INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_chunks' in sql:
+            doc.append(params)
+        elif isinstance(sql, str) and 'INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunks' in sql:
+            tenant.append(params)
+    return doc, tenant
+
+
+def best_of(fn, repeats):
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_modeled(n, chunks):
+    def old():
+        cur, cur2 = RecordingCursor(True), RecordingCursor(True)
+        old_write(cur, cur2, TENANT_ID, DOCUMENT_ID, chunks, 20)
+        return cur, cur2
+
+    def new():
+        cur = RecordingCursor(False)
+        replace_document_chunks(cur, TENANT_ID, DOCUMENT_ID, chunks, 20)
+        return cur
+
+    repeats = 5 if n <= 200 else 2
+    old_py_ms, (old_cur, old_cur2) = best_of(old, repeats)
+    new_py_ms, new_cur = best_of(new, repeats)
+
+    # Золотая проверка: в базу уходят те же строки, что и раньше
+    doc, tenant = old_rows(old_cur)
+    ok = (doc == chunk_writer.document_chunk_rows(DOCUMENT_ID, chunks)
+          and tenant == chunk_writer.tenant_chunk_rows(TENANT_ID, DOCUMENT_ID, chunks))
+
+    old_statements = len(old_cur.statements) + len(old_cur2.statements)
+    new_statements = len(new_cur.statements) + 1  # + COMMIT
+    # autocommit: каждая команда — свой коммит; плюс подключение второго соединения
+    old_ms = old_py_ms + old_statements * (BENCH_RTT_MS + BENCH_COMMIT_MS) + BENCH_RTT_MS
+    new_ms = new_py_ms + new_statements * BENCH_RTT_MS + BENCH_COMMIT_MS
+    ok = ok and new_statements <= 9
+    print(f"n={n:>5}: old={old_ms:9.1f} ms ({old_statements:>4} stmts, {old_cur.sql_bytes / 1e6:5.2f} MB)  "
+          f"new={new_ms:8.1f} ms ({new_statements:>2} stmts, {new_cur.sql_bytes / 1e6:5.2f} MB)  "
+          f"speedup={old_ms / new_ms:5.1f}x  identical_rows={ok}")
+    return ok
+
+
+def run_database(n, chunks):
+    import psycopg2
+
+    conn = psycopg2.connect(BENCH_DATABASE_URL)
+    conn2 = psycopg2.connect(BENCH_DATABASE_URL)
+    conn2.autocommit = True
+    cur, cur2 = conn.cursor(), conn2.cursor()
+
+    def read_back():
+        cur.execute("""
+            SELECT chunk_index, chunk_text, enriched_text, embedding_bin, chunk_tokens, embedding_key
+            FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks WHERE document_id = %s ORDER BY chunk_index
+        """, (DOCUMENT_ID,))
+        return [(r[0], r[1], r[2], bytes(r[3]), r[4], r[5]) for r in cur.fetchall()]
+
+    def cleanup():
+        conn.autocommit = True
+        cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunks WHERE document_id = %s", (DOCUMENT_ID,))
+        cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks WHERE document_id = %s", (DOCUMENT_ID,))
+
+    try:
+        conn.autocommit = True
+        started = time.perf_counter()
+        old_write(cur, cur2, TENANT_ID, DOCUMENT_ID, chunks, 20)
+        old_ms = (time.perf_counter() - started) * 1000
+        old_result = read_back()
+        cleanup()
+
+        conn.autocommit = False
+        started = time.perf_counter()
+        replace_document_chunks(cur, TENANT_ID, DOCUMENT_ID, chunks, 20)
+        conn.commit()
+        new_ms = (time.perf_counter() - started) * 1000
+        conn.autocommit = True
+        ok = read_back() == old_result and len(old_result) == n
+        print(f"n={n:>5}: old={old_ms:9.1f} ms  new={new_ms:8.1f} ms  speedup={old_ms / new_ms:5.1f}x  identical_rows={ok}")
+        return ok
+    finally:
+        cleanup()
+        conn.close()
+        conn2.close()
+
+
+def main():
+    mode = 'database' if BENCH_DATABASE_URL else f'modeled: rtt={BENCH_RTT_MS}ms, commit={BENCH_COMMIT_MS}ms'
+    print(f"chunk write ({mode})")
+    ok = True
+    for n in (50, 200, 2000):
+        chunks = make_chunks(n)
+        ok = (run_database(n, chunks) if BENCH_DATABASE_URL else run_modeled(n, chunks)) and ok
+    if not ok:
+        print("FAIL: bulk writer rows differ from the per-row loop")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
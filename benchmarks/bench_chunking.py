@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Разбиение документов на чанки (backend/process-pdf/chunker.py): fixed против structured.
+
+fixed      — как было: срезы по 1000 символов склеенного текста страниц.
+structured — абзацы, заголовки и строки таблиц целиком, target/overlap из CHUNK_TARGET_CHARS
+             и CHUNK_OVERLAP_CHARS (или --target/--overlap).
+
+Образцы — синтетические брошюры отелей в том виде, в каком их отдаёт PdfReader.extract_text():
+строки по ~90 символов, заголовки, тарифные таблицы с периодами и ценами, абзацы услуг.
+Для каждого факта (строка тарифа или предложение) есть вопрос; попадание — факт целиком
+в одном из top-k чанков по BM25 (LexicalIndex, как в chat). Оценка токенов — символы / 4.
+
+Золотые проверки: fixed совпадает с прежним разбиением, structured не режет факты
+и при возобновлении с чекпоинта (состояние через JSON после каждой страницы) даёт те же чанки.
+
+Запуск:
+    python benchmarks/bench_chunking.py
+    python benchmarks/bench_chunking.py --target 1200 --overlap 100 brochure.pdf ...
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'process-pdf'))
+from chunker import CHUNK_OVERLAP_CHARS, CHUNK_TARGET_CHARS, FixedChunker, StructuredChunker  # noqa: E402
+from lexical_index import LexicalIndex, detect_lang_simple, tokenize  # noqa: E402
+
+ROOMS = ['Стандарт', 'Комфорт', 'Семейный', 'Делюкс', 'Люкс', 'Апартаменты', 'Коттедж', 'Студия']
+SEASONS = [('09.01.2026', '28.02.2026'), ('01.03.2026', '31.05.2026'), ('01.06.2026', '31.08.2026'),
+           ('01.09.2026', '31.10.2026'), ('01.11.2026', '27.12.2026')]
+SERVICES = [
+    ('Завтрак', 'подаётся в ресторане «{place}» с {a}:00 до {b}:30'),
+    ('Бассейн', 'открыт ежедневно с {a}:00 до {b}:00, вход по браслету гостя'),
+    ('Трансфер', 'из аэропорта стоит {price} рублей за автомобиль до четырёх человек'),
+    ('Парковка', 'находится у корпуса {n}, стоимость {price} рублей в сутки'),
+    ('Сауна', 'работает с {a}:00 до {b}:00 по предварительной записи на ресепшен'),
+    ('Прокат велосипедов', 'доступен у корпуса {n} с {a}:00, час катания {price} рублей'),
+    ('Детский клуб', 'принимает детей от 4 лет с {a}:00 до {b}:00 в корпусе {n}'),
+    ('Спа-центр', 'предлагает массаж от {price} рублей, запись с {a}:00 до {b}:00'),
+]
+PLACES = ['Волна', 'Берег', 'Сосны', 'Маяк', 'Причал']
+FILLER = ('Отель расположен на первой линии в окружении соснового леса. Номера оборудованы кондиционером, '
+          'телевизором и мини-баром. Гости могут воспользоваться тренажёрным залом и библиотекой. '
+          'Уборка номеров проводится ежедневно, смена белья раз в три дня. На территории работает '
+          'круглосуточная охрана и видеонаблюдение. Для гостей с животными действуют особые правила. ')
+
+
+def wrap(text, width=90):
+    """Строки, как их отдаёт extract_text(): перенос по ширине колонки"""
+    lines, line = [], ''
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}' if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def make_brochure(seed):
+    """(тексты страниц, [(вопрос, факт)])"""
+    rng = random.Random(seed)
+    hotel = rng.choice(['«Солнечный»', '«Морской бриз»', '«Горный воздух»', '«Озёрный»'])
+    lines, facts = [], []
+
+    lines += [f'ОТЕЛЬ {hotel.upper()}', '']
+    for _ in range(rng.randint(2, 4)):
+        lines += wrap(FILLER) + ['']
+
+    rooms = rng.sample(ROOMS, rng.randint(5, 8))
+    lines += ['ТАРИФЫ НА ПРОЖИВАНИЕ', 'Категория Период Будни Выходные']
+    for room in rooms:
+        for start, end in SEASONS:
+            weekday = rng.randrange(35, 250) * 100
+            row = f'{room} {start}-{end} {weekday:,} {weekday + rng.randrange(5, 30) * 100:,}'.replace(',', ' ')
+            lines.append(row)
+            facts.append((f'цена {room} {start}-{end}', row))
+    lines += ['Цены указаны в рублях за номер в сутки с завтраком.', '']
+
+    lines += ['УСЛУГИ И ИНФРАСТРУКТУРА', '']
+    for name, template in rng.sample(SERVICES, len(SERVICES)):
+        sentence = f'{name} ' + template.format(place=rng.choice(PLACES), a=rng.randint(6, 11), b=rng.randint(12, 22),
+                                                n=rng.randint(1, 9), price=rng.randrange(3, 40) * 100) + '.'
+        paragraph = ' '.join(rng.sample(FILLER.split('. '), 3)).strip() + ' ' + sentence + ' ' + \
+            rng.choice(FILLER.split('. ')).strip() + '.'
+        lines += wrap(paragraph) + ['']
+        facts.append((name.lower(), sentence))
+
+    lines += ['ПРАВИЛА ПРОЖИВАНИЯ:', '']
+    checkin, checkout = rng.randint(13, 15), rng.randint(11, 12)
+    rules = (f'Расчётный час: заезд с {checkin}:00, выезд до {checkout}:00. Ранний заезд возможен при наличии '
+             f'свободных номеров за доплату 50% стоимости суток. Курение на территории запрещено, штраф '
+             f'{rng.randrange(3, 10)} 000 рублей.')
+    lines += wrap(rules) + ['']
+    facts.append(('заезд выезд расчётный час', f'заезд с {checkin}:00, выезд до {checkout}:00.'))
+
+    # Страницы по ~45 строк, как в брошюре A4
+    pages = ['\n'.join(lines[i:i + 45]) for i in range(0, len(lines), 45)]
+    return pages, facts
+
+
+def normalize(text):
+    return ' '.join(text.split())
+
+
+def run_chunker(make, pages, resume=False):
+    chunker = make(None)
+    chunks = []
+    for page_text in pages:
+        chunks += chunker.feed(page_text)
+        if resume:
+            # Следующая страница — в новом вызове process-pdf, состояние из чекпоинта
+            chunker = make(json.loads(json.dumps(chunker.state())))
+    return chunks + chunker.finish()
+
+
+def old_fixed(pages):
+    full_text = ''.join(page + '\n\n' for page in pages)
+    return [full_text[i:i + 1000] for i in range(0, len(full_text), 1000) if full_text[i:i + 1000].strip()]
+
+
+def hit_rates(chunks, facts, ks=(1, 3)):
+    index = LexicalIndex.build(chunks)
+    normalized = [normalize(c) for c in chunks]
+    hits = {k: 0 for k in ks}
+    intact = 0
+    for question, fact in facts:
+        fact = normalize(fact)
+        intact += any(fact in c for c in normalized)
+        scores = index.scores(tokenize(question + ' ' + fact.split()[0], detect_lang_simple(question)))
+        ranked = sorted(range(len(chunks)), key=lambda i: -scores[i])
+        for k in ks:
+            hits[k] += any(fact in normalized[i] for i in ranked[:k])
+    n = len(facts)
+    return intact / n, {k: v / n for k, v in hits.items()}
+
+
+def tokens_estimate(chunks):
+    return sum(len(c) // 4 for c in chunks)
+
+
+def extract_pdf_pages(path):
+    import PyPDF2
+    reader = PyPDF2.PdfReader(path)
+    return [page.extract_text() or '' for page in reader.pages]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', type=int, default=CHUNK_TARGET_CHARS)
+    parser.add_argument('--overlap', type=int, default=CHUNK_OVERLAP_CHARS)
+    parser.add_argument('pdfs', nargs='*')
+    args = parser.parse_args()
+
+    def fixed(state):
+        return FixedChunker(state=state)
+
+    def structured(state):
+        return StructuredChunker(args.target, args.overlap, state)
+
+    ok = True
+    totals = {'fixed': [0, 0, 0.0, 0.0, 0.0], 'structured': [0, 0, 0.0, 0.0, 0.0]}
+    print(f"structured: target={args.target} overlap={args.overlap}")
+    samples = [make_brochure(seed) for seed in range(6)]
+    for seed, (pages, facts) in enumerate(samples):
+        line = f"sample {seed} ({len(pages)} pages, {len(facts):>2} facts):"
+        for name, make in (('fixed', fixed), ('structured', structured)):
+            chunks = run_chunker(make, pages)
+            if name == 'fixed':
+                ok = ok and chunks == old_fixed(pages)
+            ok = ok and run_chunker(make, pages, resume=True) == chunks
+            intact, hits = hit_rates(chunks, facts)
+            if name == 'structured':
+                ok = ok and intact == 1.0
+            t = totals[name]
+            t[0] += len(chunks)
+            t[1] += tokens_estimate(chunks)
+            t[2] += intact * len(facts)
+            t[3] += hits[1] * len(facts)
+            t[4] += hits[3] * len(facts)
+            line += f"  {name}: {len(chunks):>3} chunks {tokens_estimate(chunks):>5} tok intact={intact:4.0%} hit@1={hits[1]:4.0%} hit@3={hits[3]:4.0%}"
+        print(line)
+
+    n_facts = sum(len(facts) for _, facts in samples)
+    for name, (n_chunks, tokens, intact, hit1, hit3) in totals.items():
+        print(f"{name:>10}: chunks={n_chunks:>4}  embedding_tokens≈{tokens:>6}  facts_intact={intact / n_facts:5.1%}  "
+              f"hit@1={hit1 / n_facts:5.1%}  hit@3={hit3 / n_facts:5.1%}")
+
+    for path in args.pdfs:
+        pages = extract_pdf_pages(path)
+        fixed_chunks, structured_chunks = run_chunker(fixed, pages), run_chunker(structured, pages)
+        print(f"{os.path.basename(path)} ({len(pages)} pages): fixed {len(fixed_chunks)} chunks "
+              f"{tokens_estimate(fixed_chunks)} tok, structured {len(structured_chunks)} chunks "
+              f"{tokens_estimate(structured_chunks)} tok")
+
+    if not ok:
+        print("FAIL: chunker golden checks")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Золотые кейсы и микробенчмарк предобработки запроса (backend/chat/query_preprocessing.py).
+
+old — как было: замыкания в handler, словари шаблонов на каждый вызов, отдельный
+      re.search на каждый шаблон, lower() каждого сообщения истории на каждый запрос.
+new — QueryPreprocessor: скомпилированные объединённые выражения, один проход re.sub,
+      кэш даты по сообщению истории.
+
+Золотые кейсы проверяются на фиксированной дате (25.01.2026); отличия от old —
+намеренные исправления: «завтрак» больше не превращается в дату, «на послезавтра»
+даёт +2 дня, а не «на после<завтра>».
+
+Запуск:
+    python benchmarks/bench_query_preprocessing.py
+"""
+import os
+import re
+import sys
+import time
+from calendar import monthrange
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'chat'))
+import query_preprocessing  # noqa: E402
+from query_preprocessing import QueryPreprocessor  # noqa: E402
+
+TODAY = date(2026, 1, 25)
+
+GOLDEN_CONVERT = [
+    ("Есть номера на завтра?", "Есть номера 26 января?"),
+    ("послезавтра свободно?", "27 января свободно?"),
+    ("а на послезавтра?", "а 27 января?"),
+    ("Завтра и послезавтра", "26 января и 27 января"),
+    ("Во сколько завтрак?", "Во сколько завтрак?"),
+    ("заезд через 3 дня", "заезд 28 января"),
+    ("через 2 недели на двоих", "8 февраля на двоих"),
+    ("через неделю", "1 февраля"),
+    ("через месяц люкс", "24 февраля люкс"),
+    ("на следующей неделе есть места?", "1 февраля есть места?"),
+    ("цена на 12 марта", "цена на 12 марта"),
+    ("Сколько стоит стандарт", "Сколько стоит стандарт"),
+]
+
+GOLDEN_ENRICH = [
+    ("цена на 12 марта", "цена на 12 марта Период: 01.03.2026-31.03.2026 12.03.2026"),
+    ("8 января", "8 января Период: 01.01.2027-31.01.2027 8.01.2027"),
+    ("30 января свободно?", "30 января свободно? Период: 01.01.2026-31.01.2026 30.01.2026"),
+    ("15 Мая люкс", "15 Мая люкс Период: 01.05.2026-31.05.2026 15.05.2026"),
+    ("Стоимость люкс", "Стоимость люкс"),
+]
+
+GOLDEN_HISTORY = [
+    ([{'role': 'user', 'content': 'Хочу заехать 12 марта'},
+      {'role': 'assistant', 'content': 'На 20 марта есть люкс'},
+      {'role': 'user', 'content': 'а люкс?'}], '12 марта'),
+    ([{'role': 'user', 'content': '15.04.2026 свободно?'},
+      {'role': 'user', 'content': 'а на 20 мая?'}], '20 мая'),
+    ([{'role': 'user', 'content': 'Период: 01.03.2026-31.03.2026'}], '01.03.2026'),
+    ([{'role': 'user', 'content': 'в марте 2026 года'}], 'марте 2026'),
+    ([{'role': 'user', 'content': '22 Мая 2025'}], '22 мая'),
+    ([{'role': 'assistant', 'content': '12 марта'}, {'role': 'user', 'content': 'спасибо'}], None),
+]
+
+TENANT_CONFIG = {
+    'relative': [
+        {'pattern': r'через\s+пару\s+дней', 'days': 2},
+        {'pattern': r'через\s+(\d+)\s+суток', 'per_unit_days': 1},
+        {'pattern': r'в\s+субботу', 'weekday': 5},
+    ],
+    'history': [r'\d{1,2}\s+(?:янв|фев|мар)\b'],
+}
+
+GOLDEN_TENANT = [
+    ("через пару дней", "27 января"),
+    ("через 4 суток и завтра", "29 января и 26 января"),
+    ("в субботу", "31 января"),
+]
+
+
+def legacy_convert_relative_dates(text, today):
+    relative_patterns = {
+        r'(?:на\s+)?завтра': today + timedelta(days=1),
+        r'(?:на\s+)?послезавтра': today + timedelta(days=2),
+        r'через\s+(\d+)\s+(?:день|дня|дней)': lambda m: today + timedelta(days=int(m.group(1))),
+        r'через\s+неделю': today + timedelta(weeks=1),
+        r'через\s+(\d+)\s+(?:неделю|недели|недель)': lambda m: today + timedelta(weeks=int(m.group(1))),
+        r'через\s+месяц': today + timedelta(days=30),
+        r'на\s+следующей\s+неделе': today + timedelta(weeks=1),
+    }
+    months_ru = [
+        'января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
+        'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря'
+    ]
+    converted_text = text
+    for pattern, replacement in relative_patterns.items():
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            date_obj = replacement(match) if callable(replacement) else replacement
+            date_str = f"{date_obj.day} {months_ru[date_obj.month - 1]}"
+            converted_text = re.sub(pattern, date_str, converted_text, flags=re.IGNORECASE)
+    return converted_text
+
+
+def legacy_extract_date_from_history(history_msgs):
+    date_patterns = [
+        r'\d{1,2}\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)',
+        r'\d{1,2}\.\d{1,2}\.\d{2,4}',
+        r'(январ|феврал|март|апрел|ма|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]{0,2}\s+\d{4}',
+        r'Период:\s*\d{2}\.\d{2}\.\d{4}-\d{2}\.\d{2}\.\d{4}'
+    ]
+    for msg in reversed(history_msgs):
+        if msg['role'] == 'user':
+            text = msg['content'].lower()
+            for pattern in date_patterns:
+                match = re.search(pattern, text, re.IGNORECASE)
+                if match:
+                    return match.group()
+    return None
+
+
+def legacy_enrich_date_query(text, today):
+    date_pattern = r'(\d{1,2})\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)'
+    match = re.search(date_pattern, text, re.IGNORECASE)
+    if match:
+        day_str = match.group(1)
+        months_map = {
+            'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4,
+            'мая': 5, 'июня': 6, 'июля': 7, 'августа': 8,
+            'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12
+        }
+        month_num = months_map[match.group(2).lower()]
+        if month_num < today.month or (month_num == today.month and int(day_str) < today.day):
+            year = today.year + 1
+        else:
+            year = today.year
+        last_day = monthrange(year, month_num)[1]
+        return f"{text} Период: 01.{month_num:02d}.{year}-{last_day:02d}.{month_num:02d}.{year} {day_str}.{month_num:02d}.{year}"
+    return text
+
+
+def check(name, actual, expected, failures):
+    if actual != expected:
+        failures.append(f"{name}: expected {expected!r}, got {actual!r}")
+
+
+def run_golden() -> int:
+    pre = QueryPreprocessor()
+    tenant = QueryPreprocessor(TENANT_CONFIG)
+    failures = []
+    for text, expected in GOLDEN_CONVERT:
+        check(f"convert {text!r}", pre.convert_relative_dates(text, TODAY), expected, failures)
+    for text, expected in GOLDEN_ENRICH:
+        check(f"enrich {text!r}", pre.enrich_date_query(text, TODAY), expected, failures)
+        check(f"legacy enrich {text!r}", legacy_enrich_date_query(text, TODAY), expected, failures)
+    for history, expected in GOLDEN_HISTORY:
+        check(f"history {history[-1]['content']!r}", pre.extract_date_from_history(history), expected, failures)
+        check(f"legacy history {history[-1]['content']!r}", legacy_extract_date_from_history(history), expected, failures)
+    for text, expected in GOLDEN_TENANT:
+        check(f"tenant convert {text!r}", tenant.convert_relative_dates(text, TODAY), expected, failures)
+    check("tenant history", tenant.extract_date_from_history([{'role': 'user', 'content': 'на 3 фев'}]), '3 фев', failures)
+    check("builtin ignores tenant history", pre.extract_date_from_history([{'role': 'user', 'content': 'на 3 фев'}]), None, failures)
+    # Кривой шаблон тенанта пропускается, встроенные продолжают работать
+    broken = QueryPreprocessor({'relative': [{'pattern': '(', 'days': 1}], 'history': ['[']})
+    check("broken tenant config", broken.convert_relative_dates("завтра", TODAY), "26 января", failures)
+
+    total = len(GOLDEN_CONVERT) + 2 * len(GOLDEN_ENRICH) + 2 * len(GOLDEN_HISTORY) + len(GOLDEN_TENANT) + 3
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"golden: {total - len(failures)}/{total} passed")
+    return len(failures)
+
+
+QUERIES = [text for text, _ in GOLDEN_CONVERT + GOLDEN_ENRICH] * 20
+HISTORY = [
+    {'role': 'user' if i % 2 == 0 else 'assistant', 'content': text}
+    for i, text in enumerate([
+        'Здравствуйте, какие есть номера?', 'У нас есть стандарт, комфорт и люкс.',
+        'Сколько стоит люкс?', 'Люкс — 12 000 руб. за ночь.',
+        'А завтрак включён?', 'Да, завтрак включён в стоимость.',
+        'Можно с собакой?', 'Да, с доплатой 1000 руб.',
+        'Хорошо, а парковка есть?', 'Парковка бесплатная.',
+    ])
+]
+
+
+def old_pipeline(query):
+    converted = legacy_convert_relative_dates(query, TODAY)
+    enriched = legacy_enrich_date_query(converted, TODAY)
+    return enriched, legacy_extract_date_from_history(HISTORY)
+
+
+def new_pipeline(query, pre=QueryPreprocessor()):
+    converted = pre.convert_relative_dates(query, TODAY)
+    enriched = pre.enrich_date_query(converted, TODAY)
+    return enriched, pre.extract_date_from_history(HISTORY)
+
+
+def bench(fn, repeats):
+    for query in QUERIES:
+        fn(query)  # прогрев: кэш re, кэш дат по сообщениям
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for query in QUERIES:
+            fn(query)
+    return (time.perf_counter() - started) * 1e6 / (repeats * len(QUERIES))
+
+
+def main():
+    failures = run_golden()
+
+    # DEBUG-принты модуля не нужны в замере
+    query_preprocessing.print = lambda *args, **kwargs: None
+    repeats = 50
+    old_us = bench(old_pipeline, repeats)
+    new_us = bench(new_pipeline, repeats)
+    print(f"per query (convert + enrich + 10-message history): old={old_us:7.1f} us  new={new_us:7.1f} us  speedup={old_us / new_us:4.1f}x")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
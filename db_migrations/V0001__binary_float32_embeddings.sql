@@ -0,0 +1,41 @@
+-- Бинарное хранение эмбеддингов: сырой little-endian float32 (bytea) + размерность.
+-- embedding_text (JSON) остаётся для совместимости: process-pdf пишет обе колонки.
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+    ADD COLUMN IF NOT EXISTS embedding_bin BYTEA,
+    ADD COLUMN IF NOT EXISTS embedding_dim INTEGER;
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.document_chunks
+    ADD COLUMN IF NOT EXISTS embedding_bin BYTEA,
+    ADD COLUMN IF NOT EXISTS embedding_dim INTEGER;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.embedding_bin IS 'Вектор эмбеддинга: little-endian float32, embedding_dim * 4 байт';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.document_chunks.embedding_bin IS 'Вектор эмбеддинга: little-endian float32, embedding_dim * 4 байт';
+
+-- float4send() отдаёт big-endian, поэтому байты каждого элемента переставляются
+CREATE OR REPLACE FUNCTION t_p56134400_telegram_ai_bot_pdf.embedding_json_to_f32le(embedding_json TEXT)
+RETURNS BYTEA
+LANGUAGE SQL
+IMMUTABLE
+AS $$
+    SELECT string_agg(
+        substring(b FROM 4 FOR 1) || substring(b FROM 3 FOR 1) ||
+        substring(b FROM 2 FOR 1) || substring(b FROM 1 FOR 1),
+        ''::bytea ORDER BY ord
+    )
+    FROM (
+        SELECT float4send(e.value::float4) AS b, e.ord
+        FROM json_array_elements_text(embedding_json::json) WITH ORDINALITY AS e(value, ord)
+    ) elements
+$$;
+
+-- Бэкфилл существующих строк
+UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+SET embedding_bin = t_p56134400_telegram_ai_bot_pdf.embedding_json_to_f32le(embedding_text),
+    embedding_dim = json_array_length(embedding_text::json)
+WHERE embedding_text IS NOT NULL AND embedding_bin IS NULL;
+
+UPDATE t_p56134400_telegram_ai_bot_pdf.document_chunks
+SET embedding_bin = t_p56134400_telegram_ai_bot_pdf.embedding_json_to_f32le(embedding_text),
+    embedding_dim = json_array_length(embedding_text::json)
+WHERE embedding_text IS NOT NULL AND embedding_bin IS NULL;
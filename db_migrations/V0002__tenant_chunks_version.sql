@@ -0,0 +1,7 @@
+-- Версия набора чанков тенанта: инвалидирует кэш матриц эмбеддингов в тёплых контейнерах chat.
+-- Увеличивается в process-pdf, delete-pdf, reindex-embeddings и cleanup-embeddings.
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+    ADD COLUMN IF NOT EXISTS chunks_version INTEGER NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_settings.chunks_version IS 'Счётчик изменений tenant_chunks (загрузка/удаление/переиндексация PDF)';
@@ -0,0 +1,15 @@
+-- IVF-индекс (k-means центроиды) для приближённого поиска по чанкам крупных тенантов.
+-- Строится в process-pdf; chat использует его при совпадении chunks_version.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.tenant_ann_index (
+    tenant_id INTEGER PRIMARY KEY,
+    chunks_version INTEGER NOT NULL,
+    n_lists INTEGER NOT NULL,
+    dim INTEGER NOT NULL,
+    centroids BYTEA NOT NULL,
+    chunk_ids BYTEA NOT NULL,
+    assignments BYTEA NOT NULL,
+    built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE t_p56134400_telegram_ai_bot_pdf.tenant_ann_index IS 'IVF-индекс эмбеддингов тенанта: centroids (float32 n_lists x dim), chunk_ids (int64), assignments (int32)';
@@ -0,0 +1,15 @@
+-- Общий (между контейнерами chat) кэш эмбеддингов запросов к Yandex textEmbedding.
+-- cache_key = sha256(modelUri + '\n' + нормализованный enriched_query); TTL проверяется по created_at.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.query_embedding_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    model_uri VARCHAR(255) NOT NULL,
+    embedding_bin BYTEA NOT NULL,
+    embedding_dim INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS query_embedding_cache_created_at_idx
+ON t_p56134400_telegram_ai_bot_pdf.query_embedding_cache(created_at);
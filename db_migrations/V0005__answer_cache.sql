@@ -0,0 +1,22 @@
+-- Семантический кэш ответов chat. Запись действительна только для своей chunks_version тенанта.
+-- Включается в tenant_settings.ai_settings: answer_cache_enabled, answer_cache_threshold.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.answer_cache (
+    id SERIAL PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    chunks_version INTEGER NOT NULL,
+    channel VARCHAR(32) NOT NULL,
+    context_ok BOOLEAN NOT NULL,
+    user_message TEXT NOT NULL,
+    embedding_bin BYTEA NOT NULL,
+    embedding_dim INTEGER NOT NULL,
+    answer TEXT NOT NULL,
+    tokens_used INTEGER NOT NULL DEFAULT 0,
+    latency_ms INTEGER,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS answer_cache_lookup_idx
+ON t_p56134400_telegram_ai_bot_pdf.answer_cache(tenant_id, chunks_version, channel, context_ok);
@@ -0,0 +1,14 @@
+-- Лексический индекс чанков тенанта: постинги токен → [[chunk_id, tf]] и длины документов для BM25.
+-- Строится в process-pdf; chat использует его для гибридного отбора и overlap в quality gate
+-- при совпадении chunks_version.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.tenant_lexical_index (
+    tenant_id INTEGER PRIMARY KEY,
+    chunks_version INTEGER NOT NULL,
+    n_docs INTEGER NOT NULL,
+    postings JSONB NOT NULL,
+    doc_lens JSONB NOT NULL,
+    built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE t_p56134400_telegram_ai_bot_pdf.tenant_lexical_index IS 'BM25-индекс чанков тенанта: postings {token: [[chunk_id, tf]]}, doc_lens [[chunk_id, len]]';
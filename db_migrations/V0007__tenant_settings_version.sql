@@ -0,0 +1,8 @@
+-- Версия настроек тенанта: инвалидирует кэш TenantContext в тёплых контейнерах chat.
+-- Увеличивается в update-ai-settings, update-quality-gate-settings, voice-settings,
+-- manage-api-keys, manage-proxy-settings, manage-formatting-settings и manage-embeddings.
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+    ADD COLUMN IF NOT EXISTS settings_version INTEGER NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_settings.settings_version IS 'Счётчик изменений настроек тенанта (ai_settings, прокси, API ключи, форматирование)';
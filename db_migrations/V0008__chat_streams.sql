@@ -0,0 +1,16 @@
+-- Нарастающий текст ответа для потокового режима веб-виджета.
+-- Пишет chat (POST со streamId), читает chat GET ?stream_id= (Server-Sent Events).
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.chat_streams (
+    stream_id VARCHAR(160) PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    session_id VARCHAR(100) NOT NULL,
+    content TEXT NOT NULL DEFAULT '',
+    final_message TEXT,
+    done BOOLEAN NOT NULL DEFAULT false,
+    error TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_streams_updated_at
+    ON t_p56134400_telegram_ai_bot_pdf.chat_streams (updated_at);
@@ -0,0 +1,15 @@
+-- Предобработка чанков при загрузке: очищенный текст, язык и множество токенов.
+-- Пишет process-pdf (lexical_index.preprocess_chunk), chat читает вместо sanitize/tokenize на запрос.
+-- Бэкфилл существующих строк — на Python (те же регулярки, что в chat): process-pdf дозаполняет
+-- строки тенанта при каждой загрузке документа или по POST {"action": "backfill_chunks"}.
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+    ADD COLUMN IF NOT EXISTS chunk_clean TEXT,
+    ADD COLUMN IF NOT EXISTS chunk_lang VARCHAR(8),
+    ADD COLUMN IF NOT EXISTS chunk_tokens TEXT[],
+    ADD COLUMN IF NOT EXISTS preprocess_version INTEGER;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.chunk_clean IS 'chunk_text после sanitize_chunk, обрезанный до 2200 символов — ровно то, что попадает в контекст';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.chunk_lang IS 'Язык очищенного текста: ru, en или other';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.chunk_tokens IS 'Уникальные токены chunk_clean (без удаления стоп-слов) для overlap в quality gate';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.preprocess_version IS 'Версия правил предобработки (lexical_index.PREPROCESS_VERSION); устаревшие строки пересчитываются бэкфиллом';
@@ -0,0 +1,18 @@
+-- Состояние контроллера стартового top-k quality gate (chat/topk_controller.py), по тенанту.
+-- Заменяет общий для всех тенантов контейнера счётчик low_overlap, терявшийся при холодном старте.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.tenant_topk_state (
+    tenant_id INTEGER PRIMARY KEY,
+    second_pass_rate REAL NOT NULL DEFAULT 0,
+    samples INTEGER NOT NULL DEFAULT 0,
+    since_probe INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_topk_state.second_pass_rate IS 'EWMA доли запросов, которым с базового top-k понадобился расширенный (low_overlap)';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_topk_state.samples IS 'Число запросов, начатых с базового top-k, учтённых в оценке';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_topk_state.since_probe IS 'Запросов подряд со старта на расширенном top-k; на RAG_TOPK_PROBE_EVERY делается проба с базового';
+
+-- Стартовый top-k первой попытки: top_k_used > start_top_k означает второй проход
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_quality_gate_logs
+    ADD COLUMN IF NOT EXISTS start_top_k INTEGER;
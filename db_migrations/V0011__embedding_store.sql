@@ -0,0 +1,24 @@
+-- Хранилище эмбеддингов документов с адресацией по содержимому.
+-- content_hash = sha256(modelUri + '\n' + enriched_text) — без нормализации: совпадает только
+-- побайтно тот же текст той же модели. process-pdf берёт отсюда векторы неизменившихся чанков
+-- вместо вызова textEmbedding. Векторы из резервных копий тенанта сюда не попадают —
+-- они хранятся отдельно, в tenant_imported_embeddings (V0014).
+-- Записи без ссылок из tenant_chunks удаляет cleanup-embeddings после срока хранения.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.embedding_store (
+    content_hash CHAR(64) PRIMARY KEY,
+    model_uri VARCHAR(255) NOT NULL,
+    embedding_bin BYTEA NOT NULL,
+    embedding_dim INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP
+);
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+    ADD COLUMN IF NOT EXISTS embedding_key CHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_tenant_chunks_embedding_key
+    ON t_p56134400_telegram_ai_bot_pdf.tenant_chunks (embedding_key);
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.embedding_key IS 'embedding_store.content_hash вектора чанка (NULL для строк до появления хранилища)';
@@ -0,0 +1,41 @@
+-- Потоковая обработка PDF в process-pdf: документ читается из S3 диапазонами по страницам
+-- и может обрабатываться за несколько вызовов функции.
+-- document_ingest_state — чекпоинт обработки документа: следующая страница, следующий номер
+-- чанка и незавершённый хвост текста чанкера. document_chunk_staging — чанки уже обработанных
+-- страниц с эмбеддингами; после последней страницы они одной транзакцией заменяют чанки
+-- документа в document_chunks/tenant_chunks, до этого chat видит прежний набор.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.document_ingest_state (
+    document_id INTEGER PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    file_etag VARCHAR(128),
+    pages_total INTEGER NOT NULL,
+    next_page INTEGER NOT NULL DEFAULT 0,
+    next_chunk_index INTEGER NOT NULL DEFAULT 0,
+    chunker VARCHAR(32) NOT NULL DEFAULT 'fixed',
+    chunker_state JSONB NOT NULL DEFAULT '{}'::jsonb,
+    invocations INTEGER NOT NULL DEFAULT 0,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.document_ingest_state.file_etag IS 'ETag объекта S3 при старте обработки; если файл заменили, обработка начинается заново';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.document_ingest_state.next_page IS 'Первая страница, которая ещё не попала в document_chunk_staging';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.document_ingest_state.chunker_state IS 'Состояние чанкера на границе next_page (хвост текста, не набравший на чанк)';
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.document_chunk_staging (
+    document_id INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    tenant_id INTEGER NOT NULL,
+    chunk_text TEXT NOT NULL,
+    enriched_text TEXT,
+    embedding_text TEXT,
+    embedding_bin BYTEA,
+    embedding_dim INTEGER,
+    chunk_clean TEXT,
+    chunk_lang VARCHAR(8),
+    chunk_tokens TEXT[],
+    preprocess_version INTEGER,
+    embedding_key CHAR(64),
+    PRIMARY KEY (document_id, chunk_index)
+);
@@ -0,0 +1,14 @@
+-- Стратегия разбиения документов тенанта на чанки (process-pdf/chunker.py).
+-- fixed — срезы по 1000 символов, как раньше; structured — целые абзацы, заголовки и строки
+-- таблиц размером около chunk_target_chars с перекрытием chunk_overlap_chars.
+-- NULL в размерах — значения по умолчанию функции (CHUNK_TARGET_CHARS / CHUNK_OVERLAP_CHARS).
+-- Новая стратегия применяется к документам при следующей обработке (загрузка или переиндексация).
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+    ADD COLUMN IF NOT EXISTS chunking_strategy VARCHAR(32) NOT NULL DEFAULT 'fixed',
+    ADD COLUMN IF NOT EXISTS chunk_target_chars INTEGER,
+    ADD COLUMN IF NOT EXISTS chunk_overlap_chars INTEGER;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_settings.chunking_strategy IS 'Разбиение документов на чанки: fixed или structured';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_settings.chunk_target_chars IS 'Целевой размер чанка structured, символов';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_settings.chunk_overlap_chars IS 'Перекрытие соседних чанков structured, символов';
@@ -0,0 +1,15 @@
+-- Векторы из резервной копии тенанта (import-tenant-backup) — отдельно от общего embedding_store.
+-- Копию присылает администратор тенанта, и вектор в ней не проверить: в копии нет текста чанка.
+-- Поэтому импортированные векторы видны только тому же тенанту: process-pdf берёт их для чанков
+-- этого тенанта, не нашедшихся в embedding_store, и никогда не переносит в общее хранилище.
+-- Записи без ссылок из tenant_chunks тенанта удаляет cleanup-embeddings после срока хранения.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.tenant_imported_embeddings (
+    tenant_id INTEGER NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    model_uri VARCHAR(255) NOT NULL,
+    embedding_bin BYTEA NOT NULL,
+    embedding_dim INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (tenant_id, content_hash)
+);
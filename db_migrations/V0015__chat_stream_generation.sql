@@ -0,0 +1,6 @@
+-- Поколение текста потокового ответа: StreamPublisher.reset() (повтор другим провайдером)
+-- увеличивает его и начинает текст заново. id события SSE — «поколение:смещение»; если
+-- поколение клиента устарело, GET отдаёт событие reset и текст нового поколения с начала.
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.chat_streams
+    ADD COLUMN IF NOT EXISTS generation INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,10 @@
+-- Ответ зависит не только от чанков, но и от промпта, модели и форматирования тенанта.
+-- Запись кэша действительна только для своей пары (chunks_version, settings_version).
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.answer_cache
+    ADD COLUMN IF NOT EXISTS settings_version INTEGER NOT NULL DEFAULT 0;
+
+DROP INDEX IF EXISTS t_p56134400_telegram_ai_bot_pdf.answer_cache_lookup_idx;
+
+CREATE INDEX IF NOT EXISTS answer_cache_lookup_idx
+ON t_p56134400_telegram_ai_bot_pdf.answer_cache(tenant_id, chunks_version, settings_version, channel, context_ok);
@@ -20,11 +20,15 @@ for doc_id in document_ids:
     print(f"📄 Обрабатываю документ ID={doc_id}...", end=" ")
     
     try:
-        response = requests.post(
-            PROCESS_PDF_URL,
-            json={"documentId": doc_id},
-            headers={"Content-Type": "application/json"}
-        )
+        # Большой документ обрабатывается за несколько вызовов, пока status == 'processing'
+        while True:
+            response = requests.post(
+                PROCESS_PDF_URL,
+                json={"documentId": doc_id},
+                headers={"Content-Type": "application/json"}
+            )
+            if response.status_code != 200 or response.json().get("status") != "processing":
+                break
         
         if response.status_code == 200:
             data = response.json()
@@ -12,6 +12,7 @@ interface TenantEmbedding extends Tenant {
   embedding_provider: string;
   embedding_doc_model: string;
   embedding_query_model: string;
+  chunking_strategy: string;
 }
 
 export const EmbeddingsTab = () => {
@@ -22,6 +23,7 @@ export const EmbeddingsTab = () => {
   const [editedProvider, setEditedProvider] = useState('');
   const [editedDocModel, setEditedDocModel] = useState('');
   const [editedQueryModel, setEditedQueryModel] = useState('');
+  const [editedChunking, setEditedChunking] = useState('fixed');
 
   useEffect(() => {
     loadTenants();
@@ -54,6 +56,7 @@ export const EmbeddingsTab = () => {
     setEditedProvider(tenant.embedding_provider);
     setEditedDocModel(tenant.embedding_doc_model);
     setEditedQueryModel(tenant.embedding_query_model);
+    setEditedChunking(tenant.chunking_strategy || 'fixed');
   };
 
   const handleSave = async (tenantId: number) => {
@@ -65,7 +68,8 @@ export const EmbeddingsTab = () => {
           tenant_id: tenantId,
           embedding_provider: editedProvider,
           embedding_doc_model: editedDocModel,
-          embedding_query_model: editedQueryModel
+          embedding_query_model: editedQueryModel,
+          chunking_strategy: editedChunking
         })
       });
 
@@ -127,6 +131,7 @@ export const EmbeddingsTab = () => {
     setEditedProvider('');
     setEditedDocModel('');
     setEditedQueryModel('');
+    setEditedChunking('fixed');
   };
 
   if (isLoading) {
@@ -209,6 +214,19 @@ export const EmbeddingsTab = () => {
                       </Select>
                     </div>
 
+                    <div>
+                      <label className="text-sm font-medium">Разбиение документов на фрагменты</label>
+                      <Select value={editedChunking} onValueChange={setEditedChunking}>
+                        <SelectTrigger>
+                          <SelectValue />
+                        </SelectTrigger>
+                        <SelectContent>
+                          <SelectItem value="fixed">По 1000 символов</SelectItem>
+                          <SelectItem value="structured">По абзацам, заголовкам и строкам таблиц</SelectItem>
+                        </SelectContent>
+                      </Select>
+                    </div>
+
                     {editedProvider === 'yandex' && (
                       <>
                         <div>
@@ -268,7 +286,7 @@ export const EmbeddingsTab = () => {
                     )}
                   </div>
                 ) : (
-                  <div className="grid grid-cols-3 gap-4 pt-2 text-sm">
+                  <div className="grid grid-cols-4 gap-4 pt-2 text-sm">
                     <div>
                       <span className="text-muted-foreground">Провайдер:</span>
                       <p className="font-medium">{tenant.embedding_provider}</p>
@@ -281,6 +299,10 @@ export const EmbeddingsTab = () => {
                       <span className="text-muted-foreground">Модель запросов:</span>
                       <p className="font-medium">{tenant.embedding_query_model}</p>
                     </div>
+                    <div>
+                      <span className="text-muted-foreground">Фрагменты:</span>
+                      <p className="font-medium">{tenant.chunking_strategy || 'fixed'}</p>
+                    </div>
                   </div>
                 )}
               </div>
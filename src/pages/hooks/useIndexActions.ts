@@ -132,6 +132,35 @@ export const useIndexActions = (params: UseIndexActionsParams): IndexActions =>
       window.parent.postMessage({ type: 'USER_MESSAGE_SENT' }, '*');
     }
 
+    // Потоковый ответ: POST генерирует ответ, EventSource по тому же streamId показывает текст по мере генерации
+    const streamId = `${sessionId}-${Date.now()}-${Math.random().toString(36).slice(2, 10)}`;
+    const assistantId = (Date.now() + 1).toString();
+    const upsertAssistant = (content: string) => {
+      setMessages(prev => {
+        const timestamp = new Date().toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' });
+        if (prev.some(m => m.id === assistantId)) {
+          return prev.map(m => (m.id === assistantId ? { ...m, content } : m));
+        }
+        return [...prev, { id: assistantId, role: 'assistant' as const, content, timestamp }];
+      });
+    };
+
+    let streamedText = '';
+    let eventSource: EventSource | null = null;
+    if (typeof EventSource !== 'undefined') {
+      eventSource = new EventSource(`${BACKEND_URLS.chat}?stream_id=${encodeURIComponent(streamId)}`);
+      eventSource.addEventListener('delta', (event) => {
+        streamedText += JSON.parse((event as MessageEvent).data).text;
+        upsertAssistant(streamedText);
+      });
+      // Ответ начат заново другим провайдером — уже показанный текст недействителен
+      eventSource.addEventListener('reset', () => {
+        streamedText = '';
+        upsertAssistant(streamedText);
+      });
+      eventSource.addEventListener('done', () => eventSource?.close());
+    }
+
     try {
       const response = await fetch(BACKEND_URLS.chat, {
         method: 'POST',
@@ -140,25 +169,22 @@ export const useIndexActions = (params: UseIndexActionsParams): IndexActions =>
           message: inputMessage,
           sessionId,
           tenantId: currentTenantId || getTenantId() || 1,
-          channel: 'widget'
+          channel: 'widget',
+          streamId: eventSource ? streamId : undefined
         })
       });
 
       const data = await response.json();
 
       if (response.ok) {
-        const assistantMessage: Message = {
-          id: (Date.now() + 1).toString(),
-          role: 'assistant',
-          content: data.message,
-          timestamp: new Date().toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' })
-        };
-        setMessages(prev => [...prev, assistantMessage]);
+        // Финальный текст уже отформатирован под виджет — заменяет накопленный поток
+        upsertAssistant(data.message);
         
         if (window.parent !== window) {
           window.parent.postMessage({ type: 'USER_MESSAGE_SENT' }, '*');
         }
       } else {
+        setMessages(prev => prev.filter(m => m.id !== assistantId));
         toast({
           title: 'Ошибка',
           description: data.error || 'Не удалось получить ответ',
@@ -166,12 +192,14 @@ export const useIndexActions = (params: UseIndexActionsParams): IndexActions =>
         });
       }
     } catch (error) {
+      setMessages(prev => prev.filter(m => m.id !== assistantId));
       toast({
         title: 'Ошибка',
         description: 'Ошибка сети',
         variant: 'destructive'
       });
     } finally {
+      eventSource?.close();
       setIsLoading(false);
     }
   };
@@ -240,26 +268,30 @@ export const useIndexActions = (params: UseIndexActionsParams): IndexActions =>
         }
 
         const processUrl = tenantId ? `${BACKEND_URLS.processPdf}?tenant_id=${tenantId}` : BACKEND_URLS.processPdf;
-        const processResponse = await authenticatedFetch(processUrl, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ documentId: uploadData.documentId })
-        });
-
+        // Большой PDF обрабатывается порциями страниц: пока status === 'processing', повторяем вызов
+        let processResponse: Response;
         let processData;
-        try {
-          const responseText = await processResponse.text();
-          console.log('[PDF Process] Response text:', responseText);
-          processData = responseText ? JSON.parse(responseText) : {};
-        } catch (parseError) {
-          console.error('[PDF Process] JSON parse error:', parseError);
-          toast({
-            title: `Ошибка при обработке ${file.name}`,
-            description: 'Некорректный ответ сервера',
-            variant: 'destructive'
+        do {
+          processResponse = await authenticatedFetch(processUrl, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ documentId: uploadData.documentId })
           });
-          throw new Error('Invalid server response');
-        }
+
+          try {
+            const responseText = await processResponse.text();
+            console.log('[PDF Process] Response text:', responseText);
+            processData = responseText ? JSON.parse(responseText) : {};
+          } catch (parseError) {
+            console.error('[PDF Process] JSON parse error:', parseError);
+            toast({
+              title: `Ошибка при обработке ${file.name}`,
+              description: 'Некорректный ответ сервера',
+              variant: 'destructive'
+            });
+            throw new Error('Invalid server response');
+          }
+        } while (processResponse.ok && processData.status === 'processing');
 
         if (processResponse.ok) {
           successCount++;